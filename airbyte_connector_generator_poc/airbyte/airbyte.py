@@ -1,53 +1,40 @@
+import asyncio
 from collections import defaultdict
+from typing import Optional
 import json
 import yaml
-import jsonschema
 import os
 import dotenv
-from openai import OpenAI
 from airbyte_connector_generator_poc.logger import logger
+from airbyte_connector_generator_poc.llm import llm
+from airbyte_connector_generator_poc.airbyte.primary_key import guess_primary_key, PRIMARY_KEY_CONFIDENCE_THRESHOLD
+from airbyte_connector_generator_poc.airbyte.pagination import infer_paginator, load_pagination_docs
+from airbyte_connector_generator_poc.airbyte.refs import RefResolver, resolve_json_pointer
+from airbyte_connector_generator_poc.airbyte.validation import validate_airbyte_connector
+from airbyte_connector_generator_poc.prompt_budget import (PromptTooLargeError, count_message_tokens, count_tokens, fit_messages,
+                                                          minify_json, prompt_budget, shrink_json, strip_schema_docs)
+from airbyte_connector_generator_poc.relevance import select_relevant_markdown
+from airbyte_connector_generator_poc.tracing import traced
+from airbyte_connector_generator_poc.utils import dump_yaml
 import re
 
 dotenv.load_dotenv()
-openai = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
 
 AIRBYTE_PATH = os.path.dirname(os.path.realpath(__file__))
 
+PRIMARY_KEY_MODEL = "gpt-3.5-turbo"
+# Most schemas in a single batched primary key request, which is also bound by the model's budget
+PRIMARY_KEY_BATCH_SIZE = 25
 
-def traverse_yaml_dict_ref(yaml_dict: dict, ref: str):
-    if not ref.startswith("#/"):
-        raise ValueError(f"Invalid ref: {ref}")
-
-    ref_parts = ref.split("/")[1:]
 
-    current_level = yaml_dict
-
-    for part in ref_parts:
-        current_level = current_level.get(part)
-        if current_level is None:
-            return None
-
-    return current_level
+def traverse_yaml_dict_ref(yaml_dict: dict, ref: str):
+    return resolve_json_pointer(yaml_dict, ref)
 
 
 def expand_refs(yaml_dict: dict, current_level=None, is_root=True):
-    if is_root and current_level is None:
-        current_level = yaml_dict
-
-    if isinstance(current_level, dict):
-        new_dict = {}
-        for key, value in current_level.items():
-            if key == '$ref':
-                ref_content = traverse_yaml_dict_ref(yaml_dict, value)
-                if ref_content is not None:
-                    new_dict.update(expand_refs(yaml_dict, ref_content, False))
-            else:
-                new_dict[key] = expand_refs(yaml_dict, value, False)
-        return new_dict
-    elif isinstance(current_level, list):
-        return [expand_refs(yaml_dict, item, False) for item in current_level]
-    else:
-        return current_level
+    # Kept for one-off expansions, `generate_airbyte_connector` reuses one resolver for the whole spec
+    resolver = RefResolver(yaml_dict)
+    return resolver.resolve(yaml_dict if is_root and current_level is None else current_level)
 
 
 def derive_authenticator(connection_specification: dict, openapi_spec: dict):
@@ -136,29 +123,186 @@ def derive_params(connection_specification: dict, parameters: list[dict], exclud
     return params
 
 
-def determine_primary_key(response_schema: dict) -> list[str]:
-    response = openai.chat.completions.create(
-        model="gpt-3.5-turbo",
+def primary_key_messages(serialized_schema: str) -> list[dict]:
+    return [
+        {
+            "role": "system",
+            "content": "You are an assistant designed to determine the top schema. Always respond with JSON and put the results under the key \"primary_keys\"",
+        },
+        {
+            "role": "user",
+            "content": f"Given the response schema, what is the primary key? {serialized_schema}"
+        },
+    ]
+
+
+async def determine_primary_key(response_schema: dict) -> list[str]:
+    schema = strip_schema_docs(response_schema)
+
+    def render(max_chars: Optional[int]) -> list[dict]:
+        # If the schema is too large, only its top levels are sent, where the keys are
+        return primary_key_messages(minify_json(schema) if max_chars is None else shrink_json(schema, max_chars))
+
+    content = await llm.chat_completion(
+        model=PRIMARY_KEY_MODEL,
         response_format={"type": "json_object"},
-        messages=[
-            {
-                "role": "system",
-                "content": "You are an assistant designed to determine the top schema. Always respond with JSON and put the results under the key \"primary_keys\"",
-            },
-            {
-                "role": "user",
-                "content": f"Given the response schema, what is the primary key? {json.dumps(response_schema)}"
-            },
-        ],
+        messages=fit_messages(PRIMARY_KEY_MODEL, render),
         temperature=0,
     )
 
-    primary_keys = json.loads(
-        response.choices[0].message.content).get("primary_keys")
+    primary_keys = json.loads(content).get("primary_keys")
 
     return primary_keys
 
 
+def primary_keys_batch_messages(schemas: dict[str, str]) -> list[dict]:
+    schemas_json = ",\n".join(
+        f"{json.dumps(schema_id)}: {serialized_schema}" for schema_id, serialized_schema in schemas.items())
+
+    return [
+        {
+            "role": "system",
+            "content": "You are an assistant designed to determine the primary key of record schemas. You will be given a JSON object mapping schema ids to response schemas. Always respond with JSON and put the results under the key \"primary_keys\", as an object mapping every schema id to its list of primary keys.",
+        },
+        {
+            "role": "user",
+            "content": f"Given the response schemas, what is the primary key of each? {{{schemas_json}}}"
+        },
+    ]
+
+
+def chunk_schemas(schemas: dict[str, str], max_tokens: int,
+                  batch_size: int = PRIMARY_KEY_BATCH_SIZE) -> tuple[list[dict[str, str]], list[str]]:
+    """
+    Pack serialized schemas into batches of at most `batch_size` schemas and `max_tokens`
+    tokens. Returns the batches, and the ids of the schemas too large for any batch.
+    """
+    chunks = []
+    oversized_schema_ids = []
+    chunk = {}
+    chunk_tokens = 0
+
+    for schema_id, serialized_schema in schemas.items():
+        tokens = count_tokens(
+            f"{json.dumps(schema_id)}: {serialized_schema},\n", PRIMARY_KEY_MODEL)
+        if tokens > max_tokens:
+            oversized_schema_ids.append(schema_id)
+            continue
+        if chunk and (len(chunk) >= batch_size or chunk_tokens + tokens > max_tokens):
+            chunks.append(chunk)
+            chunk = {}
+            chunk_tokens = 0
+        chunk[schema_id] = serialized_schema
+        chunk_tokens += tokens
+
+    if chunk:
+        chunks.append(chunk)
+
+    return chunks, oversized_schema_ids
+
+
+async def determine_primary_keys_batch(schemas: dict[str, str]) -> dict[str, list[str]]:
+    content = await llm.chat_completion(
+        model=PRIMARY_KEY_MODEL,
+        response_format={"type": "json_object"},
+        messages=primary_keys_batch_messages(schemas),
+        temperature=0,
+    )
+
+    primary_keys = json.loads(content).get("primary_keys")
+
+    if not isinstance(primary_keys, dict):
+        return {}
+
+    return {schema_id: keys for schema_id, keys in primary_keys.items()
+            if schema_id in schemas and isinstance(keys, list)}
+
+
+@traced()
+async def determine_primary_keys(result_schemas: dict[str, dict]) -> tuple[dict[str, list[str]], dict[str, str]]:
+    """
+    Determine the primary keys of many streams with as few requests as possible.
+    Obvious keys are found locally, and only the ambiguous schemas are sent to the LLM:
+    identical schemas once, and the rest batched into chunked requests.
+
+    Returns the primary keys by stream, and how each was determined (`heuristic` or `llm`).
+    """
+    primary_keys_by_stream = {}
+    source_by_stream = {}
+    guesses_by_stream = {}
+    schema_id_by_serialized = {}
+    schema_id_by_stream = {}
+
+    for stream_name, result_schema in result_schemas.items():
+        primary_key, confidence = guess_primary_key(result_schema, stream_name)
+        if primary_key and confidence >= PRIMARY_KEY_CONFIDENCE_THRESHOLD:
+            logger.debug("Primary key of %s: %s (heuristic, confidence %.2f)",
+                         stream_name, primary_key, confidence)
+            primary_keys_by_stream[stream_name] = primary_key
+            source_by_stream[stream_name] = "heuristic"
+            continue
+        guesses_by_stream[stream_name] = primary_key
+
+        # Descriptions don't help finding keys, and without them more schemas are identical
+        serialized_schema = minify_json(strip_schema_docs(result_schema))
+        if serialized_schema not in schema_id_by_serialized:
+            schema_id = f"schema_{len(schema_id_by_serialized)}"
+            schema_id_by_serialized[serialized_schema] = schema_id
+        schema_id_by_stream[stream_name] = schema_id_by_serialized[serialized_schema]
+
+    if not schema_id_by_stream:
+        return primary_keys_by_stream, source_by_stream
+
+    schemas = {schema_id: serialized_schema for serialized_schema,
+               schema_id in schema_id_by_serialized.items()}
+    # What's left of the budget once the batch prompt itself is counted
+    batch_budget = prompt_budget(PRIMARY_KEY_MODEL) - \
+        count_message_tokens(primary_keys_batch_messages({}), PRIMARY_KEY_MODEL)
+    chunks, oversized_schema_ids = chunk_schemas(schemas, batch_budget)
+
+    logger.debug("Determining primary keys of %d streams (%d unique schemas) in %d request(s)",
+                 len(schema_id_by_stream), len(schemas), len(chunks) + len(oversized_schema_ids))
+
+    primary_keys_by_schema_id = {}
+    for batch_result in await asyncio.gather(*[determine_primary_keys_batch(chunk) for chunk in chunks]):
+        primary_keys_by_schema_id.update(batch_result)
+
+    async def ask_primary_key(schema_id: str) -> Optional[list[str]]:
+        try:
+            return await determine_primary_key(json.loads(schemas[schema_id]))
+        except PromptTooLargeError as e:
+            logger.debug("Can't ask for the primary key of %s: %s", schema_id, e)
+            return None
+
+    # Ask for schemas too large to batch, and the ones the batch answers skipped, one by one
+    missing_schema_ids = [
+        schema_id for schema_id in schemas if schema_id not in primary_keys_by_schema_id]
+    if missing_schema_ids:
+        logger.debug("Asking for %d schema(s) individually, %d too large to batch",
+                     len(missing_schema_ids), len(oversized_schema_ids))
+        missing_primary_keys = await asyncio.gather(
+            *[ask_primary_key(schema_id) for schema_id in missing_schema_ids])
+        primary_keys_by_schema_id.update(
+            (schema_id, primary_keys) for schema_id, primary_keys in zip(missing_schema_ids, missing_primary_keys)
+            if primary_keys is not None)
+
+    for stream_name, schema_id in schema_id_by_stream.items():
+        if schema_id not in primary_keys_by_schema_id:
+            # The best guess, however unsure, rather than failing the connector
+            primary_key = guesses_by_stream[stream_name] or []
+            logger.debug("Primary key of %s: %s (heuristic fallback)",
+                         stream_name, primary_key)
+            primary_keys_by_stream[stream_name] = primary_key
+            source_by_stream[stream_name] = "heuristic"
+            continue
+        logger.debug("Primary key of %s: %s (llm)", stream_name,
+                     primary_keys_by_schema_id[schema_id])
+        primary_keys_by_stream[stream_name] = primary_keys_by_schema_id[schema_id]
+        source_by_stream[stream_name] = "llm"
+
+    return primary_keys_by_stream, source_by_stream
+
+
 def determine_top_level_props(response_schema: dict) -> list[str]:
     root_type = response_schema.get("type")
 
@@ -171,80 +315,115 @@ def determine_top_level_props(response_schema: dict) -> list[str]:
     return ["*"]
 
 
-def determine_paginator(connection_specification: dict, parameters: dict, request_body_schema: dict, response_schema: dict) -> dict:
-    docs_content = []
+@traced()
+async def determine_paginator(connection_specification: dict, parameters: dict, request_body_schema: dict, response_schema: dict,
+                              response_headers: dict = None) -> dict:
+    paginator = infer_paginator(
+        parameters, request_body_schema, response_schema, response_headers)
 
-    with open(os.path.join(AIRBYTE_PATH, "pagination_yaml.md"), "r") as f:
-        docs_content.append(f.read())
+    if paginator is not None:
+        logger.debug("Paginator inferred from rules: %s",
+                     json.dumps(paginator))
+    else:
+        logger.debug("No known pagination pattern, asking the LLM")
+        paginator = await ask_paginator(parameters, request_body_schema, response_schema)
 
-    with open(os.path.join(AIRBYTE_PATH, "pagination.md"), "r") as f:
-        docs_content.append(f.read())
+    if "pagination_strategy" not in paginator:
+        return paginator
 
-    response = openai.chat.completions.create(
-        model="gpt-4-turbo-preview",
-        response_format={"type": "json_object"},
-        messages=[
+    if paginator.get("pagination_strategy", {}).get("page_size") is None:
+        page_size = 100
+
+        if paginator.get("pagination_strategy", {}).get("type") == "OffsetIncrement":
+            connection_specification["properties"]["page_size"] = {
+                "type": "integer",
+                "title": "Page Size",
+            }
+            connection_specification["required"].append("page_size")
+            page_size = "{{ config['page_size'] }}"
+
+        paginator["pagination_strategy"]["page_size"] = page_size
+
+    return paginator
+
+
+def field_names(value) -> list[str]:
+    # Names of the parameters and properties of an endpoint, e.g `cursor` or `next_page`
+    names = []
+    if isinstance(value, dict):
+        if isinstance(value.get("name"), str):
+            names.append(value["name"])
+        for key, item in value.items():
+            if key == "properties" and isinstance(item, dict):
+                names.extend(item.keys())
+            names.extend(field_names(item))
+    elif isinstance(value, list):
+        for item in value:
+            names.extend(field_names(item))
+    return names
+
+
+async def ask_paginator(parameters: dict, request_body_schema: dict, response_schema: dict) -> dict:
+    model = "gpt-4-turbo-preview"
+    pagination_docs = load_pagination_docs()
+    query = " ".join(field_names(
+        [parameters, request_body_schema, response_schema]))
+
+    def render(max_chars: Optional[int]) -> list[dict]:
+        # If the prompt is too large, only the docs sections closest to the endpoint's fields are kept
+        docs = pagination_docs if max_chars is None else select_relevant_markdown(
+            pagination_docs, query, top_k=None, max_tokens=max_chars // 4, always_kept_pattern=None)
+
+        return [
             {"role": "system", "content": f"""
                 You are an expert data engineer working for Airbyte, specialised in writing low-code YAML paginators.
-                Here is the official documentation for paginators: {"\n".join(docs_content)}.
+                Here is the official documentation for paginators: {docs}.
                 Always respond with JSON and put the results under the key \"paginator\"!
             """},
             {
                 "role": "user",
                 "content": f"""Given the request params, request body and response schema, what is the paginator?
                 Request Parameters:
-                {json.dumps(parameters)}
+                {minify_json(parameters)}
 
                 Request Body:
-                {json.dumps(request_body_schema)}
+                {minify_json(request_body_schema)}
 
                 Response:
-                {json.dumps(response_schema)}
+                {minify_json(response_schema)}
                 """
             },
-        ],
-        temperature=0,
-    )
-
-    paginator = json.loads(
-        response.choices[0].message.content).get("paginator")
+        ]
 
-    if "pagination_strategy" not in paginator:
-        return paginator
-
-    if paginator.get("pagination_strategy", {}).get("page_size") is None:
-        page_size = 100
-
-        if paginator.get("pagination_strategy", {}).get("type") == "OffsetIncrement":
-            connection_specification["properties"]["page_size"] = {
-                "type": "integer",
-                "title": "Page Size",
-            }
-            connection_specification["required"].append("page_size")
-            page_size = "{{ config['page_size'] }}"
+    messages = fit_messages(model, render)
 
-        paginator["pagination_strategy"]["page_size"] = page_size
+    content = await llm.chat_completion(
+        model=model,
+        response_format={"type": "json_object"},
+        messages=messages,
+        temperature=0,
+    )
 
-    return paginator
+    return json.loads(content).get("paginator")
 
 
-def get_request_body_schema(openapi_spec: dict, resource: dict) -> dict:
-    return expand_refs(openapi_spec, resource
-                       .get("requestBody", {})
-                       .get("content", {})
-                       .get("application/json", {})
-                       .get("schema", {})
-                       )
+def get_request_body_schema(resolver: RefResolver, resource: dict) -> dict:
+    return resolver.resolve(resource
+                            .get("requestBody", {})
+                            .get("content", {})
+                            .get("application/json", {})
+                            .get("schema", {})
+                            )
 
 
-def get_response_schema(openapi_spec: dict, resource: dict) -> dict:
-    return expand_refs(openapi_spec, resource
-                       .get("responses", {})
-                       .get("200", {})
-                       .get("content", {})
-                       .get("application/json", {})
-                       .get("schema", {})
-                       )
+def get_response_schema(resolver: RefResolver, resource: dict) -> dict:
+    return resolver.resolve(resource
+                            .get("responses", {})
+                            .get("200", {})
+                            .get("content", {})
+                            .get("application/json", {})
+                            .get("schema", {})
+                            )
 
 
 def group_paginator_by_inject_into(paginator: dict) -> dict:
@@ -337,7 +516,7 @@ def derive_url_base(connection_specification: dict, openapi_spec: dict) -> str:
     return url_base
 
 
-def generate_airbyte_connector(openapi_spec: str) -> dict:
+async def generate_airbyte_connector(openapi_spec: str) -> dict:
     connection_specification = {
         "required": [],
         "properties": {},
@@ -355,42 +534,14 @@ def generate_airbyte_connector(openapi_spec: str) -> dict:
         openapi_spec=openapi_spec
     )
 
-    paginator = determine_paginator(
-        connection_specification=connection_specification,
-        parameters=expand_refs(
-            openapi_spec, first_resource.get("parameters", [])),
-        request_body_schema=get_request_body_schema(
-            openapi_spec, first_resource),
-        response_schema=get_response_schema(openapi_spec, first_resource),
-    )
-
-    banned_params = group_paginator_by_inject_into(paginator)
+    # Every component is expanded once, however many operations reference it
+    resolver = RefResolver(openapi_spec)
 
-    streams = []
+    resources = []
 
     for path, methods in openapi_spec.get("paths", {}).items():
         for method, resource in methods.items():
-            name = f"{path}_{method}"
-            parameters = expand_refs(
-                openapi_spec, resource.get("parameters", []))
-            response_schema = get_response_schema(openapi_spec, resource)
-            request_body_schema = get_request_body_schema(
-                openapi_spec, resource)
-
-            request_params = {"query": {}, "header": {}, "path": {}}
-
-            for param_type in request_params.keys():
-                request_params[param_type] = derive_params(
-                    connection_specification=connection_specification,
-                    parameters=[
-                        param for param in parameters if param["in"] == param_type],
-                    excluded=banned_params.get(param_type, [])
-                )
-
-            for param, value in request_params["path"].items():
-                path = path.replace(
-                    f"{{{param}}}", value)
-
+            response_schema = get_response_schema(resolver, resource)
             top_level_properties = determine_top_level_props(response_schema)
 
             result_schema = {}
@@ -403,42 +554,88 @@ def generate_airbyte_connector(openapi_spec: str) -> dict:
                     result_schema[key] = response_schema.get(
                         "properties", {}).get(key)
 
-            primary_key = determine_primary_key(result_schema)
+            resources.append(
+                (f"{path}_{method}", path, method, resource, top_level_properties, result_schema))
+
+    # The paginator and primary keys don't depend on each other, so the LLM calls run concurrently
+    paginator, (primary_keys, primary_key_sources) = await asyncio.gather(
+        determine_paginator(
+            connection_specification=connection_specification,
+            parameters=resolver.resolve(first_resource.get("parameters", [])),
+            request_body_schema=get_request_body_schema(
+                resolver, first_resource),
+            response_schema=get_response_schema(resolver, first_resource),
+            response_headers=resolver.resolve(first_resource
+                                              .get("responses", {})
+                                              .get("200", {})
+                                              .get("headers", {})),
+        ),
+        determine_primary_keys(
+            {name: result_schema for name, *_, result_schema in resources})
+    )
+
+    logger.debug("Primary keys determined by heuristic: %d, by LLM: %d",
+                 list(primary_key_sources.values()).count("heuristic"),
+                 list(primary_key_sources.values()).count("llm"))
+
+    banned_params = group_paginator_by_inject_into(paginator)
+
+    streams = []
 
-            body_json = map_request_body(
+    for name, path, method, resource, top_level_properties, _ in resources:
+        primary_key = primary_keys[name]
+        parameters = resolver.resolve(resource.get("parameters", []))
+        request_body_schema = get_request_body_schema(
+            resolver, resource)
+
+        request_params = {"query": {}, "header": {}, "path": {}}
+
+        for param_type in request_params.keys():
+            request_params[param_type] = derive_params(
                 connection_specification=connection_specification,
-                banned_params=banned_params,
-                data=request_body_schema
+                parameters=[
+                    param for param in parameters if param["in"] == param_type],
+                excluded=banned_params.get(param_type, [])
             )
 
-            stream = {
-                "name": name,
-                "primary_key": primary_key,
-                "type": "DeclarativeStream",
-                "retriever": {
-                    "type": "SimpleRetriever",
-                    "record_selector": {
-                        "type": "RecordSelector",
-                        "extractor": {
-                            "type": "DpathExtractor",
-                            "field_path": top_level_properties,
-                        },
+        for param, value in request_params["path"].items():
+            path = path.replace(
+                f"{{{param}}}", value)
+
+        body_json = map_request_body(
+            connection_specification=connection_specification,
+            banned_params=banned_params,
+            data=request_body_schema
+        )
+
+        stream = {
+            "name": name,
+            "primary_key": primary_key,
+            "type": "DeclarativeStream",
+            "retriever": {
+                "type": "SimpleRetriever",
+                "record_selector": {
+                    "type": "RecordSelector",
+                    "extractor": {
+                        "type": "DpathExtractor",
+                        "field_path": top_level_properties,
                     },
-                    "paginator": paginator if paginator else {"type": "NoPagination"},
-                    "requester": {
-                        "authenticator": authenticator,
-                        "http_method": method.upper(),
-                        "path": path,
-                        "type": "HttpRequester",
-                        "url_base": url_base,
-                        "request_parameters": request_params["query"],
-                        "request_headers": request_params["header"],
-                        "request_body_json": body_json
-                    }
+                },
+                "paginator": paginator if paginator else {"type": "NoPagination"},
+                "requester": {
+                    "authenticator": authenticator,
+                    "http_method": method.upper(),
+                    "path": path,
+                    "type": "HttpRequester",
+                    "url_base": url_base,
+                    "request_parameters": request_params["query"],
+                    "request_headers": request_params["header"],
+                    "request_body_json": body_json
                 }
             }
+        }
 
-            streams.append(stream)
+        streams.append(stream)
 
     connector_yaml = {
         "streams": streams,
@@ -457,24 +654,13 @@ def generate_airbyte_connector(openapi_spec: str) -> dict:
     return connector_yaml
 
 
-def validate_airbyte_connector(connector: dict):
-    with open(os.path.join(AIRBYTE_PATH, "airbyte_schema.yaml"), "r") as file:
-        airbyte_schema = yaml.safe_load(file)
-
-    try:
-        jsonschema.validators.validate(connector, airbyte_schema)
-        return True, None
-    except jsonschema.exceptions.ValidationError as e:
-        return False, e
-
-
 if __name__ == "__main__":
     with open("openapi.yaml", "r") as file:
         openapi_spec = yaml.safe_load(file)
 
-    airbyte_connector = generate_airbyte_connector(openapi_spec)
+    airbyte_connector = asyncio.run(generate_airbyte_connector(openapi_spec))
 
     with open("airbyte_connector.yaml", "w") as file:
-        yaml.safe_dump(airbyte_connector, file)
+        dump_yaml(airbyte_connector, file)
 
     validate_airbyte_connector(airbyte_connector)
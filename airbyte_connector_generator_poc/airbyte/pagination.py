@@ -0,0 +1,214 @@
+import functools
+import os
+import re
+from typing import Optional
+
+AIRBYTE_PATH = os.path.dirname(os.path.realpath(__file__))
+
+# Request fields, compared after normalization (lowercase, without `_`/`-`)
+CURSOR_REQUEST_FIELDS = ["cursor", "startcursor", "startingafter", "after", "pagetoken",
+                         "nextpagetoken", "nexttoken", "continuationtoken", "nextcursor", "pagecursor"]
+OFFSET_REQUEST_FIELDS = ["offset", "skip", "start", "startindex"]
+PAGE_REQUEST_FIELDS = ["page", "pagenumber", "pagenum", "pageindex"]
+PAGE_SIZE_REQUEST_FIELDS = ["limit", "pagesize", "perpage", "size", "count", "maxresults",
+                            "top", "pagelimit", "resultsperpage"]
+
+# Response fields
+CURSOR_RESPONSE_FIELDS = ["nextcursor", "nextpagetoken", "nexttoken", "cursor", "endcursor",
+                          "continuationtoken", "after", "nextpagecursor"]
+HAS_MORE_RESPONSE_FIELDS = ["hasmore", "hasnext", "hasnextpage", "more", "morepages"]
+NEXT_URL_RESPONSE_FIELDS = ["next", "nexturl", "nextpage",
+                            "nextpageurl", "nextlink", "odatanextlink"]
+# Objects commonly wrapping pagination metadata
+PAGINATION_CONTAINERS = ["meta", "metadata", "pagination", "paging", "pageinfo",
+                         "links", "cursor", "cursors", "responsemetadata"]
+
+# Generic names that are as often filters, e.g a `count` or a `start` date, only trusted
+# as integer request fields...
+INTEGER_ONLY_REQUEST_FIELDS = ["count", "size", "top", "start"]
+# ...as request cursors that aren't dates...
+DATE_FORMATS = ["date", "date-time"]
+# ...and as response fields within a pagination metadata object
+CONTAINED_ONLY_RESPONSE_FIELDS = ["more", "after"]
+
+# Used when the page size parameter has neither a maximum nor a default
+DEFAULT_PAGE_SIZE = 100
+
+
+@functools.lru_cache(maxsize=None)
+def load_pagination_docs() -> str:
+    docs_content = []
+
+    with open(os.path.join(AIRBYTE_PATH, "pagination_yaml.md"), "r") as f:
+        docs_content.append(f.read())
+
+    with open(os.path.join(AIRBYTE_PATH, "pagination.md"), "r") as f:
+        docs_content.append(f.read())
+
+    return "\n".join(docs_content)
+
+
+def normalize_field(name: str) -> str:
+    return re.sub(r"[^a-z0-9]", "", str(name).lower())
+
+
+def is_request_field_candidate(candidate: str, schema: dict) -> bool:
+    if candidate in INTEGER_ONLY_REQUEST_FIELDS:
+        return schema.get("type") == "integer"
+    return schema.get("format") not in DATE_FORMATS
+
+
+def find_request_field(parameters: list[dict], request_body_schema: dict, candidates: list[str]) -> Optional[dict]:
+    """
+    Find a request field by name among the query parameters and the request body.
+    Returns a `RequestOption` injecting into that field.
+    """
+    for candidate in candidates:
+        for param in parameters:
+            schema = param.get("schema") or {}
+            if param.get("in") == "query" and normalize_field(param.get("name")) == candidate \
+                    and is_request_field_candidate(candidate, schema):
+                return {"type": "RequestOption", "inject_into": "request_parameter", "field_name": param["name"], "schema": schema}
+
+        for name, schema in (request_body_schema or {}).get("properties", {}).items():
+            schema = schema or {}
+            if normalize_field(name) == candidate and is_request_field_candidate(candidate, schema):
+                return {"type": "RequestOption", "inject_into": "body_json", "field_name": name, "schema": schema}
+
+    return None
+
+
+def find_response_field(response_schema: dict, candidates: list[str], types: list[str],
+                        in_container: bool = False) -> Optional[list[str]]:
+    """
+    Find a field by name at the root of the response or in a pagination metadata object.
+    Returns the path to the field.
+    """
+    properties = (response_schema or {}).get("properties", {})
+
+    for candidate in candidates:
+        if candidate in CONTAINED_ONLY_RESPONSE_FIELDS and not in_container:
+            continue
+        for name, schema in properties.items():
+            if normalize_field(name) == candidate and (schema or {}).get("type") in types:
+                return [name]
+
+    for container_name, container_schema in properties.items():
+        if normalize_field(container_name) not in PAGINATION_CONTAINERS:
+            continue
+        path = find_response_field(
+            container_schema, candidates, types, in_container=True)
+        if path:
+            return [container_name, *path]
+
+    return None
+
+
+def response_expression(path: list[str]) -> str:
+    return "response" + "".join(f"['{key}']" for key in path)
+
+
+def request_option(field: dict) -> dict:
+    return {key: value for key, value in field.items() if key != "schema"}
+
+
+def page_size(field: dict) -> int:
+    # As large as the API allows, for as few requests as possible
+    schema = field["schema"]
+    for key in ["maximum", "default"]:
+        value = schema.get(key)
+        if isinstance(value, int) and not isinstance(value, bool) and value > 0:
+            return value
+    return DEFAULT_PAGE_SIZE
+
+
+def has_link_header(response_headers: Optional[dict]) -> bool:
+    return any(normalize_field(name) == "link" for name in (response_headers or {}))
+
+
+def infer_paginator(parameters: list[dict], request_body_schema: dict, response_schema: dict,
+                    response_headers: Optional[dict] = None) -> Optional[dict]:
+    """
+    Recognize common pagination patterns from the request fields and response schema.
+    Returns an Airbyte `DefaultPaginator`, or `None` if no pattern matches.
+    """
+    page_size_field = find_request_field(
+        parameters, request_body_schema, PAGE_SIZE_REQUEST_FIELDS)
+
+    paginator = None
+
+    cursor_field = find_request_field(
+        parameters, request_body_schema, CURSOR_REQUEST_FIELDS)
+    cursor_path = find_response_field(
+        response_schema, CURSOR_RESPONSE_FIELDS, ["string", "integer", None])
+    next_url_path = find_response_field(
+        response_schema, NEXT_URL_RESPONSE_FIELDS, ["string"])
+    has_more_path = find_response_field(
+        response_schema, HAS_MORE_RESPONSE_FIELDS, ["boolean"])
+
+    if has_link_header(response_headers):
+        paginator = {
+            "type": "DefaultPaginator",
+            "pagination_strategy": {
+                "type": "CursorPagination",
+                "cursor_value": "{{ headers['link']['next']['url'] }}",
+                "stop_condition": "{{ 'next' not in headers['link'] }}",
+            },
+            "page_token_option": {"type": "RequestPath"},
+        }
+    elif cursor_field and cursor_path:
+        stop_path = has_more_path or cursor_path
+        paginator = {
+            "type": "DefaultPaginator",
+            "pagination_strategy": {
+                "type": "CursorPagination",
+                "cursor_value": f"{{{{ {response_expression(cursor_path)} }}}}",
+                "stop_condition": f"{{{{ not {response_expression(stop_path)} }}}}",
+            },
+            "page_token_option": request_option(cursor_field),
+        }
+    elif next_url_path and not cursor_field:
+        paginator = {
+            "type": "DefaultPaginator",
+            "pagination_strategy": {
+                "type": "CursorPagination",
+                "cursor_value": f"{{{{ {response_expression(next_url_path)} }}}}",
+                "stop_condition": f"{{{{ not {response_expression(next_url_path)} }}}}",
+            },
+            "page_token_option": {"type": "RequestPath"},
+        }
+    else:
+        offset_field = find_request_field(
+            parameters, request_body_schema, OFFSET_REQUEST_FIELDS)
+        page_field = find_request_field(
+            parameters, request_body_schema, PAGE_REQUEST_FIELDS)
+
+        if offset_field and page_size_field:
+            paginator = {
+                "type": "DefaultPaginator",
+                "pagination_strategy": {"type": "OffsetIncrement"},
+                "page_token_option": request_option(offset_field),
+            }
+        elif page_field:
+            page_schema = page_field["schema"]
+            start_from_page = page_schema.get(
+                "minimum", page_schema.get("default", 1))
+            paginator = {
+                "type": "DefaultPaginator",
+                "pagination_strategy": {
+                    "type": "PageIncrement",
+                    "start_from_page": start_from_page if isinstance(start_from_page, int) else 1,
+                },
+                "page_token_option": request_option(page_field),
+            }
+
+    if paginator is None:
+        return None
+
+    if page_size_field:
+        # The page size option is only sent along with a page size
+        paginator["pagination_strategy"]["page_size"] = page_size(
+            page_size_field)
+        paginator["page_size_option"] = request_option(page_size_field)
+
+    return paginator
@@ -0,0 +1,114 @@
+import re
+from typing import Optional
+
+# Scores above this are trusted without asking the LLM
+PRIMARY_KEY_CONFIDENCE_THRESHOLD = 0.8
+# ...as long as the runner-up is at least this far behind
+PRIMARY_KEY_MIN_MARGIN = 0.15
+
+KEY_TYPES = ["string", "integer", None]
+EXACT_NAME_SCORES = {
+    "id": 1.0,
+    "uuid": 0.9,
+    "guid": 0.9,
+    "_id": 0.9,
+    "key": 0.5,
+    "slug": 0.4,
+}
+
+
+def find_record_properties(schema: dict, depth: int = 0) -> dict:
+    """
+    Find the properties of a single record in a result schema, which is either a
+    response schema or `{<records property>: <schema>}`.
+    """
+    if not isinstance(schema, dict) or depth > 3:
+        return {}
+
+    if schema.get("type") == "array":
+        return find_record_properties(schema.get("items", {}), depth + 1)
+
+    properties = schema.get("properties")
+    if isinstance(properties, dict):
+        return properties
+
+    # `{<records property>: <schema>}` as built from determine_top_level_props
+    if len(schema) == 1:
+        return find_record_properties(next(iter(schema.values())), depth + 1)
+
+    return {}
+
+
+def resource_name_from_stream(stream_name: str) -> Optional[str]:
+    path = stream_name.rsplit("_", 1)[0]
+    segments = [segment for segment in path.split("/")
+                if segment and not segment.startswith("{")]
+    if not segments:
+        return None
+    name = re.sub(r"[^a-z0-9]+", "_", segments[-1].lower()).strip("_")
+    # Good enough singularization for resource names
+    if name.endswith("ies"):
+        return name[:-3] + "y"
+    if name.endswith("s") and not name.endswith("ss"):
+        return name[:-1]
+    return name
+
+
+def normalize_name(name: str) -> str:
+    # `userId`, `user-id` and `user_id` are the same key
+    return re.sub(r"(?<=[a-z0-9])(?=[A-Z])", "_", name).replace("-", "_").lower()
+
+
+def score_key_candidate(name: str, schema: dict, resource_name: Optional[str]) -> float:
+    if not isinstance(schema, dict) or schema.get("type") not in KEY_TYPES:
+        return 0.0
+
+    normalized = normalize_name(name)
+    score = EXACT_NAME_SCORES.get(normalized, 0.0)
+
+    if resource_name and normalized in [f"{resource_name}_id", f"{resource_name}_uuid", f"{resource_name}_key"]:
+        score = max(score, 0.9)
+    elif normalized.endswith("_id"):
+        # Could just as well be a foreign key
+        score = max(score, 0.4)
+
+    if schema.get("format") == "uuid":
+        if score >= 0.9:
+            score += 0.2
+        else:
+            # Any other uuid is as likely to reference another record
+            score = max(score, 0.4)
+
+    description = str(schema.get("description", "")).lower()
+    if "unique identifier" in description or "primary key" in description:
+        score += 0.2
+
+    if schema.get("nullable"):
+        score -= 0.3
+
+    return min(score, 1.0)
+
+
+def guess_primary_key(result_schema: dict, stream_name: str = "") -> tuple[Optional[list[str]], float]:
+    """
+    Guess the primary key of a stream from its result schema without the LLM.
+    Returns the key and a confidence between 0 and 1, or `None` if there is no candidate.
+    """
+    properties = find_record_properties(result_schema)
+    resource_name = resource_name_from_stream(stream_name)
+
+    scores = sorted(((score_key_candidate(name, schema, resource_name), name)
+                     for name, schema in properties.items()), reverse=True)
+    scores = [(score, name) for score, name in scores if score > 0]
+
+    if not scores:
+        return None, 0.0
+
+    best_score, best_name = scores[0]
+    runner_up_score = scores[1][0] if len(scores) > 1 else 0.0
+
+    confidence = best_score
+    if best_score - runner_up_score < PRIMARY_KEY_MIN_MARGIN:
+        confidence = min(confidence, PRIMARY_KEY_CONFIDENCE_THRESHOLD - 0.01)
+
+    return [best_name], confidence
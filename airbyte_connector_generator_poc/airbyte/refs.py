@@ -0,0 +1,104 @@
+from urllib.parse import unquote
+
+# Nested refs expanded at most, deeper ones are stubbed to bound the expansion (and the stack)
+MAX_REF_DEPTH = 64
+
+
+def resolve_json_pointer(document, ref: str):
+    """
+    Resolve a local JSON reference like `#/components/schemas/User` in `document`,
+    with `~1`/`~0` escapes, percent-encoding and array indexes (RFC 6901).
+    Returns `None` if nothing is found at the pointer.
+    """
+    if not ref.startswith("#"):
+        raise ValueError(f"Invalid ref: {ref}")
+
+    pointer = unquote(ref[1:])
+    if pointer == "":
+        return document
+    if not pointer.startswith("/"):
+        raise ValueError(f"Invalid ref: {ref}")
+
+    current_level = document
+
+    for part in pointer.split("/")[1:]:
+        part = part.replace("~1", "/").replace("~0", "~")
+
+        if isinstance(current_level, dict):
+            current_level = current_level.get(part)
+        elif isinstance(current_level, list) and part.isdigit() and int(part) < len(current_level):
+            current_level = current_level[int(part)]
+        else:
+            return None
+
+        if current_level is None:
+            return None
+
+    return current_level
+
+
+def ref_stub(ref: str, target, reason: str) -> dict:
+    # Stands in for a schema that contains itself, e.g the children of a tree node
+    return {"type": target.get("type", "object") if isinstance(target, dict) else "object",
+            "description": f"{reason} {ref}"}
+
+
+class RefResolver():
+    """
+    Expands the `$ref`s of a spec, built once per spec.
+
+    Every ref is expanded once and memoized, so the expanded subtree of a component
+    is shared by every place referencing it and expanded values must be treated as
+    read-only, and dumped with `dump_yaml` to be written out without anchors. A ref met
+    again while it's being expanded, or nested deeper than `MAX_REF_DEPTH`, is replaced
+    by a stub so recursive schemas stay bounded. The stub stays where the ref first
+    repeated in the memoized expansion.
+    """
+
+    def __init__(self, document: dict):
+        self.document = document
+        self._memo = {}
+        self._in_progress = set()
+
+    def resolve(self, value):
+        if isinstance(value, dict):
+            if len(value) == 1 and "$ref" in value:
+                # Shared as is, no copy
+                return self._resolve_ref(value["$ref"])
+
+            resolved = {}
+            for key, item in value.items():
+                if key == "$ref":
+                    ref_content = self._resolve_ref(item)
+                    if ref_content is not None:
+                        resolved.update(ref_content)
+                else:
+                    resolved[key] = self.resolve(item)
+            return resolved
+        elif isinstance(value, list):
+            return [self.resolve(item) for item in value]
+        else:
+            return value
+
+    def _resolve_ref(self, ref: str):
+        if ref in self._memo:
+            return self._memo[ref]
+
+        target = resolve_json_pointer(self.document, ref)
+        if target is None:
+            return {}
+
+        if ref in self._in_progress:
+            return ref_stub(ref, target, "Circular reference to")
+        if len(self._in_progress) >= MAX_REF_DEPTH:
+            # Not memoized itself, the ref is expanded in full where it's less deeply nested
+            return ref_stub(ref, target, "Too deeply nested reference to")
+
+        self._in_progress.add(ref)
+        try:
+            resolved = self.resolve(target)
+        finally:
+            self._in_progress.discard(ref)
+
+        self._memo[ref] = resolved
+        return resolved
@@ -0,0 +1,99 @@
+import functools
+import hashlib
+import json
+import os
+from typing import TYPE_CHECKING, Iterator
+import yaml
+from airbyte_connector_generator_poc.logger import logger
+
+if TYPE_CHECKING:
+    import jsonschema
+
+AIRBYTE_PATH = os.path.dirname(os.path.realpath(__file__))
+AIRBYTE_SCHEMA_YAML_PATH = os.path.join(AIRBYTE_PATH, "airbyte_schema.yaml")
+# Precompiled from the YAML schema, which is slow to parse.
+# Regenerate with `python -m airbyte_connector_generator_poc.airbyte.validation`
+AIRBYTE_SCHEMA_JSON_PATH = os.path.join(AIRBYTE_PATH, "airbyte_schema.json")
+
+# The C loader is an order of magnitude faster when PyYAML is built with libyaml
+YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+
+class InvalidAirbyteConnectorError(Exception):
+    """
+    A generated connector doesn't validate against the Airbyte schema, `errors` are
+    every violation with its path.
+    """
+
+    def __init__(self, error: "jsonschema.exceptions.ValidationError", errors: list[str]):
+        super().__init__(
+            f"Airbyte connector is invalid, {len(errors)} error(s): {format_validation_error(error)}")
+        self.error = error
+        self.errors = errors
+
+
+def schema_source_hash() -> str:
+    with open(AIRBYTE_SCHEMA_YAML_PATH, "rb") as file:
+        return hashlib.sha256(file.read()).hexdigest()
+
+
+def compile_airbyte_schema():
+    with open(AIRBYTE_SCHEMA_YAML_PATH, "r") as file:
+        airbyte_schema = yaml.load(file, Loader=YAML_LOADER)
+
+    # YAML parses a few `examples` as dates, which are annotations and don't affect validation
+    with open(AIRBYTE_SCHEMA_JSON_PATH, "w") as file:
+        json.dump({"source_sha256": schema_source_hash(), "schema": airbyte_schema},
+                  file, separators=(",", ":"), default=lambda value: value.isoformat())
+
+    return airbyte_schema
+
+
+@functools.lru_cache(maxsize=None)
+def load_airbyte_schema() -> dict:
+    # The precompiled schema is only used if it was compiled from the current YAML
+    if os.path.exists(AIRBYTE_SCHEMA_JSON_PATH):
+        with open(AIRBYTE_SCHEMA_JSON_PATH, "r") as file:
+            compiled = json.load(file)
+        if compiled.get("source_sha256") == schema_source_hash():
+            return compiled["schema"]
+
+    logger.debug("Precompiled Airbyte schema is outdated, loading the YAML schema")
+    with open(AIRBYTE_SCHEMA_YAML_PATH, "r") as file:
+        return yaml.load(file, Loader=YAML_LOADER)
+
+
+@functools.lru_cache(maxsize=None)
+def airbyte_schema_validator() -> "jsonschema.protocols.Validator":
+    # Imported on first use, it pulls in a stack of schema libraries
+    import jsonschema
+
+    airbyte_schema = load_airbyte_schema()
+    validator_class = jsonschema.validators.validator_for(airbyte_schema)
+    validator_class.check_schema(airbyte_schema)
+    return validator_class(airbyte_schema)
+
+
+def iter_airbyte_connector_errors(connector: dict) -> Iterator["jsonschema.exceptions.ValidationError"]:
+    # Every violation, rather than the most relevant one
+    return airbyte_schema_validator().iter_errors(connector)
+
+
+def format_validation_error(error: "jsonschema.exceptions.ValidationError") -> str:
+    return f"{error.json_path}: {error.message}"
+
+
+def validate_airbyte_connector(connector: dict):
+    import jsonschema
+
+    error = jsonschema.exceptions.best_match(
+        iter_airbyte_connector_errors(connector))
+
+    if error is None:
+        return True, None
+    return False, error
+
+
+if __name__ == "__main__":
+    compile_airbyte_schema()
+    print(f"Compiled {AIRBYTE_SCHEMA_YAML_PATH} to {AIRBYTE_SCHEMA_JSON_PATH}")
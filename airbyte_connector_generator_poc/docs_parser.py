@@ -1,49 +1,60 @@
-from pprint import pprint
-from html2text import HTML2Text
-from bs4 import BeautifulSoup, Tag
+from typing import TYPE_CHECKING, Union
+from urllib.parse import urlparse
+import hashlib
 import json
-from openai import OpenAI
+import re
 from airbyte_connector_generator_poc.logger import logger
 from airbyte_connector_generator_poc.html_tree import build_html_tree
+from airbyte_connector_generator_poc.html_parser import parse_html
+from airbyte_connector_generator_poc.llm import llm
+from airbyte_connector_generator_poc.prompt_budget import fit_messages
+from airbyte_connector_generator_poc.tracing import traced
 from dotenv import load_dotenv
+
+if TYPE_CHECKING:
+    from bs4 import Tag
+
 load_dotenv()
 
 
-openai = OpenAI()
+SELECTOR_MODEL = "gpt-4-turbo-preview"
 
 
-def elect_main_section_selector(html_tree_str: str):
-    # Get selector for the main area we want to keep
-    response = openai.chat.completions.create(
-        messages=[{
-            "role": "system",
-            "content": """
+@traced()
+async def elect_main_section_selector(html: "Tag"):
+    # Get selector for the main area we want to keep, from a tree cut to fit the prompt
+    messages = fit_messages(SELECTOR_MODEL, lambda max_chars: [{
+        "role": "system",
+        "content": """
         You're an HTML expert. Your task is to find the section with most relevant content of a page given an HTML document.
         Avoid long chain of child selectors (>).
         Output the selector as JSON in the `selector` property.
       """
-        }, {
-            "role": "user",
-            "content": f"Find the main section of this page: {html_tree_str}"
-        }],
+    }, {
+        "role": "user",
+        "content": f"Find the main section of this page: {build_html_tree(html, max_chars=max_chars)}"
+    }])
+
+    content = await llm.chat_completion(
+        messages=messages,
         response_format={
             "type": "json_object"
         },
-        model="gpt-4-turbo-preview",
+        model=SELECTOR_MODEL,
         temperature=0,
         frequency_penalty=0.7,
     )
-    selector_json = json.loads(response.choices[0].message.content)
+    selector_json = json.loads(content)
     logger.debug("Generated selectors %s", json.dumps(selector_json))
     selector = selector_json["selector"]
     return selector
 
 
-def get_irrelevant_sections_selectors(html_tree_str: str):
-    response = openai.chat.completions.create(
-        messages=[{
-            "role": "system",
-            "content": """
+@traced()
+async def get_irrelevant_sections_selectors(html: "Tag"):
+    messages = fit_messages(SELECTOR_MODEL, lambda max_chars: [{
+        "role": "system",
+        "content": """
             You're an HTML expert. Your task is to remove sections that are not relevant to the main content. Things like:
             - Navigation (also knows as Nav, Navbar, etc.)
             - Menus
@@ -53,24 +64,57 @@ def get_irrelevant_sections_selectors(html_tree_str: str):
             Descendant children of this HTML might be relevant to keep, so be aware!
             Output the selectors to remove as JSON in the `selectors` property.
             """
-        }, {
-            "role": "user",
-            "content": f"Find the section to remove of this page: {html_tree_str}"
-        }],
+    }, {
+        "role": "user",
+        "content": f"Find the section to remove of this page: {build_html_tree(html, max_chars=max_chars)}"
+    }])
+
+    content = await llm.chat_completion(
+        messages=messages,
         response_format={
             "type": "json_object"
         },
-        model="gpt-4-turbo-preview",
+        model=SELECTOR_MODEL,
         temperature=0,
         frequency_penalty=0.7,
     )
 
-    selector_json = json.loads(response.choices[0].message.content)
+    selector_json = json.loads(content)
     logger.debug("Generated selectors: %s", selector_json)
     return selector_json["selectors"]
 
 
-def remove_irrelevant_sections(html: Tag, selectors: list[str]):
+# Levels of the page skeleton hashed into the fingerprint, deep enough to capture
+# the layout template (header, sidebar, main) but not the content of the page
+FINGERPRINT_DEPTH = 6
+# A reused main section with less text than this is considered a mismatch
+MIN_MAIN_SECTION_CHARS = 200
+
+
+def page_fingerprint(url: str, html: "Tag") -> str:
+    """
+    Fingerprint the layout template of a page, so pages of the same docs site
+    share their selectors. Attribute values are dropped as they often vary from
+    page to page (ids, links), while the skeleton stays the same.
+    """
+    skeleton = build_html_tree(html, max_depth=FINGERPRINT_DEPTH)
+    skeleton = re.sub(r'="[^"]*"', "", skeleton)
+    host = urlparse(url).netloc
+    return hashlib.md5(f"{host}\n{skeleton}".encode()).hexdigest()
+
+
+def selectors_match(html: "Tag", main_section_selector: str) -> bool:
+    # Check that selectors elected on another page of the template apply to this one
+    try:
+        main_section = html.select_one(main_section_selector)
+    except Exception as err:
+        logger.debug(f"Invalid cached selector `{main_section_selector}`: {err}")
+        return False
+
+    return main_section is not None and len(main_section.get_text(strip=True)) >= MIN_MAIN_SECTION_CHARS
+
+
+def remove_irrelevant_sections(html: "Tag", selectors: list[str]):
     for selector in selectors:
         selected_list = html.select(selector)
         logger.debug(f"{selector}: {len(selected_list)} elements found")
@@ -83,6 +127,13 @@ def remove_irrelevant_sections(html: Tag, selectors: list[str]):
 
 
 def convert_html_to_markdown(raw_html: str):
+    # Imported on first use, like bs4
+    from html2text import HTML2Text
+
+    # html2text only reads markup, so the relevant HTML is parsed again here. It's the
+    # main content of the pages, without the irrelevant sections, and costs a fraction
+    # of the first parse
+
     # Create an HTML to text converter
     text_maker = HTML2Text()
     # Ignore converting links from HTML
@@ -91,12 +142,13 @@ def convert_html_to_markdown(raw_html: str):
     return text_maker.handle(raw_html)
 
 
-def extract_relevant_html(raw_html: str, main_section_selector=None, irrelevant_sections_selectors=None):
-    html = BeautifulSoup(raw_html, "html.parser")
-    html_tree = build_html_tree(html)
+async def extract_relevant_html(html: Union[str, "Tag"], main_section_selector=None, irrelevant_sections_selectors=None):
+    # Callers that already parsed the page pass the tree, so it's only parsed once
+    if isinstance(html, str):
+        html = parse_html(html)
 
     if main_section_selector is None:
-        main_section_selector = elect_main_section_selector(html_tree)
+        main_section_selector = await elect_main_section_selector(html)
 
     html_main_content = html.select_one(main_section_selector)
 
@@ -105,11 +157,9 @@ def extract_relevant_html(raw_html: str, main_section_selector=None, irrelevant_
         raise ValueError(f"No main content found with selector `{
                          main_section_selector}`.")
 
-    html_main_content_tree = build_html_tree(html_main_content)
-
     if irrelevant_sections_selectors is None:
-        irrelevant_sections_selectors = get_irrelevant_sections_selectors(
-            html_main_content_tree)
+        irrelevant_sections_selectors = await get_irrelevant_sections_selectors(
+            html_main_content)
 
     cleaned_html_main_content = remove_irrelevant_sections(
         html_main_content, irrelevant_sections_selectors)
@@ -0,0 +1,47 @@
+import importlib.util
+import os
+from typing import TYPE_CHECKING
+from airbyte_connector_generator_poc.logger import logger
+
+if TYPE_CHECKING:
+    from bs4 import BeautifulSoup
+
+# BeautifulSoup tree builders, fastest first. `lxml` tokenizes in C instead of the
+# pure-Python `html.parser`, and the resulting tree supports the same
+# `select`/`select_one`/`extract` operations the rest of the pipeline relies on.
+HTML_PARSER_BACKENDS = {
+    "lxml": "lxml",
+    "html.parser": None,
+}
+
+
+def is_backend_available(backend: str) -> bool:
+    module = HTML_PARSER_BACKENDS[backend]
+    return module is None or importlib.util.find_spec(module) is not None
+
+
+def resolve_html_parser_backend(backend: str = None) -> str:
+    backend = backend or os.environ.get("SKYFFEL_HTML_PARSER")
+
+    if backend is None:
+        return next(name for name in HTML_PARSER_BACKENDS if is_backend_available(name))
+
+    if backend not in HTML_PARSER_BACKENDS:
+        raise ValueError(
+            f"Unknown HTML parser `{backend}`, expected one of {list(HTML_PARSER_BACKENDS)}")
+    if not is_backend_available(backend):
+        raise ValueError(
+            f"HTML parser `{backend}` is not installed, install it with `pip install {HTML_PARSER_BACKENDS[backend]}`")
+
+    return backend
+
+
+HTML_PARSER_BACKEND = resolve_html_parser_backend()
+logger.debug("Using HTML parser: %s", HTML_PARSER_BACKEND)
+
+
+def parse_html(raw_html: str, backend: str = None) -> "BeautifulSoup":
+    # Imported on first use, bs4 takes a while to import
+    from bs4 import BeautifulSoup
+
+    return BeautifulSoup(raw_html, resolve_html_parser_backend(backend) if backend else HTML_PARSER_BACKEND)
@@ -1,35 +1,102 @@
+from typing import TYPE_CHECKING, Optional
 
-from bs4 import Tag
+if TYPE_CHECKING:
+    from bs4 import Tag
 
 EXCLUDED_TAGS = ['script', 'svg', 'style', 'head', 'meta']
 
 
-def build_html_tree(element: Tag, level=0) -> str:
-    ast = ""
-    if element.name and element.name not in EXCLUDED_TAGS:
-        # Create a string to represent the element's attributes
-        attributes = []
-        for k, v in element.attrs.items():
-            if k not in ["style", "class"]:
-                if not isinstance(v, list):
-                    attributes.append(f'{k}="{v}"')
-                else:
-                    exclusion_rules = ['css-', 'js-', 'r-']
-                    filtered_values = []
-                    for attr in v:
-                        if not any(attr.startswith(rule) for rule in exclusion_rules):
-                            digit_count = sum(c.isdigit() for c in attr)
-                            if digit_count <= 2:
-                                filtered_values.append(attr)
-                    if filtered_values:
-                        attributes.append(f'{k}="{" ".join(filtered_values)}"')
-        attribute_str = str(" ".join(attributes))
-        ast += (f"<{element.name} {attribute_str.strip()
-                                   }>" if attribute_str else f"<{element.name}>").replace("\n", "").strip()
-        for child in element.children:
+def build_attribute_str(element: "Tag") -> str:
+    # Create a string to represent the element's attributes
+    attributes = []
+    for k, v in element.attrs.items():
+        if k not in ["style", "class"]:
+            if not isinstance(v, list):
+                attributes.append(f'{k}="{v}"')
+            else:
+                exclusion_rules = ['css-', 'js-', 'r-']
+                filtered_values = []
+                for attr in v:
+                    if not any(attr.startswith(rule) for rule in exclusion_rules):
+                        digit_count = sum(c.isdigit() for c in attr)
+                        if digit_count <= 2:
+                            filtered_values.append(attr)
+                if filtered_values:
+                    attributes.append(f'{k}="{" ".join(filtered_values)}"')
+    return str(" ".join(attributes))
+
+
+def build_opening_tag(element: "Tag") -> str:
+    attribute_str = build_attribute_str(element)
+    opening_tag = f"<{element.name} {attribute_str.strip()}>" if attribute_str else f"<{element.name}>"
+    return opening_tag.replace("\n", "").strip()
+
+
+def build_html_tree(element: "Tag", level=0, max_chars: Optional[int] = None, max_depth: Optional[int] = None) -> str:
+    """
+    Serialize the tag structure of an element, without text and noisy attributes,
+    for the LLM to pick selectors from.
+
+    The tree is walked iteratively into a list of parts, so the cost is linear in
+    the size of the DOM and deep pages can't hit the recursion limit.
+
+    With `max_chars` the walk stops as soon as the next tag wouldn't fit, and the
+    tags still open are closed, so the output is well-formed and never longer than
+    `max_chars` (a token is roughly 4 characters).
+
+    With `max_depth` only the elements at most that many levels below `element`
+    are serialized, which keeps the page skeleton and leaves out its content.
+    """
+    # Imported here rather than for every child, the tree is parsed by now anyway
+    from bs4 import Tag
+
+    if not element.name or element.name in EXCLUDED_TAGS:
+        return ""
+
+    opening_tag = build_opening_tag(element)
+    closing_tag = f"</{element.name}>"
+
+    if max_chars is not None and len(opening_tag) + len(closing_tag) > max_chars:
+        return ""
+
+    parts = [opening_tag]
+    length = len(opening_tag)
+    # Closing tags of the currently open elements, innermost last
+    closing_tags = [closing_tag]
+    closing_length = len(closing_tag)
+    # Iterators over the children of the currently open elements
+    stack = [iter(element.contents) if max_depth is None or max_depth > 0 else iter(())]
+
+    while stack:
+        for child in stack[-1]:
             if isinstance(child, Tag) and child.name not in EXCLUDED_TAGS:
-                ast += build_html_tree(child, level +
-                                       1).replace("\n", "").strip()
-        if element.name and element.name not in EXCLUDED_TAGS:
-            ast += f"</{element.name}>".replace("\n", "").strip()
-    return ast
+                break
+        else:
+            # All children are serialized, close the element
+            stack.pop()
+            closing_tag = closing_tags.pop()
+            parts.append(closing_tag)
+            if max_chars is not None:
+                length += len(closing_tag)
+                closing_length -= len(closing_tag)
+            continue
+
+        opening_tag = build_opening_tag(child)
+        closing_tag = f"</{child.name}>"
+
+        if max_chars is not None:
+            if length + len(opening_tag) + len(closing_tag) + closing_length > max_chars:
+                parts.extend(reversed(closing_tags))
+                break
+            length += len(opening_tag)
+            closing_length += len(closing_tag)
+
+        parts.append(opening_tag)
+        closing_tags.append(closing_tag)
+        # The child is `len(stack)` levels deep, skip its children past `max_depth`
+        if max_depth is not None and len(stack) >= max_depth:
+            stack.append(iter(()))
+        else:
+            stack.append(iter(child.contents))
+
+    return "".join(parts)
@@ -0,0 +1,220 @@
+import asyncio
+import os
+import random
+import time
+import weakref
+from contextvars import ContextVar
+from typing import TYPE_CHECKING, Optional
+from airbyte_connector_generator_poc.llm_cache import llm_cache
+from airbyte_connector_generator_poc.logger import logger
+from airbyte_connector_generator_poc.prompt_budget import check_prompt, estimate_tokens
+from airbyte_connector_generator_poc.tracing import (CACHE_HIT_ATTRIBUTE, INPUT_TOKENS_ATTRIBUTE, MODEL_ATTRIBUTE,
+                                                    OUTPUT_TOKENS_ATTRIBUTE, current_span, span, tracer)
+
+# openai takes most of the startup time, it's imported when the first request is made
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI
+
+DEFAULT_MAX_IN_FLIGHT = int(os.environ.get("SKYFFEL_LLM_MAX_IN_FLIGHT", 8))
+DEFAULT_REQUESTS_PER_MINUTE = int(os.environ.get("SKYFFEL_LLM_RPM", 500))
+DEFAULT_TOKENS_PER_MINUTE = int(os.environ.get("SKYFFEL_LLM_TPM", 150_000))
+DEFAULT_MAX_RETRIES = int(os.environ.get("SKYFFEL_LLM_MAX_RETRIES", 6))
+DEFAULT_TIMEOUT = float(os.environ.get("SKYFFEL_LLM_TIMEOUT", 600))
+
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+
+
+def prompt_bytes(params: dict) -> int:
+    return sum(len(str(message.get("content", "")).encode()) for message in params.get("messages", []))
+
+
+def estimate_request_tokens(params: dict) -> int:
+    prompt_tokens = sum(estimate_tokens(str(message.get("content", "")))
+                        for message in params.get("messages", []))
+    return prompt_tokens + (params.get("max_tokens") or 0)
+
+
+class TokenBucket():
+    """
+    Limits the rate of a resource to `rate_per_minute`, allowing bursts up to a minute's worth.
+    """
+
+    def __init__(self, rate_per_minute: float):
+        self.rate_per_second = rate_per_minute / 60
+        self.capacity = rate_per_minute
+        self.tokens = rate_per_minute
+        self.updated_at = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens +
+                          (now - self.updated_at) * self.rate_per_second)
+        self.updated_at = now
+
+    async def acquire(self, amount: float = 1):
+        # A request larger than the bucket can never fit, so it waits for a full bucket instead
+        amount = min(amount, self.capacity)
+        while True:
+            self._refill()
+            if self.tokens >= amount:
+                self.tokens -= amount
+                return
+            await asyncio.sleep((amount - self.tokens) / self.rate_per_second)
+
+    def adjust(self, amount: float):
+        # Corrects an estimate once the real usage is known, may go negative
+        self._refill()
+        self.tokens -= amount
+
+
+class LLMUsage():
+    """
+    Requests and tokens used by the LLM calls made within a context, e.g a batch job.
+    """
+
+    def __init__(self):
+        self.requests = 0
+        self.cache_hits = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+    def record(self, response):
+        self.requests += 1
+        if response.usage is not None:
+            self.prompt_tokens += response.usage.prompt_tokens
+            self.completion_tokens += response.usage.completion_tokens
+
+
+# Set per job, tasks created within the job inherit it
+llm_usage: ContextVar[Optional[LLMUsage]] = ContextVar(
+    "llm_usage", default=None)
+
+
+def is_retryable(error: Exception) -> bool:
+    import openai
+
+    if isinstance(error, (openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code == 429 or error.status_code >= 500
+    return False
+
+
+def retry_delay(error: Exception, attempt: int) -> float:
+    response = getattr(error, "response", None)
+    retry_after = response.headers.get(
+        "retry-after") if response is not None else None
+    if retry_after:
+        try:
+            return float(retry_after)
+        except ValueError:
+            pass
+    # Exponential backoff with full jitter, so concurrent retries don't stampede
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+class LLMClient():
+    """
+    Shared async OpenAI client. Bounds the number of requests in flight, paces
+    requests and tokens per minute, retries rate limits and server errors, and
+    serves repeated requests from the LLM cache.
+    """
+
+    def __init__(self, max_in_flight: int = DEFAULT_MAX_IN_FLIGHT,
+                 requests_per_minute: float = DEFAULT_REQUESTS_PER_MINUTE,
+                 tokens_per_minute: float = DEFAULT_TOKENS_PER_MINUTE,
+                 max_retries: int = DEFAULT_MAX_RETRIES,
+                 timeout: float = DEFAULT_TIMEOUT):
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.request_bucket = TokenBucket(requests_per_minute)
+        self.token_bucket = TokenBucket(tokens_per_minute)
+        self._client = None
+        # asyncio primitives are bound to the loop they are first used on
+        self._semaphores = weakref.WeakKeyDictionary()
+
+    @property
+    def client(self) -> "AsyncOpenAI":
+        # Created on first use, so importing doesn't require an API key
+        if self._client is None:
+            from openai import AsyncOpenAI
+
+            self._client = AsyncOpenAI(max_retries=0)
+        return self._client
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        if loop not in self._semaphores:
+            self._semaphores[loop] = asyncio.Semaphore(self.max_in_flight)
+        return self._semaphores[loop]
+
+    async def _create(self, params: dict, timeout: float):
+        estimated_tokens = estimate_request_tokens(params)
+
+        for attempt in range(self.max_retries + 1):
+            queued_at = time.perf_counter()
+            async with self._semaphore():
+                await self.request_bucket.acquire()
+                await self.token_bucket.acquire(estimated_tokens)
+                # Time spent waiting on the in-flight limit and the rate limits
+                current_span().add(**{"llm.queued_s": time.perf_counter() - queued_at})
+                try:
+                    response = await self.client.chat.completions.create(**params, timeout=timeout)
+                except Exception as e:
+                    if attempt == self.max_retries or not is_retryable(e):
+                        raise
+                    delay = retry_delay(e, attempt)
+                    current_span().add(**{"llm.retries": 1})
+                    logger.debug("OpenAI request failed (%s), retrying in %.1fs (attempt %d/%d)",
+                                 e.__class__.__name__, delay, attempt + 1, self.max_retries)
+                else:
+                    if response.usage is not None:
+                        self.token_bucket.adjust(
+                            response.usage.total_tokens - estimated_tokens)
+                    return response
+            # Back off outside the semaphore so other requests can proceed
+            await asyncio.sleep(delay)
+
+    async def chat_completion(self, timeout: Optional[float] = None, **params) -> str:
+        with span("openai.chat_completion", **{"gen_ai.system": "openai", MODEL_ATTRIBUTE: params.get("model")}) as llm_span:
+            # Sizes are only measured for the trace, they encode the whole prompt
+            if tracer.enabled:
+                llm_span.set(**{"llm.prompt_bytes": prompt_bytes(params)})
+
+            # Oversized prompts fail here, rather than remotely after waiting their turn
+            check_prompt(params)
+
+            usage = llm_usage.get()
+
+            content = llm_cache.get(params)
+            if content is not None:
+                logger.debug("LLM cache hit for %s", params.get("model"))
+                if usage is not None:
+                    usage.cache_hits += 1
+                llm_span.set(**{CACHE_HIT_ATTRIBUTE: True})
+                if tracer.enabled:
+                    llm_span.set(**{"llm.response_bytes": len(content.encode())})
+                return content
+
+            response = await self._create(params, timeout or self.timeout)
+            if usage is not None:
+                usage.record(response)
+            llm_cache.set(params, response)
+
+            content = response.choices[0].message.content
+            llm_span.set(**{CACHE_HIT_ATTRIBUTE: False})
+            if tracer.enabled:
+                llm_span.set(**{"llm.response_bytes": len((content or "").encode())})
+            if response.usage is not None:
+                llm_span.set(**{INPUT_TOKENS_ATTRIBUTE: response.usage.prompt_tokens,
+                                OUTPUT_TOKENS_ATTRIBUTE: response.usage.completion_tokens})
+            return content
+
+
+llm = LLMClient()
@@ -0,0 +1,72 @@
+import hashlib
+import json
+import os
+from typing import Optional
+from airbyte_connector_generator_poc.local_cache import LocalCache
+from airbyte_connector_generator_poc.utils import SKYFFEL_DIR
+
+LLM_CACHE_PATH = os.path.join(SKYFFEL_DIR, "llm_cache.sqlite")
+LLM_CACHE_MAX_BYTES = int(os.environ.get(
+    "SKYFFEL_LLM_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+
+
+class LLMCache():
+    """
+    Cache of chat completions keyed by a hash of the model, messages and parameters.
+    When bypassed, responses are still stored but never read, to refresh the cache.
+    """
+
+    def __init__(self, cache_file_path=LLM_CACHE_PATH, max_bytes: int = LLM_CACHE_MAX_BYTES, bypass: bool = False):
+        self.cache_file_path = cache_file_path
+        self.max_bytes = max_bytes
+        self.bypass = bypass
+        self.hits = 0
+        self.misses = 0
+        self._cache = None
+
+    @property
+    def cache(self) -> LocalCache:
+        # Opened on first use so importing this module doesn't touch the disk
+        if self._cache is None:
+            self._cache = LocalCache(
+                self.cache_file_path, max_bytes=self.max_bytes)
+        return self._cache
+
+    def key(self, params: dict) -> str:
+        serialized = json.dumps(params, sort_keys=True,
+                                separators=(",", ":"), default=str)
+        return hashlib.sha256(serialized.encode()).hexdigest()
+
+    def get(self, params: dict) -> Optional[str]:
+        if self.bypass:
+            self.misses += 1
+            return None
+        entry = self.cache.get(self.key(params))
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry["content"]
+
+    def set(self, params: dict, response):
+        choice = response.choices[0]
+        # A truncated completion (e.g finish_reason=length) would be replayed forever
+        if choice.finish_reason != "stop":
+            return
+        self.cache.set(key=self.key(params), value={
+            "model": response.model,
+            "content": choice.message.content,
+        })
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+llm_cache = LLMCache(bypass=os.environ.get(
+    "SKYFFEL_LLM_CACHE", "true").lower() in ["false", "0", "no"])
+
@@ -1,29 +1,155 @@
 import os
 import json
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS entries (
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        created_at REAL NOT NULL,
+        accessed_at REAL NOT NULL
+    )""",
+    "CREATE INDEX IF NOT EXISTS entries_accessed_at ON entries (accessed_at)",
+    "CREATE INDEX IF NOT EXISTS entries_created_at ON entries (created_at)",
+    # Totals are kept up to date by triggers so eviction never has to scan the table
+    """CREATE TABLE IF NOT EXISTS totals (
+        id INTEGER PRIMARY KEY CHECK (id = 0),
+        entries INTEGER NOT NULL,
+        bytes INTEGER NOT NULL
+    )""",
+    "INSERT OR IGNORE INTO totals VALUES (0, 0, 0)",
+    """CREATE TRIGGER IF NOT EXISTS entries_insert AFTER INSERT ON entries BEGIN
+        UPDATE totals SET entries = entries + 1, bytes = bytes + NEW.size;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS entries_update AFTER UPDATE OF size ON entries BEGIN
+        UPDATE totals SET bytes = bytes + NEW.size - OLD.size;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS entries_delete AFTER DELETE ON entries BEGIN
+        UPDATE totals SET entries = entries - 1, bytes = bytes - OLD.size;
+    END""",
+]
 
 
 class LocalCache():
-    def __init__(self, cache_file_path):
-        if not cache_file_path.endswith('.json'):
-            raise ValueError("Cache file path must end with '.json'")
+    """
+    Key-value cache of JSON values backed by SQLite, safe to share between processes.
+
+    - `ttl`: seconds after which an entry expires
+    - `max_entries` / `max_bytes`: bounds enforced by evicting the least recently used entries
+    """
+
+    def __init__(self, cache_file_path, ttl: Optional[float] = None, max_entries: Optional[int] = None,
+                 max_bytes: Optional[int] = None):
+        if not cache_file_path.endswith('.sqlite'):
+            raise ValueError("Cache file path must end with '.sqlite'")
         self.cache_file_path = cache_file_path
-        if not os.path.exists(self.cache_file_path):
-            with open(self.cache_file_path, 'w') as cache_file:
-                # Create an empty JSON object in the file
-                cache_file.write('{}')
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+
+        cache_dir = os.path.dirname(self.cache_file_path)
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+        # Autocommit mode, transactions are explicit. The timeout makes
+        # concurrent runs wait for each other's write lock instead of failing.
+        self.connection = sqlite3.connect(
+            self.cache_file_path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        with self._transaction():
+            for statement in SCHEMA:
+                self.connection.execute(statement)
+
+    @contextmanager
+    def _transaction(self):
+        with self.lock:
+            # Take the write lock up front so a read-then-write can't deadlock with another process
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                yield
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+            self.connection.execute("COMMIT")
+
+    @property
+    def tracks_access(self) -> bool:
+        return self.max_entries is not None or self.max_bytes is not None
 
     def get(self, key):
-        with open(self.cache_file_path, 'r') as cache_file:
-            file_content = cache_file.read()
-            cache_data = json.loads(file_content if file_content else '{}')
-        return cache_data.get(key)
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT value, created_at FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+
+        value, created_at = row
+        now = time.time()
+
+        if self.ttl is not None and now - created_at > self.ttl:
+            self.delete(key)
+            return None
+
+        if self.tracks_access:
+            with self._transaction():
+                self.connection.execute(
+                    "UPDATE entries SET accessed_at = ? WHERE key = ?", (now, key))
+
+        return json.loads(value)
 
     def set(self, key: str, value: dict):
-        with open(self.cache_file_path, 'r') as cache_file:
-            cache_data = json.loads(cache_file.read())
-        cache_data[key] = value
-        with open(self.cache_file_path, 'w') as cache_file:
-            cache_file.write(json.dumps(cache_data, indent=2))
+        data = json.dumps(value)
+        now = time.time()
+        with self._transaction():
+            self.connection.execute("""
+                INSERT INTO entries (key, value, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (key) DO UPDATE SET
+                    value = excluded.value, size = excluded.size,
+                    created_at = excluded.created_at, accessed_at = excluded.accessed_at
+            """, (key, data, len(data), now, now))
+            self._evict(now)
+
+    def delete(self, key: str):
+        with self._transaction():
+            self.connection.execute(
+                "DELETE FROM entries WHERE key = ?", (key,))
+
+    def _evict(self, now: float):
+        if self.ttl is not None:
+            self.connection.execute(
+                "DELETE FROM entries WHERE created_at < ?", (now - self.ttl,))
+
+        if not self.tracks_access:
+            return
+
+        while True:
+            entries, size = self.connection.execute(
+                "SELECT entries, bytes FROM totals").fetchone()
+            excess = 0
+            if self.max_entries is not None and entries > self.max_entries:
+                excess = entries - self.max_entries
+            elif self.max_bytes is not None and size > self.max_bytes:
+                excess = 1
+            if excess == 0:
+                return
+            self.connection.execute("""
+                DELETE FROM entries WHERE key IN (
+                    SELECT key FROM entries ORDER BY accessed_at LIMIT ?
+                )
+            """, (excess,))
+
+    def close(self):
+        self.connection.close()
 
     def __del__(self):
-        pass
+        try:
+            self.close()
+        except Exception:
+            pass
@@ -1,6 +1,3 @@
-from datetime import datetime
-from rich.table import Table
-from rich.console import Console
 import dotenv
 import logging
 import os
@@ -1,13 +1,13 @@
-import traceback
-import yaml
+from contextlib import contextmanager
+from typing import Optional
 from dotenv import load_dotenv
 import typer
-from airbyte_connector_generator_poc.utils import check_env_for_key, write_debug_file, write_env_variable, validate_urls, nuke_debug_directory
-from airbyte_connector_generator_poc.scraper import scrape_urls
+from airbyte_connector_generator_poc.utils import DEBUG_ARTIFACT_LEVELS, check_env_for_key, write_env_variable, nuke_debug_directory, set_debug_artifact_level
+from airbyte_connector_generator_poc.scraper import DEFAULT_CONCURRENCY, DEFAULT_TIMEOUT, DEFAULT_WAIT_STRATEGY, DEFAULT_FETCH_MODE
+from airbyte_connector_generator_poc.pipeline import DEFAULT_BATCH_WORKERS
+from airbyte_connector_generator_poc.tracing import TRACE_FORMATS, export_trace, print_trace_summary, tracer
 from asyncio import run
-from airbyte_connector_generator_poc.logger import logger
 from rich.console import Console
-from rich.status import Status
 from rich.columns import Columns
 from rich.panel import Panel
 
@@ -16,11 +16,7 @@ load_dotenv()
 console = Console(log_time=False)
 
 
-async def _main(goal: str, urls: list[str]):
-    nuke_debug_directory()
-
-    if not goal:
-        goal = typer.prompt("Tell us, what do you want to integrate?")
+def ensure_openai_api_key():
     if not check_env_for_key("OPENAI_API_KEY"):
         typer.echo(
             "We'll need an api key to generate the code. We'll store it in a .env file")
@@ -30,9 +26,60 @@ async def _main(goal: str, urls: list[str]):
             raise ValueError("OpenAI API key is required.")
         write_env_variable("OPENAI_API_KEY", openai_api_key)
 
-    from airbyte_connector_generator_poc.airbyte.airbyte import generate_airbyte_connector, validate_airbyte_connector
-    from airbyte_connector_generator_poc.openapi_generator import generate_openapi_spec
+
+def log_llm_cache_stats():
+    from airbyte_connector_generator_poc.llm_cache import llm_cache
+
+    llm_cache_stats = llm_cache.stats()
+    console.log(
+        f"[dim]LLM cache: {llm_cache_stats['hits']} hits, {llm_cache_stats['misses']} misses")
+
+
+def apply_debug_artifacts(debug_artifacts: Optional[str]):
+    try:
+        set_debug_artifact_level(debug_artifacts)
+    except ValueError:
+        raise typer.BadParameter(
+            f"Expected one of {DEBUG_ARTIFACT_LEVELS}", param_hint="--debug-artifacts")
+
+
+@contextmanager
+def traced_run(trace: Optional[str], trace_format: str):
+    # The trace is written even if the run fails, that's when it's most useful
+    if not trace:
+        yield
+        return
+    if trace_format not in TRACE_FORMATS:
+        raise typer.BadParameter(
+            f"Expected one of {TRACE_FORMATS}", param_hint="--trace-format")
+
+    tracer.enabled = True
+    try:
+        yield
+    finally:
+        print_trace_summary(console)
+        export_trace(trace, trace_format)
+        console.log(f"[dim]Trace written to {trace}")
+
+
+async def _main(goal: str, urls: list[str], concurrency: int = DEFAULT_CONCURRENCY, timeout: float = DEFAULT_TIMEOUT,
+                wait_strategy: str = DEFAULT_WAIT_STRATEGY, block_resources: bool = True, fetch_mode: str = DEFAULT_FETCH_MODE,
+                use_cache: bool = True, from_cache: bool = False, llm_cache_enabled: bool = True):
+    nuke_debug_directory()
+
+    if not goal:
+        goal = typer.prompt("Tell us, what do you want to integrate?")
+    ensure_openai_api_key()
+
+    from airbyte_connector_generator_poc.airbyte.validation import InvalidAirbyteConnectorError
     from airbyte_connector_generator_poc.openapi_spec import load_openapi_spec_from_path_or_url
+    from airbyte_connector_generator_poc.openapi_validation import InvalidOpenAPISpecError
+    from airbyte_connector_generator_poc.llm_cache import llm_cache
+    from airbyte_connector_generator_poc.pipeline import run_pipeline
+    from airbyte_connector_generator_poc.prompt_budget import PromptTooLargeError
+
+    if not llm_cache_enabled:
+        llm_cache.bypass = True
 
     console.log("[bold]Starting...")
 
@@ -48,47 +95,104 @@ async def _main(goal: str, urls: list[str]):
         console.print(
             Columns([Panel(url, expand=True) for url in urls]))
 
-        urls = validate_urls(urls)
+        try:
+            await run_pipeline(goal, urls, concurrency=concurrency, timeout=timeout,
+                               wait_strategy=wait_strategy, block_resources=block_resources, fetch_mode=fetch_mode,
+                               use_cache=use_cache, from_cache=from_cache)
+        except (InvalidOpenAPISpecError, InvalidAirbyteConnectorError):
+            # Already reported, with the details in the debug directory
+            raise typer.Exit(1)
+        except PromptTooLargeError as e:
+            console.log(f"[red bold]❌ {e}, try fewer or shorter docs pages")
+            raise typer.Exit(1)
 
-        logger.debug(f"Start scraping URLs: %s", urls)
-        html_documents = await scrape_urls(urls)
-        logger.debug(f"Scraped HTML documents")
+    log_llm_cache_stats()
 
-        openapi_spec = await generate_openapi_spec(url_html_documents=html_documents, user_goal=goal)
+    console.bell()
 
-    with open("openapi.yaml", 'w') as file:
-        yaml.safe_dump(openapi_spec, file)
 
-    with Status("[bold cyan] Generating Airbyte connector...", console=console):
-        airbyte_connector = generate_airbyte_connector(openapi_spec)
+async def _batch(manifest: str, workers: int, llm_cache_enabled: bool = True):
+    from airbyte_connector_generator_poc.llm_cache import llm_cache
+    from airbyte_connector_generator_poc.pipeline import load_manifest, print_batch_summary, run_batch
 
-        console.log("[bold green]  ✅ Airbyte connector generated")
+    jobs = load_manifest(manifest)
+    ensure_openai_api_key()
 
-        logger.debug(f"Writing airbyte connector")
-        with open("airbyte_connector.yaml", 'w') as f:
-            yaml.safe_dump(airbyte_connector, f)
+    if not llm_cache_enabled:
+        llm_cache.bypass = True
 
-        ok, err = validate_airbyte_connector(airbyte_connector)
+    console.log(f"[bold]Running {len(jobs)} job(s), {workers} at a time...")
 
-        if ok:
-            console.log("[green bold]  ✅ Airbyte connector is valid")
-        else:
-            console.log(
-                "[red bold]  ❌ Airbyte connector is invalid (check .skyffel/airbyte_validation_error.log for more details)")
-            write_debug_file("airbyte_validation_error.log",
-                             "".join(traceback.format_exception(err)))
-            exit(1)
+    results = await run_batch(jobs, workers=workers)
 
-    console.bell()
+    print_batch_summary(results)
+    log_llm_cache_stats()
 
+    console.bell()
 
-def main(goal: str = typer.Option(), urls: list[str] = typer.Option()):
-    run(_main(goal, urls))
+    if any(result["status"] != "ok" for result in results):
+        raise typer.Exit(1)
+
+
+app = typer.Typer(invoke_without_command=True)
+
+
+@app.callback()
+def main(ctx: typer.Context,
+         goal: Optional[str] = typer.Option(None, help="What to integrate, asked for if not given"),
+         urls: Optional[list[str]] = typer.Option(None, help="URL of a docs page, repeated for each page"),
+         concurrency: int = typer.Option(
+             DEFAULT_CONCURRENCY, help="Number of pages scraped in parallel"),
+         timeout: float = typer.Option(DEFAULT_TIMEOUT, help="Timeout in seconds for scraping a single URL"),
+         wait_strategy: str = typer.Option(
+             DEFAULT_WAIT_STRATEGY, help="When a page is considered loaded: load, domcontentloaded, networkidle, selector:<css> or stable:<ms>"),
+         block_resources: bool = typer.Option(True, help="Abort images, fonts, media, stylesheets and tracker requests while scraping"),
+         fetch_mode: str = typer.Option(
+             DEFAULT_FETCH_MODE, help="auto: plain HTTP with browser fallback, http: plain HTTP only, browser: browser only"),
+         cache: bool = typer.Option(
+             True, help="Cache scraped pages in .skyffel/ and revalidate them with conditional requests"),
+         from_cache: bool = typer.Option(False, help="Replay scraped pages from the cache without any network access"),
+         llm_cache: bool = typer.Option(True, help="Reuse LLM responses for identical requests from previous runs"),
+         debug_artifacts: Optional[str] = typer.Option(
+             None, envvar="SKYFFEL_DEBUG_ARTIFACTS", help="Debug files written to .skyffel/: none, summary or full"),
+         trace: Optional[str] = typer.Option(
+             None, envvar="SKYFFEL_TRACE", help="Write a trace of every stage and OpenAI request to this file"),
+         trace_format: str = typer.Option("otlp", help="otlp: OpenTelemetry OTLP/JSON, json: flat list of spans")):
+    """
+    Generate an Airbyte connector from API docs, or run a batch of generations with `skyffel batch`.
+    """
+    if ctx.invoked_subcommand is not None:
+        return
+    if not urls:
+        raise typer.BadParameter("At least one URL is required", param_hint="--urls")
+    apply_debug_artifacts(debug_artifacts)
+
+    with traced_run(trace, trace_format):
+        run(_main(goal, urls, concurrency, timeout, wait_strategy,
+            block_resources, fetch_mode, cache, from_cache, llm_cache))
+
+
+@app.command()
+def batch(manifest: str = typer.Argument(help="YAML manifest listing the jobs, each with a goal, URLs and output directory"),
+          workers: int = typer.Option(
+              DEFAULT_BATCH_WORKERS, help="Number of jobs run at the same time"),
+          llm_cache: bool = typer.Option(True, help="Reuse LLM responses for identical requests from previous runs"),
+          debug_artifacts: Optional[str] = typer.Option(
+              None, envvar="SKYFFEL_DEBUG_ARTIFACTS", help="Debug files written to .skyffel/: none, summary or full"),
+          trace: Optional[str] = typer.Option(
+              None, envvar="SKYFFEL_TRACE", help="Write a trace of every job, stage and OpenAI request to this file"),
+          trace_format: str = typer.Option("otlp", help="otlp: OpenTelemetry OTLP/JSON, json: flat list of spans")):
+    """
+    Generate several connectors, sharing one browser, the caches and the OpenAI rate limits.
+    """
+    apply_debug_artifacts(debug_artifacts)
+    with traced_run(trace, trace_format):
+        run(_batch(manifest, workers, llm_cache))
 
 
 def cli():
-    typer.run(main)
+    app()
 
 
 if __name__ == "__main__":
-    typer.run(main)
+    app()
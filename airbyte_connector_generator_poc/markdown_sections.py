@@ -0,0 +1,106 @@
+import re
+from airbyte_connector_generator_poc.prompt_budget import estimate_tokens
+
+HEADING_PATTERN = re.compile(r"^(#{1,6})\s+(.*?)\s*#*\s*$")
+FENCE_PATTERN = re.compile(r"^\s*(```|~~~)")
+
+
+def split_markdown_sections(markdown: str) -> list[dict]:
+    """
+    Split markdown into sections at every heading, ignoring `#` lines inside code blocks.
+    Each section has its `heading`, `level`, the `path` of headings leading to it
+    and its `content`, including the heading line. Text before the first heading
+    is a section of level 0.
+    """
+    sections = []
+    path = []
+    section = {"heading": "", "level": 0, "path": [], "lines": []}
+    in_code_block = False
+
+    for line in markdown.splitlines():
+        if FENCE_PATTERN.match(line):
+            in_code_block = not in_code_block
+
+        match = None if in_code_block else HEADING_PATTERN.match(line)
+
+        if match:
+            sections.append(section)
+
+            level = len(match.group(1))
+            heading = match.group(2)
+            # Keep the headings of the enclosing sections only
+            path = [entry for entry in path if entry[0] < level] + \
+                [(level, heading)]
+            section = {"heading": heading, "level": level,
+                       "path": [entry[1] for entry in path], "lines": []}
+
+        section["lines"].append(line)
+
+    sections.append(section)
+
+    return [{
+        "heading": section["heading"],
+        "level": section["level"],
+        "path": section["path"],
+        "content": "\n".join(section["lines"]).strip(),
+    } for section in sections if "".join(section["lines"]).strip()]
+
+
+def split_oversized_text(text: str, max_tokens: int) -> list[str]:
+    # Split on paragraphs, then on lines, then hard on characters as a last resort
+    if estimate_tokens(text) <= max_tokens:
+        return [text]
+
+    for separator in ["\n\n", "\n"]:
+        parts = text.split(separator)
+        if len(parts) > 1:
+            return pack_texts(parts, max_tokens, separator)
+
+    max_chars = max(max_tokens - 1, 1) * 4
+    return [text[i:i + max_chars] for i in range(0, len(text), max_chars)]
+
+
+def pack_texts(texts: list[str], max_tokens: int, separator: str = "\n\n") -> list[str]:
+    # Greedily pack consecutive texts into chunks of at most `max_tokens`
+    chunks = []
+    current = []
+    current_tokens = 0
+
+    for text in texts:
+        for part in split_oversized_text(text, max_tokens):
+            part_tokens = estimate_tokens(part)
+
+            if current and current_tokens + part_tokens > max_tokens:
+                chunks.append(separator.join(current))
+                current, current_tokens = [], 0
+
+            current.append(part)
+            current_tokens += part_tokens
+
+    if current:
+        chunks.append(separator.join(current))
+
+    return chunks
+
+
+def chunk_markdown(markdown: str, max_tokens: int) -> list[str]:
+    """
+    Split markdown into chunks of at most `max_tokens` (estimated) along heading boundaries.
+    Sections that don't fit in a chunk are split on paragraphs, and each part
+    repeats the heading path so it keeps its context.
+    """
+    texts = []
+
+    for section in split_markdown_sections(markdown):
+        content = section["content"]
+
+        if estimate_tokens(content) <= max_tokens:
+            texts.append(content)
+            continue
+
+        context = " > ".join(section["path"])
+        context_tokens = estimate_tokens(f"({context})\n\n") if context else 0
+        for i, part in enumerate(split_oversized_text(content, max(max_tokens - context_tokens, 1))):
+            texts.append(part if i == 0 or not context else f"({context})\n\n{part}")
+
+    return pack_texts(texts, max_tokens)
@@ -1,105 +1,230 @@
+import asyncio
 import os
-import traceback
+from collections import defaultdict
+from typing import TYPE_CHECKING, AsyncIterable, Optional, Union
+from urllib.parse import urlparse
 
 from rich.console import Console
-from rich.status import Status
-from rich.progress import Progress
-from rich.progress import SpinnerColumn, TextColumn, BarColumn, TaskProgressColumn, TimeElapsedColumn
 
-from airbyte_connector_generator_poc.utils import SKYFFEL_DIR, write_debug_file
+from airbyte_connector_generator_poc.utils import SKYFFEL_DIR, debug_file_path, write_debug_file
 from airbyte_connector_generator_poc.docs_parser import (convert_html_to_markdown,
-                                                         extract_relevant_html)
+                                                         extract_relevant_html, page_fingerprint,
+                                                         selectors_match)
+from airbyte_connector_generator_poc.html_parser import parse_html
 from dotenv import load_dotenv
 from airbyte_connector_generator_poc.local_cache import LocalCache
-from airbyte_connector_generator_poc.openapi_spec import (clean_openapi_spec, generate_openapi_spec_from_markdown,
-                                                          validate_openapi_spec)
+from airbyte_connector_generator_poc.relevance import select_relevant_markdown
+from airbyte_connector_generator_poc.openapi_spec import clean_openapi_spec, generate_openapi_spec_from_markdown
+from airbyte_connector_generator_poc.openapi_validation import InvalidOpenAPISpecError, validate_openapi_spec_by_path
 
 from airbyte_connector_generator_poc.logger import logger
+from airbyte_connector_generator_poc.progress import progress, shared_progress
+from airbyte_connector_generator_poc.tracing import current_span, span, traced
 
 import hashlib
 
+if TYPE_CHECKING:
+    from bs4 import Tag
+
 load_dotenv()
 
 console = Console(log_time=False)
-progress = Progress(
-    SpinnerColumn(),
-    TextColumn("[progress.description]{task.description}"),
-    BarColumn(),
-    TaskProgressColumn(),
-    TimeElapsedColumn(),
-)
 
+# Pages preprocessed at the same time, mostly waiting on selector elections
+DEFAULT_PREPROCESS_CONCURRENCY = 4
+SELECTOR_CACHE_PATH = os.path.join(SKYFFEL_DIR, 'selector_cache.sqlite')
 
-async def generate_openapi_spec(url_html_documents: dict, user_goal: str):
-    assert len(url_html_documents.keys()) > 0
 
-    logger.debug(f"Start generating OpenAPI spec for user goal: {user_goal}")
-    write_debug_file("html_documents_combined.html",
-                     "\n".join(url_html_documents.values()))
+def find_cached_selectors(selector_cache: LocalCache, keys: list[str], html: "Tag") -> dict:
+    # Selectors elected on another page are only reused if they match this one
+    for key in keys:
+        selectors = selector_cache.get(key=key) or {}
+        main_section_selector = selectors.get("main_section_selector")
 
-    url_selector_cache = LocalCache(
-        os.path.join(SKYFFEL_DIR, 'selector_cache.json'))
+        if main_section_selector and selectors_match(html, main_section_selector):
+            logger.debug(
+                f"Reusing selectors elected on {selectors.get('url')}")
+            return selectors
 
-    relevant_html_tags = []
+    return {}
+
+
+@traced()
+def parse_page(url: str, html_document: str) -> tuple["Tag", str]:
+    html = parse_html(html_document)
+    return html, page_fingerprint(url, html)
 
-    with progress:
-        preprocessing_task = progress.add_task(
-            "[bold green]Preprocessing docs...", total=len(url_html_documents.keys()))
 
-        for url, html_document in url_html_documents.items():
-            progress.update(preprocessing_task,
-                            description=f"[bold cyan]Preprocessing[/bold cyan] {url}")
+@traced()
+async def preprocess_page(url: str, html_document: str, selector_cache: LocalCache, fingerprint_locks: dict) -> str:
+    page_span = current_span()
+    page_span.set(url=url, html_bytes=len(html_document))
 
-            url_key = hashlib.md5(url.encode()).hexdigest()
+    # Parsing is CPU bound, off the event loop it doesn't hold up scraping and LLM calls
+    html, fingerprint = await asyncio.to_thread(parse_page, url, html_document)
 
-            selectors = url_selector_cache.get(key=url_key) or {}
+    # Pages of the same template wait for the first one to elect the selectors, then reuse them
+    async with fingerprint_locks[fingerprint]:
+        # Same template first, then any template of the same docs site
+        selector_keys = [fingerprint, f"host:{urlparse(url).netloc}"]
+        selectors = find_cached_selectors(
+            selector_cache, selector_keys, html)
 
-            main_section_selector = selectors.get("main_section_selector")
-            irrelevant_sections_selectors = selectors.get(
-                "irrelevant_sections_selectors")
+        main_section_selector = selectors.get("main_section_selector")
+        page_span.set(selectors_cached=main_section_selector is not None)
+        irrelevant_sections_selectors = selectors.get(
+            "irrelevant_sections_selectors")
 
-            relevant_html, main_section_selector, irrelevant_sections_selectors = extract_relevant_html(
-                html_document, main_section_selector, irrelevant_sections_selectors)
+        relevant_html, main_section_selector, irrelevant_sections_selectors = await extract_relevant_html(
+            html, main_section_selector, irrelevant_sections_selectors)
 
-            write_debug_file(f"relevant_html_{
-                url_key}.html", relevant_html.prettify())
+        for key in selector_keys:
+            if (selector_cache.get(key=key) or {}).get("main_section_selector") != main_section_selector:
+                selector_cache.set(key=key, value={
+                    "main_section_selector": main_section_selector,
+                    "irrelevant_sections_selectors": irrelevant_sections_selectors,
+                    "url": url,
+                })
 
-            url_selector_cache.set(key=url_key, value={
-                "main_section_selector": main_section_selector,
-                "irrelevant_sections_selectors": irrelevant_sections_selectors,
-                "url": url,
-            })
+    # Serialized once, for both the debug file and the markdown conversion
+    relevant_html_document = str(relevant_html)
+    page_span.set(relevant_html_bytes=len(relevant_html_document))
 
-            relevant_html_tags.append(relevant_html)
+    url_key = hashlib.md5(url.encode()).hexdigest()
+    write_debug_file(f"relevant_html_{url_key}.html",
+                     relevant_html_document, level="full")
 
-            progress.update(preprocessing_task, advance=1)
+    return relevant_html_document
 
-        progress.update(preprocessing_task,
+
+async def iterate_pages(pages: Union[dict, AsyncIterable]) -> AsyncIterable[tuple[str, str]]:
+    if isinstance(pages, dict):
+        for page in pages.items():
+            yield page
+    else:
+        async for page in pages:
+            yield page
+
+
+@traced()
+async def preprocess_pages(pages: Union[dict, AsyncIterable], total: Optional[int] = None,
+                           concurrency: int = DEFAULT_PREPROCESS_CONCURRENCY,
+                           selector_cache: Optional[LocalCache] = None,
+                           fingerprint_locks: Optional[dict] = None) -> tuple[dict, dict]:
+    """
+    Extract the relevant HTML of pages as they come in, `concurrency` at a time.
+    `pages` is a dict of URL to HTML, or an async iterable of `(url, html)` streamed
+    by the scraper. Returns the HTML documents and relevant HTML by URL.
+
+    Jobs running concurrently pass the same `selector_cache` and `fingerprint_locks`,
+    so a template shared by their docs is only elected once.
+    """
+    if selector_cache is None:
+        selector_cache = LocalCache(SELECTOR_CACHE_PATH)
+    if fingerprint_locks is None:
+        fingerprint_locks = defaultdict(asyncio.Lock)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    html_documents = {}
+    tasks = {}
+
+    with shared_progress():
+        preprocessing_task = progress.add_task(
+            "[bold green]Preprocessing docs...", total=total)
+
+        async def preprocess_with_limit(url: str, html_document: str) -> str:
+            async with semaphore:
+                progress.update(preprocessing_task,
+                                description=f"[bold cyan]Preprocessing[/bold cyan] {url}")
+                relevant_html_document = await preprocess_page(
+                    url, html_document, selector_cache, fingerprint_locks)
+                progress.update(preprocessing_task, advance=1)
+                return relevant_html_document
+
+        try:
+            async for url, html_document in iterate_pages(pages):
+                html_documents[url] = html_document
+                tasks[url] = asyncio.create_task(
+                    preprocess_with_limit(url, html_document))
+
+            relevant_html_documents = await asyncio.gather(*tasks.values())
+        finally:
+            for task in tasks.values():
+                task.cancel()
+
+        progress.update(preprocessing_task, total=len(tasks),
                         description="[bold green]✅ Preprocessed docs")
 
-    relevant_html_combined = "\n".join(
-        [tag.prettify() for tag in relevant_html_tags])
+    return html_documents, dict(zip(tasks.keys(), relevant_html_documents))
 
-    write_debug_file("relevant_html_combined.html", relevant_html_combined)
 
-    logger.debug(f"Start converting relevant HTML to markdown")
-    markdown = convert_html_to_markdown(relevant_html_combined)
-    write_debug_file("markdown.md", markdown)
+async def generate_openapi_spec(url_html_documents: Union[dict, AsyncIterable], user_goal: str,
+                                urls: Optional[list[str]] = None, selector_cache: Optional[LocalCache] = None,
+                                fingerprint_locks: Optional[dict] = None):
+    """
+    Generate an OpenAPI spec from docs pages, given as a dict of URL to HTML or streamed
+    as `(url, html)` while they're scraped. `urls` sets the order of the pages in the
+    prompts, so they don't depend on which page was scraped first.
+    """
+    logger.debug(f"Start generating OpenAPI spec for user goal: {user_goal}")
 
-    with Status("[bold cyan]Generating OpenAPI spec...", console=console):
+    if isinstance(url_html_documents, dict):
+        urls = urls or list(url_html_documents.keys())
+
+    html_documents, relevant_html_by_url = await preprocess_pages(
+        url_html_documents, total=len(urls) if urls else None,
+        selector_cache=selector_cache, fingerprint_locks=fingerprint_locks)
+
+    assert len(html_documents.keys()) > 0
+
+    order = {url: i for i, url in enumerate(urls or [])}
+    ordered_urls = sorted(html_documents.keys(),
+                          key=lambda url: order.get(url, len(order)))
+
+    write_debug_file("html_documents_combined.html",
+                     lambda: "\n".join(html_documents[url] for url in ordered_urls), level="full")
+
+    relevant_html_documents = [relevant_html_by_url[url]
+                               for url in ordered_urls]
+
+    relevant_html_combined = "\n".join(relevant_html_documents)
+
+    write_debug_file("relevant_html_combined.html",
+                     relevant_html_combined, level="full")
+
+    logger.debug(f"Start converting relevant HTML to markdown")
+    with span("convert_html_to_markdown", input_bytes=len(relevant_html_combined)) as markdown_span:
+        markdown = convert_html_to_markdown(relevant_html_combined)
+        markdown_span.set(output_bytes=len(markdown))
+    write_debug_file("markdown.md", markdown, level="full")
+
+    with span("select_relevant_markdown", input_bytes=len(markdown)) as relevance_span:
+        markdown = select_relevant_markdown(markdown, user_goal)
+        relevance_span.set(output_bytes=len(markdown))
+    write_debug_file("relevant_markdown.md", markdown)
+
+    # A progress task rather than a status, which would clash with the display of concurrent jobs
+    with shared_progress():
+        generating_task = progress.add_task(
+            "[bold cyan]Generating OpenAPI spec...", total=None)
         openapi_spec_json = await generate_openapi_spec_from_markdown(markdown, user_goal)
         clean_openapi_spec(openapi_spec_json)
-        console.log("[bold green]  ✅ OpenAPI spec generated")
+        progress.update(generating_task, total=1, completed=1,
+                        description="[bold green]✅ Generated OpenAPI spec")
 
-    ok, err = validate_openapi_spec(openapi_spec_json)
+    # Every error, with the JSON pointer of where it is
+    with span("validate_openapi_spec") as validation_span:
+        validation_errors = await asyncio.to_thread(validate_openapi_spec_by_path, openapi_spec_json)
+        validation_span.set(errors=len(validation_errors))
 
-    if ok:
+    if not validation_errors:
         console.log("[green bold]  ✅ OpenAPI spec is valid")
     else:
         console.log(
-            "[red bold]  ❌ OpenAPI spec is invalid (check .skyffel/openapi_validation_error.log for more details)")
+            f"[red bold]  ❌ OpenAPI spec is invalid, {len(validation_errors)} error(s) (check {debug_file_path('openapi_validation_error.log')} for more details)")
         write_debug_file("openapi_validation_error.log",
-                         "".join(traceback.format_exception(err)))
-        exit(1)
+                         "\n".join(f"{error['pointer'] or '/'}: {error['message']}" for error in validation_errors),
+                         level="none")
+        raise InvalidOpenAPISpecError(validation_errors)
 
     return openapi_spec_json
@@ -1,16 +1,18 @@
 from airbyte_connector_generator_poc.logger import logger
-from openapi_spec_validator import validate
 from airbyte_connector_generator_poc.utils import write_debug_file
-from openai import AsyncOpenAI
+from airbyte_connector_generator_poc.llm import llm
+from airbyte_connector_generator_poc.markdown_sections import chunk_markdown
+from airbyte_connector_generator_poc.prompt_budget import fit_messages, minify_json, shrink_json
+from airbyte_connector_generator_poc.tracing import current_span, span, traced
 from dotenv import load_dotenv
+import asyncio
 import os
-import requests
+import re
 import yaml
 import json
+from typing import Optional
 load_dotenv()
 
-openai = AsyncOpenAI()
-
 
 def clean_openapi_spec(openapi_spec: dict):
     if "security" in openapi_spec:
@@ -62,20 +64,21 @@ def convert_angle_brackets_to_curly_braces(yaml_content: dict):
             convert_angle_brackets_to_curly_braces(item)
 
 
-def validate_openapi_spec(openapi_spec: dict):
-    logger.debug("Validating OpenAPI spec")
-    try:
-        validate(openapi_spec)
-        return True, None
-    except Exception as e:
-        return False, e
+# Chunks of the docs are extracted concurrently, so the latency is bounded by the
+# slowest chunk instead of growing with the size of the docs
+EXTRACT_DETAILS_CHUNK_TOKENS = int(
+    os.environ.get("SKYFFEL_EXTRACT_CHUNK_TOKENS", 8_000))
+ENDPOINT_PATH_PARAMETER_PATTERN = re.compile(r"\{[^}]*\}|<[^>]*>|:[A-Za-z_]\w*")
+EXTRACT_DETAILS_MODEL = "gpt-4-turbo-preview"
+OPENAPI_SPEC_MODEL = "gpt-4-turbo-preview"
 
 
-async def extract_details(markdown: str, user_goal: str):
-    response = await openai.chat.completions.create(
-        model="gpt-4-turbo-preview",
-        temperature=0,
-        messages=[
+@traced()
+async def extract_chunk_details(markdown: str, user_goal: str, chunk_index: int, chunk_count: int) -> dict:
+    def render(max_chars: Optional[int]) -> list[dict]:
+        # A chunk too large for the model, e.g with a large SKYFFEL_EXTRACT_CHUNK_TOKENS, is cut short
+        chunk = markdown if max_chars is None else markdown[:max_chars]
+        return [
             {
                 "role": "system",
                 "content": """
@@ -85,7 +88,7 @@ Prefer Basic Authentication, API Keys and Bearer Authentication over other metho
                 
 You're an expert at extracing pagination strategies from technical API documentation written in markdown.
 
-You're an HTTP API expert. Given this API documentation in markdown, get the relevant endpoint and describe the resource with:
+You're an HTTP API expert. Given this API documentation in markdown, get the relevant endpoints and describe each resource with:
 - Path
 - HTTP Method
 - Requests body schema
@@ -94,6 +97,15 @@ You're an HTTP API expert. Given this API documentation in markdown, get the rel
 - Request cookies
 - Request query Parameters
 
+You only get a part of the documentation, extract what this part contains and leave out what it doesn't.
+Output JSON with the properties:
+- `authentication`: list of facts about authentication & authorization
+- `pagination`: list of facts about pagination
+- `versioning`: list of facts about API versions and required version headers
+- `base_urls`: list of base URLs
+- `endpoints`: list of objects with `method`, `path`, `description`, `request_headers`, `request_cookies`, `query_parameters`, `request_body_schema` and `response_schema`
+- `notes`: list of other facts relevant to the goal
+
 NEVER EVER OMIT ANYTHING FOR BREVITY.
 The user will provide a goal, make sure to follow that.
 
@@ -102,19 +114,135 @@ Take a deep breath, think step by step, and reason yourself to the correct answe
             },
             {
                 "role": "user",
-                "content": f"My goal: {user_goal}. Extract relevant information from this documentation: {markdown} "
+                "content": f"My goal: {user_goal}. Extract relevant information from part {chunk_index + 1} of {chunk_count} of this documentation: {chunk} "
             }
         ]
+
+    content = await llm.chat_completion(
+        model=EXTRACT_DETAILS_MODEL,
+        temperature=0,
+        response_format={"type": "json_object"},
+        messages=fit_messages(EXTRACT_DETAILS_MODEL, render),
     )
 
-    return response.choices[0].message.content
+    details = json.loads(content)
+    return details if isinstance(details, dict) else {}
+
+
+def normalize_endpoint_path(path: str) -> str:
+    # `/users/{id}/`, `/users/:user_id` and `/users/<id>` are the same endpoint
+    path = str(path).strip().split("?")[0].rstrip("/") or "/"
+    return ENDPOINT_PATH_PARAMETER_PATTERN.sub("{}", path).lower()
+
+
+def merge_values(value, other):
+    # Prefer the more complete value, merging objects and lists by their content
+    if value in (None, "", [], {}):
+        return merge_lists([], other) if isinstance(other, list) else other
+    if other in (None, "", [], {}):
+        return value
+
+    if isinstance(value, dict) and isinstance(other, dict):
+        merged = dict(value)
+        for key, other_value in other.items():
+            merged[key] = merge_values(merged.get(key), other_value)
+        return merged
+
+    if isinstance(value, list) and isinstance(other, list):
+        return merge_lists(value, other)
+
+    if isinstance(value, str) and isinstance(other, str):
+        return other if len(other) > len(value) else value
+
+    return value
+
+
+def merge_lists(items: list, other_items: list) -> list:
+    # Items with a `name` (parameters, headers) are merged, other items deduplicated
+    merged = list(items)
+    index_by_key = {}
+
+    for i, item in enumerate(merged):
+        index_by_key.setdefault(list_item_key(item), i)
+
+    for item in other_items:
+        key = list_item_key(item)
+        if key in index_by_key:
+            # The same fact worded slightly differently is kept as first seen
+            if not isinstance(item, str):
+                i = index_by_key[key]
+                merged[i] = merge_values(merged[i], item)
+        else:
+            index_by_key[key] = len(merged)
+            merged.append(item)
+
+    return merged
+
+
+def list_item_key(item) -> str:
+    if isinstance(item, dict) and item.get("name"):
+        return f"name:{str(item['name']).lower()}"
+    if isinstance(item, str):
+        return " ".join(item.lower().split())
+    return json.dumps(item, sort_keys=True)
+
+
+def merge_details(chunk_details: list[dict]) -> dict:
+    """
+    Reduce the details extracted from every chunk, deduplicating endpoints by
+    method and path and facts by their text.
+    """
+    merged = {}
+    endpoints = {}
+
+    for details in chunk_details:
+        for key, value in details.items():
+            if key == "endpoints":
+                continue
+            merged[key] = merge_values(merged.get(key), value)
+
+        for endpoint in details.get("endpoints") or []:
+            if not isinstance(endpoint, dict):
+                continue
+            endpoint_key = (str(endpoint.get("method", "")).upper(),
+                            normalize_endpoint_path(endpoint.get("path", "")))
+            if endpoint_key in endpoints:
+                # Keep the path as first seen, e.g `{id}` rather than `:user_id`
+                endpoints[endpoint_key] = {**merge_values(endpoints[endpoint_key], endpoint),
+                                           "method": endpoints[endpoint_key].get("method"),
+                                           "path": endpoints[endpoint_key].get("path")}
+            else:
+                endpoints[endpoint_key] = endpoint
+
+    merged["endpoints"] = list(endpoints.values())
+
+    return merged
+
+
+@traced()
+async def extract_details(markdown: str, user_goal: str):
+    chunks = chunk_markdown(markdown, EXTRACT_DETAILS_CHUNK_TOKENS)
+    current_span().set(chunks=len(chunks))
+    logger.debug(f"Extracting details from {len(chunks)} chunks")
+
+    chunk_details = await asyncio.gather(*[
+        extract_chunk_details(chunk, user_goal, i, len(chunks)) for i, chunk in enumerate(chunks)
+    ])
+
+    details = merge_details(chunk_details)
+    logger.debug(
+        f"Extracted {len(details['endpoints'])} endpoints from {len(chunks)} chunks")
+
+    return details
 
 
 async def generate_openapi_spec_from_markdown(markdown: str, user_goal: str):
     logger.debug(
         f"Start extracting relevant markdown given user goal: %s", user_goal)
 
-    info = await extract_details(markdown, user_goal)
+    details = await extract_details(markdown, user_goal)
+    write_debug_file("extracted_details.json",
+                     lambda: json.dumps(details, indent=2))
 
     SYSTEM_PROMPT = f"""
 You’re an expert at writing OpenAPI 3.0 specifications.
@@ -126,7 +254,13 @@ Keep this in mind:
 
 OUTPUT ONLY JSON!
     """
-    USER_PROMPT = f"""
+
+    def render(max_chars: Optional[int]) -> list[dict]:
+        # Indentation is a good share of the tokens of large JSON. If the details are
+        # still too large, only their top levels are sent
+        info = minify_json(
+            details) if max_chars is None else shrink_json(details, max_chars)
+        USER_PROMPT = f"""
 My goal as a user, {user_goal}. This is very important to me.
 
 # Here's the information you need:
@@ -135,27 +269,33 @@ My goal as a user, {user_goal}. This is very important to me.
 Take a deep breath, think step by step, and reason yourself to the correct answer.
 Write the OpenAPI 3.0 specification.
     """
+        return [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": USER_PROMPT}
+        ]
+
+    messages = fit_messages(OPENAPI_SPEC_MODEL, render)
 
     write_debug_file("system_prompt.txt", SYSTEM_PROMPT)
-    write_debug_file("user_prompt.txt", USER_PROMPT)
+    write_debug_file("user_prompt.txt", messages[1]["content"])
 
     logger.debug("Generating OpenAPI spec")
 
-    response = await openai.chat.completions.create(
-        messages=[
-            {"role": "system", "content": SYSTEM_PROMPT},
-            {"role": "user", "content": USER_PROMPT}
-        ],
-        model="gpt-4-turbo-preview",
-        temperature=0,
-        response_format={"type": "json_object"}
-    )
+    with span("write_openapi_spec"):
+        content = await llm.chat_completion(
+            messages=messages,
+            model=OPENAPI_SPEC_MODEL,
+            temperature=0,
+            response_format={"type": "json_object"}
+        )
 
-    return json.loads(response.choices[0].message.content)
+    return json.loads(content)
 
 
 def load_openapi_spec_from_path_or_url(path: str):
     if path.startswith("http"):
+        import requests
+
         response = requests.get(path)
         openapi_spec_raw = response.json()
     else:
@@ -0,0 +1,185 @@
+import hashlib
+import importlib.metadata
+import json
+import multiprocessing
+import os
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+from airbyte_connector_generator_poc.airbyte.refs import resolve_json_pointer
+from airbyte_connector_generator_poc.local_cache import LocalCache
+from airbyte_connector_generator_poc.logger import logger
+from airbyte_connector_generator_poc.utils import SKYFFEL_DIR
+
+OPENAPI_VALIDATION_CACHE_PATH = os.path.join(
+    SKYFFEL_DIR, "openapi_validation_cache.sqlite")
+DEFAULT_VALIDATION_WORKERS = min(os.cpu_count() or 1, 8)
+# Starting workers costs more than validating a handful of path items serially
+MIN_PARALLEL_JOBS = 16
+
+HTTP_METHODS = ["get", "put", "post", "delete",
+                "options", "head", "patch", "trace"]
+
+
+class InvalidOpenAPISpecError(Exception):
+    """
+    A generated OpenAPI spec doesn't validate, `errors` are the errors with their JSON pointers.
+    """
+
+    def __init__(self, errors: list[dict]):
+        super().__init__(f"OpenAPI spec is invalid, {len(errors)} error(s)")
+        self.errors = errors
+
+
+def json_pointer(parts) -> str:
+    return "".join("/" + str(part).replace("~", "~0").replace("/", "~1") for part in parts)
+
+
+def collect_component_refs(value, spec: dict, refs: set):
+    # Components a value references, directly or through other components
+    if isinstance(value, dict):
+        ref = value.get("$ref")
+        if isinstance(ref, str) and ref.startswith("#/components/") and ref not in refs:
+            refs.add(ref)
+            # Schemas are stubbed, so what they reference isn't needed
+            if not ref.startswith("#/components/schemas/"):
+                collect_component_refs(
+                    resolve_json_pointer(spec, ref), spec, refs)
+        for item in value.values():
+            collect_component_refs(item, spec, refs)
+    elif isinstance(value, list):
+        for item in value:
+            collect_component_refs(item, spec, refs)
+
+
+def referenced_components(value, spec: dict) -> dict:
+    """
+    The components a path item needs to be validated on its own. Schemas are validated
+    with the rest of the components, so they're replaced by an empty (valid) schema:
+    changing one doesn't invalidate the cached results of the path items using it.
+    """
+    refs = set()
+    collect_component_refs(value, spec, refs)
+
+    components = defaultdict(dict)
+    for ref in refs:
+        parts = ref.split("/")
+        if len(parts) == 4:
+            # Components are `#/components/<type>/<name>`, names can't contain `/`
+            name = parts[3].replace("~1", "/").replace("~0", "~")
+            component = spec.get("components", {}).get(parts[2], {})
+            if name in component:
+                components[parts[2]][name] = {} if parts[2] == "schemas" else component[name]
+
+    return dict(components)
+
+
+def build_validation_jobs(openapi_spec: dict) -> list[tuple[Optional[str], dict]]:
+    """
+    Split a spec into independently valid specs: everything but the paths, then each
+    path item with the components it references.
+    """
+    jobs = [(None, {**openapi_spec, "paths": {}})]
+
+    for path, path_item in openapi_spec.get("paths", {}).items():
+        path_spec = {key: value for key, value in openapi_spec.items()
+                     if key in ["openapi", "info"]}
+        path_spec["paths"] = {path: path_item}
+        components = referenced_components(path_item, openapi_spec)
+        if components:
+            path_spec["components"] = components
+        jobs.append((path, path_spec))
+
+    return jobs
+
+
+def validate_job(job: tuple[Optional[str], dict]) -> list[dict]:
+    # Runs in a worker process
+    from openapi_spec_validator.shortcuts import get_validator_cls
+
+    path, spec = job
+    path_parts = [] if path is None else ["paths", path]
+    errors = []
+
+    try:
+        validator = get_validator_cls(spec)(spec)
+        validation_errors = list(validator.iter_errors())
+    except Exception as err:
+        return [{"pointer": json_pointer(path_parts), "message": str(err)}]
+
+    for error in validation_errors:
+        error_path = list(getattr(error, "absolute_path", []) or [])
+
+        # Errors of the checks beyond the JSON schema of OpenAPI have a path relative
+        # to the object they're about, they're reported at the closest known location
+        if not error_path or error_path[0] not in spec:
+            error_path = path_parts
+        elif path is not None and error_path[:2] != path_parts:
+            # Reported by the validation of everything but the paths
+            continue
+
+        errors.append({"pointer": json_pointer(error_path),
+                       "message": error.message})
+
+    return errors
+
+
+def find_duplicate_operation_ids(openapi_spec: dict) -> list[dict]:
+    # Uniqueness spans path items, so it can't be checked per path item
+    pointers_by_operation_id = defaultdict(list)
+
+    for path, path_item in openapi_spec.get("paths", {}).items():
+        for method, operation in (path_item or {}).items():
+            if method in HTTP_METHODS and isinstance(operation, dict) and "operationId" in operation:
+                pointers_by_operation_id[operation["operationId"]].append(
+                    (path, json_pointer(["paths", path, method, "operationId"])))
+
+    # Duplicates within a path item are reported by its own validation
+    return [{"pointer": pointer, "message": f"Operation ID '{operation_id}' is not unique"}
+            for operation_id, pointers in pointers_by_operation_id.items()
+            for path, pointer in pointers[1:] if path != pointers[0][0]]
+
+
+def job_cache_key(job: tuple[Optional[str], dict]) -> str:
+    validator_version = importlib.metadata.version("openapi-spec-validator")
+    content = json.dumps([validator_version, *job],
+                         sort_keys=True, default=str)
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+def validate_openapi_spec_by_path(openapi_spec: dict, workers: int = DEFAULT_VALIDATION_WORKERS,
+                                  use_cache: bool = True) -> list[dict]:
+    """
+    Validate the components and each path item of a spec independently, in a worker
+    pool for large specs. Returns every error with the JSON pointer of its location.
+
+    Results are cached by the content of what's validated, so on a spec that changed
+    only the changed path items are validated again.
+    """
+    jobs = build_validation_jobs(openapi_spec)
+    cache = LocalCache(OPENAPI_VALIDATION_CACHE_PATH) if use_cache else None
+
+    keys = [job_cache_key(job) for job in jobs]
+    results = [cache.get(key) if cache else None for key in keys]
+    pending = [i for i, result in enumerate(results) if result is None]
+
+    logger.debug(
+        f"Validating {len(pending)} of {len(jobs)} parts of the OpenAPI spec")
+
+    if len(pending) >= MIN_PARALLEL_JOBS and workers > 1:
+        # Spawned, forking the threaded event loop process isn't safe
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+            pending_results = list(executor.map(
+                validate_job, [jobs[i] for i in pending], chunksize=max(len(pending) // (workers * 4), 1)))
+    else:
+        pending_results = [validate_job(jobs[i]) for i in pending]
+
+    for i, result in zip(pending, pending_results):
+        results[i] = result
+        if cache:
+            cache.set(key=keys[i], value=result)
+
+    errors = [error for result in results for error in result]
+    errors += find_duplicate_operation_ids(openapi_spec)
+
+    return errors
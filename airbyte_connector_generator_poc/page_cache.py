@@ -0,0 +1,75 @@
+import hashlib
+import os
+import time
+from typing import Optional
+from airbyte_connector_generator_poc.local_cache import LocalCache
+from airbyte_connector_generator_poc.utils import SKYFFEL_DIR
+
+PAGE_CACHE_DIR = os.path.join(SKYFFEL_DIR, "page_cache")
+# Seconds a page is reused as is after it was fetched or revalidated, 0 to always revalidate
+PAGE_CACHE_MAX_AGE = float(os.environ.get("SKYFFEL_PAGE_CACHE_MAX_AGE", 0))
+
+
+class PageCache():
+    """
+    URL-keyed cache of scraped pages. The HTML is stored in its own file next to
+    an index holding the validators (ETag/Last-Modified) used to revalidate it.
+
+    Pages fetched or revalidated less than `max_age` seconds ago are fresh, and
+    reused without a request. Older pages without validators are fetched again.
+    """
+
+    def __init__(self, cache_dir=PAGE_CACHE_DIR, max_age: float = PAGE_CACHE_MAX_AGE):
+        self.cache_dir = cache_dir
+        self.max_age = max_age
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.index = LocalCache(os.path.join(self.cache_dir, "index.sqlite"))
+
+    def _key(self, url: str) -> str:
+        return hashlib.md5(url.encode()).hexdigest()
+
+    def _html_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.html")
+
+    def get(self, url: str) -> Optional[dict]:
+        key = self._key(url)
+        entry = self.index.get(key)
+        if entry is None or not os.path.exists(self._html_path(key)):
+            return None
+        with open(self._html_path(key), 'r') as file:
+            return {**entry, "html": file.read()}
+
+    def set(self, url: str, html: str, etag: Optional[str] = None, last_modified: Optional[str] = None):
+        key = self._key(url)
+        html_path = self._html_path(key)
+        # Write to a temporary file first so an interrupted run never leaves a truncated page
+        tmp_path = f"{html_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as file:
+            file.write(html)
+        os.replace(tmp_path, html_path)
+        self.index.set(key=key, value={
+            "url": url,
+            "etag": etag,
+            "last_modified": last_modified,
+            "fetched_at": time.time(),
+        })
+
+    def is_fresh(self, cached_page: dict) -> bool:
+        return time.time() - cached_page.get("fetched_at", 0) < self.max_age
+
+    def touch(self, url: str):
+        key = self._key(url)
+        entry = self.index.get(key)
+        if entry is not None:
+            self.index.set(key=key, value={**entry, "fetched_at": time.time()})
+
+
+def conditional_request_headers(cached_page: Optional[dict]) -> dict:
+    headers = {}
+    if cached_page is None:
+        return headers
+    if cached_page.get("etag"):
+        headers["If-None-Match"] = cached_page["etag"]
+    if cached_page.get("last_modified"):
+        headers["If-Modified-Since"] = cached_page["last_modified"]
+    return headers
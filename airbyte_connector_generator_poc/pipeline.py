@@ -0,0 +1,285 @@
+import asyncio
+import os
+import time
+import traceback
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Optional
+import yaml
+from rich.console import Console
+from rich.table import Table
+from airbyte_connector_generator_poc.llm import LLMUsage, llm_usage
+from airbyte_connector_generator_poc.local_cache import LocalCache
+from airbyte_connector_generator_poc.logger import logger
+from airbyte_connector_generator_poc.scraper import SharedBrowser, stream_urls
+from airbyte_connector_generator_poc.tracing import span
+from airbyte_connector_generator_poc.utils import debug_dir, debug_file_path, dump_yaml, nuke_debug_directory, validate_urls, write_debug_file
+
+console = Console(log_time=False)
+
+OPENAPI_SPEC_FILE_NAME = "openapi.yaml"
+AIRBYTE_CONNECTOR_FILE_NAME = "airbyte_connector.yaml"
+
+DEFAULT_BATCH_WORKERS = 2
+
+# Scraping options a manifest can set, for every job under `defaults` or per job,
+# named like the CLI options
+MANIFEST_SCRAPE_OPTIONS = {
+    "concurrency": "concurrency",
+    "timeout": "timeout",
+    "wait_strategy": "wait_strategy",
+    "block_resources": "block_resources",
+    "fetch_mode": "fetch_mode",
+    "cache": "use_cache",
+    "from_cache": "from_cache",
+}
+MANIFEST_JOB_KEYS = ["name", "goal", "urls",
+                     "output_dir", *MANIFEST_SCRAPE_OPTIONS]
+
+
+class SharedResources():
+    """
+    What the jobs of a batch share: the browser, the selector cache and the locks
+    electing selectors per page template. The LLM client, its rate limiter and the
+    LLM cache are shared by every job of the process already.
+    """
+
+    def __init__(self):
+        from airbyte_connector_generator_poc.openapi_generator import SELECTOR_CACHE_PATH
+
+        self.browser = SharedBrowser()
+        self.selector_cache = LocalCache(SELECTOR_CACHE_PATH)
+        self.fingerprint_locks = defaultdict(asyncio.Lock)
+
+    async def close(self):
+        await self.browser.close()
+        self.selector_cache.close()
+
+
+@contextmanager
+def timed(timings: dict, stage: str):
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] = time.perf_counter() - started_at
+
+
+async def run_pipeline(goal: str, urls: list[str], output_dir: str = ".", shared: Optional[SharedResources] = None,
+                       timings: Optional[dict] = None, **scrape_options) -> dict:
+    """
+    Scrape the docs, generate the OpenAPI spec and the Airbyte connector, and write
+    both to `output_dir`. Returns the connector, raises if either doesn't validate.
+    `timings` is filled with the seconds spent on each stage, even when it fails.
+    """
+    from airbyte_connector_generator_poc.airbyte.airbyte import generate_airbyte_connector
+    from airbyte_connector_generator_poc.airbyte.validation import (InvalidAirbyteConnectorError, format_validation_error,
+                                                                    iter_airbyte_connector_errors, validate_airbyte_connector)
+    from airbyte_connector_generator_poc.openapi_generator import generate_openapi_spec
+    from airbyte_connector_generator_poc.progress import progress, shared_progress
+
+    timings = {} if timings is None else timings
+    urls = validate_urls(urls)
+    os.makedirs(output_dir, exist_ok=True)
+
+    with span("run_pipeline", goal=goal, pages=len(urls), output_dir=output_dir):
+        with timed(timings, "openapi_spec"), span("openapi_spec"):
+            logger.debug(f"Start scraping URLs: %s", urls)
+            # Pages are preprocessed as soon as they're scraped
+            html_documents = stream_urls(urls, **scrape_options,
+                                         shared_browser=shared.browser if shared else None)
+
+            openapi_spec = await generate_openapi_spec(
+                url_html_documents=html_documents, user_goal=goal, urls=urls,
+                selector_cache=shared.selector_cache if shared else None,
+                fingerprint_locks=shared.fingerprint_locks if shared else None)
+
+        with open(os.path.join(output_dir, OPENAPI_SPEC_FILE_NAME), 'w') as file:
+            dump_yaml(openapi_spec, file)
+
+        with timed(timings, "airbyte_connector"), span("airbyte_connector"), shared_progress():
+            generating_task = progress.add_task(
+                "[bold cyan]Generating Airbyte connector...", total=None)
+            airbyte_connector = await generate_airbyte_connector(openapi_spec)
+            progress.update(generating_task, total=1, completed=1,
+                            description="[bold green]✅ Generated Airbyte connector")
+
+        logger.debug(f"Writing airbyte connector")
+        with open(os.path.join(output_dir, AIRBYTE_CONNECTOR_FILE_NAME), 'w') as f:
+            dump_yaml(airbyte_connector, f)
+
+        with span("validate_airbyte_connector") as validation_span:
+            ok, err = validate_airbyte_connector(airbyte_connector)
+            validation_span.set(valid=ok)
+
+        if ok:
+            console.log("[green bold]  ✅ Airbyte connector is valid")
+        else:
+            console.log(
+                f"[red bold]  ❌ Airbyte connector is invalid (check {debug_file_path('airbyte_validation_error.log')} for more details)")
+            # The most relevant error first, then every violation with its path
+            errors = [format_validation_error(error)
+                      for error in iter_airbyte_connector_errors(airbyte_connector)]
+            write_debug_file("airbyte_validation_error.log",
+                             "".join(traceback.format_exception(err)) + "\n" + "\n".join(errors), level="none")
+            raise InvalidAirbyteConnectorError(err, errors)
+
+        return airbyte_connector
+
+
+def load_manifest(manifest_path: str) -> list[dict]:
+    """
+    Load the jobs of a batch manifest:
+
+    ```yaml
+    defaults:
+      fetch_mode: http
+    jobs:
+      - name: notion
+        goal: extract all pages from notion
+        urls: [https://developers.notion.com/reference/post-search]
+        output_dir: connectors/notion
+    ```
+
+    `output_dir` defaults to the job name, and relative paths are relative to the manifest.
+    """
+    with open(manifest_path, "r") as file:
+        manifest = yaml.safe_load(file) or {}
+
+    defaults = manifest.get("defaults") or {}
+    unknown_defaults = set(defaults) - set(MANIFEST_SCRAPE_OPTIONS)
+    if unknown_defaults:
+        raise ValueError(
+            f"Unknown defaults in {manifest_path}: {sorted(unknown_defaults)}")
+
+    if not manifest.get("jobs"):
+        raise ValueError(f"No jobs found in {manifest_path}")
+
+    manifest_dir = os.path.dirname(os.path.abspath(manifest_path))
+    jobs = []
+
+    for i, job in enumerate(manifest["jobs"]):
+        name = str(job.get("name") or f"job-{i + 1}")
+
+        unknown_keys = set(job) - set(MANIFEST_JOB_KEYS)
+        if unknown_keys:
+            raise ValueError(
+                f"Unknown keys in job `{name}`: {sorted(unknown_keys)}")
+        if not job.get("goal"):
+            raise ValueError(f"Job `{name}` has no goal")
+        if not job.get("urls"):
+            raise ValueError(f"Job `{name}` has no URLs")
+
+        urls = job["urls"] if isinstance(job["urls"], list) else [job["urls"]]
+        options = {**defaults, **{key: value for key, value in job.items()
+                                  if key in MANIFEST_SCRAPE_OPTIONS}}
+
+        jobs.append({
+            "name": name,
+            "goal": job["goal"],
+            "urls": urls,
+            "output_dir": os.path.join(manifest_dir, job.get("output_dir") or name),
+            "scrape_options": {MANIFEST_SCRAPE_OPTIONS[key]: value for key, value in options.items()},
+        })
+
+    for key in ["name", "output_dir"]:
+        values = [job[key] for job in jobs]
+        duplicates = sorted({value for value in values if values.count(value) > 1})
+        if duplicates:
+            raise ValueError(
+                f"Jobs must have distinct {key}s, found duplicates: {duplicates}")
+
+    return jobs
+
+
+async def run_job(job: dict, shared: Optional[SharedResources] = None) -> dict:
+    # Runs in its own task, so the debug directory and usage set here are the job's own
+    usage = LLMUsage()
+    llm_usage.set(usage)
+    debug_dir.set(os.path.join(job["output_dir"], ".skyffel"))
+    # Waits for the files other jobs have queued, off the event loop. The thread
+    # inherits the job's debug directory
+    await asyncio.to_thread(nuke_debug_directory)
+
+    result = {"name": job["name"], "output_dir": job["output_dir"],
+              "status": "ok", "error": None, "timings": {}, "usage": usage}
+
+    console.log(f"[bold]Starting job {job['name']}")
+
+    with timed(result["timings"], "total"), span("job", name=job["name"]) as job_span:
+        try:
+            await run_pipeline(job["goal"], job["urls"], job["output_dir"], shared=shared,
+                               timings=result["timings"], **job["scrape_options"])
+        except Exception as e:
+            logger.debug("Job %s failed", job["name"], exc_info=True)
+            write_debug_file("error.log", traceback.format_exc(), level="none")
+            result["status"] = "failed"
+            result["error"] = str(e) or e.__class__.__name__
+            job_span.fail(result["error"])
+
+    if result["status"] == "ok":
+        console.log(f"[green bold]✅ Job {job['name']} done")
+    else:
+        console.log(
+            f"[red bold]❌ Job {job['name']} failed: {result['error']}")
+
+    return result
+
+
+async def run_batch(jobs: list[dict], workers: int = DEFAULT_BATCH_WORKERS) -> list[dict]:
+    """
+    Run jobs `workers` at a time, sharing one browser and the caches.
+    A failed job doesn't stop the others. Returns the result of each job, in order.
+    """
+    if workers < 1:
+        raise ValueError("Workers must be at least 1.")
+
+    shared = SharedResources()
+    semaphore = asyncio.Semaphore(workers)
+
+    async def run_with_limit(job: dict) -> dict:
+        async with semaphore:
+            return await run_job(job, shared)
+
+    try:
+        with span("batch", jobs=len(jobs), workers=workers):
+            return await asyncio.gather(*[run_with_limit(job) for job in jobs])
+    finally:
+        await shared.close()
+
+
+def format_duration(seconds: Optional[float]) -> str:
+    return "-" if seconds is None else f"{seconds:.1f}s"
+
+
+def print_batch_summary(results: list[dict]):
+    table = Table(title="Batch summary")
+    table.add_column("Job")
+    table.add_column("Status")
+    table.add_column("Spec", justify="right")
+    table.add_column("Connector", justify="right")
+    table.add_column("Total", justify="right")
+    table.add_column("LLM calls", justify="right")
+    table.add_column("Cached", justify="right")
+    table.add_column("Tokens (in/out)", justify="right")
+
+    for result in results:
+        timings = result["timings"]
+        usage = result["usage"]
+        table.add_row(
+            result["name"],
+            "[green]✅ ok" if result["status"] == "ok" else "[red]❌ failed",
+            format_duration(timings.get("openapi_spec")),
+            format_duration(timings.get("airbyte_connector")),
+            format_duration(timings.get("total")),
+            str(usage.requests),
+            str(usage.cache_hits),
+            f"{usage.prompt_tokens}/{usage.completion_tokens}",
+        )
+
+    console.print(table)
+
+    for result in results:
+        if result["status"] != "ok":
+            console.print(
+                f"[red]{result['name']}[/red]: {result['error']} (see {os.path.relpath(os.path.join(result['output_dir'], '.skyffel'))})")
@@ -0,0 +1,32 @@
+from contextlib import contextmanager
+from rich.progress import Progress
+from rich.progress import SpinnerColumn, TextColumn, BarColumn, TaskProgressColumn, TimeElapsedColumn
+
+# Rich allows a single live display at a time, so the stages running concurrently
+# (scraping, preprocessing) add their tasks to this one
+progress = Progress(
+    SpinnerColumn(),
+    TextColumn("[progress.description]{task.description}"),
+    BarColumn(),
+    TaskProgressColumn(),
+    TimeElapsedColumn(),
+)
+
+_active_stages = 0
+
+
+@contextmanager
+def shared_progress():
+    # The display is started by the first stage and stopped when the last one is done
+    global _active_stages
+
+    if _active_stages == 0:
+        progress.start()
+    _active_stages += 1
+
+    try:
+        yield progress
+    finally:
+        _active_stages -= 1
+        if _active_stages == 0:
+            progress.stop()
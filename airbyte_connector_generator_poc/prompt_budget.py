@@ -0,0 +1,228 @@
+import functools
+import importlib.util
+import json
+import os
+from typing import Callable, Optional
+from airbyte_connector_generator_poc.logger import logger
+
+# Context windows of the models in use, in tokens. Unknown models get the smallest.
+MODEL_CONTEXT_TOKENS = {
+    "gpt-4-turbo-preview": 128_000,
+    "gpt-3.5-turbo": 16_385,
+}
+DEFAULT_CONTEXT_TOKENS = 8_192
+# Left for the completion when fitting a prompt to the budget, as no request sets `max_tokens`
+DEFAULT_COMPLETION_TOKENS = int(os.environ.get(
+    "SKYFFEL_COMPLETION_TOKENS", 4_096))
+# Optional cap on every prompt, below the context window, e.g to bound costs
+MAX_PROMPT_TOKENS = int(os.environ["SKYFFEL_PROMPT_MAX_TOKENS"]) if os.environ.get(
+    "SKYFFEL_PROMPT_MAX_TOKENS") else None
+
+# Tokens the chat format adds around each message, and before the reply
+MESSAGE_OVERHEAD_TOKENS = 4
+REPLY_OVERHEAD_TOKENS = 3
+
+# Schema keywords only there for humans, dropped when a schema has to shrink
+SCHEMA_DOC_KEYS = ["description", "example", "examples", "externalDocs"]
+# Keywords whose keys are names, e.g a property called `description`
+SCHEMA_NAMED_KEYS = ["properties", "patternProperties", "definitions", "$defs"]
+
+
+class PromptTooLargeError(Exception):
+    def __init__(self, model: str, tokens: int, budget: int):
+        self.model = model
+        self.tokens = tokens
+        self.budget = budget
+        super().__init__(
+            f"Prompt of {tokens} tokens is over the budget of {budget} tokens for {model}")
+
+
+def estimate_tokens(text: str) -> int:
+    # Roughly 4 characters per token for English text and code
+    return len(text) // 4 + 1
+
+
+@functools.lru_cache(maxsize=None)
+def get_encoding(model: str):
+    # tiktoken is optional, and needs to download its encodings on first use
+    if importlib.util.find_spec("tiktoken") is None:
+        return None
+
+    import tiktoken
+
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        logger.debug(
+            "tiktoken encoding unavailable (%s), estimating tokens from characters", e)
+        return None
+
+
+def count_tokens(text: str, model: str) -> int:
+    encoding = get_encoding(model)
+    if encoding is None:
+        return estimate_tokens(text)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def count_message_tokens(messages: list[dict], model: str) -> int:
+    return sum(count_tokens(str(message.get("content", "")), model) + MESSAGE_OVERHEAD_TOKENS
+               for message in messages) + REPLY_OVERHEAD_TOKENS
+
+
+def message_chars(messages: list[dict]) -> int:
+    return sum(len(str(message.get("content", ""))) for message in messages)
+
+
+def prompt_budget(model: str, completion_tokens: int = DEFAULT_COMPLETION_TOKENS) -> int:
+    budget = MODEL_CONTEXT_TOKENS.get(model, DEFAULT_CONTEXT_TOKENS) - completion_tokens
+    return min(budget, MAX_PROMPT_TOKENS) if MAX_PROMPT_TOKENS else budget
+
+
+def check_prompt(params: dict):
+    """
+    Raise `PromptTooLargeError` if the messages of a request don't fit the context
+    window of its model, less its `max_tokens`, so it fails before waiting on the rate
+    limits rather than after. Prompts are fitted with room for the completion beforehand,
+    this only rejects the ones the API would.
+    """
+    model = params.get("model")
+    budget = prompt_budget(model, params.get("max_tokens") or 0)
+    messages = params.get("messages", [])
+
+    # A token is at least a character, so short prompts fit without tokenizing them
+    chars = message_chars(messages)
+    if chars + len(messages) * MESSAGE_OVERHEAD_TOKENS + REPLY_OVERHEAD_TOKENS <= budget:
+        return
+
+    tokens = count_message_tokens(messages, model)
+    if tokens > budget:
+        raise PromptTooLargeError(model, tokens, budget)
+
+
+def fit_messages(model: str, render: Callable[[Optional[int]], list[dict]],
+                 max_completion_tokens: Optional[int] = None, attempts: int = 4) -> list[dict]:
+    """
+    Build the messages of a request within the budget of its model. `render(max_chars)`
+    returns the messages with their compressible part, e.g docs or an HTML tree, cut to
+    `max_chars` characters, or in full with `None`.
+
+    When the full prompt is over budget, the compressible part is sized from the tokens
+    per character it measured, and shrunk further if the tokenizer disagrees. Raises
+    `PromptTooLargeError` if even the rest of the prompt doesn't fit.
+    """
+    budget = prompt_budget(
+        model, max_completion_tokens or DEFAULT_COMPLETION_TOKENS)
+
+    messages = render(None)
+    tokens = count_message_tokens(messages, model)
+    if tokens <= budget:
+        return messages
+
+    fixed_messages = render(0)
+    fixed_tokens = count_message_tokens(fixed_messages, model)
+    if fixed_tokens >= budget:
+        raise PromptTooLargeError(model, fixed_tokens, budget)
+
+    full_tokens = tokens
+    chars = message_chars(messages) - message_chars(fixed_messages)
+    chars_per_token = chars / max(tokens - fixed_tokens, 1)
+    max_chars = int((budget - fixed_tokens) * chars_per_token)
+
+    for _ in range(attempts):
+        messages = render(max_chars)
+        tokens = count_message_tokens(messages, model)
+        if tokens <= budget:
+            logger.debug("Compressed prompt for %s from %d to %d tokens",
+                         model, full_tokens, tokens)
+            return messages
+        max_chars = int(max_chars * budget / tokens * 0.95)
+
+    raise PromptTooLargeError(model, tokens, budget)
+
+
+def strip_schema_docs(schema):
+    # Descriptions and examples of a JSON schema, recursively
+    if isinstance(schema, list):
+        return [strip_schema_docs(item) for item in schema]
+    if not isinstance(schema, dict):
+        return schema
+
+    stripped = {}
+    for key, value in schema.items():
+        if key in SCHEMA_DOC_KEYS:
+            continue
+        if key in SCHEMA_NAMED_KEYS and isinstance(value, dict):
+            stripped[key] = {name: strip_schema_docs(item)
+                             for name, item in value.items()}
+        else:
+            stripped[key] = strip_schema_docs(value)
+    return stripped
+
+
+def minify_json(value) -> str:
+    return json.dumps(value, separators=(",", ":"), sort_keys=True)
+
+
+def json_depth(value) -> int:
+    if isinstance(value, dict):
+        return 1 + max((json_depth(item) for item in value.values()), default=0)
+    if isinstance(value, list):
+        return 1 + max((json_depth(item) for item in value), default=0)
+    return 0
+
+
+def limit_json_depth(value, depth: int):
+    # Objects and arrays nested deeper than `depth` are replaced by "..."
+    if isinstance(value, (dict, list)) and depth <= 0:
+        return "..."
+    if isinstance(value, dict):
+        return {key: limit_json_depth(item, depth - 1) for key, item in value.items()}
+    if isinstance(value, list):
+        return [limit_json_depth(item, depth - 1) for item in value]
+    return value
+
+
+def shrink_json(value, max_chars: int) -> str:
+    """
+    Minified JSON of `value` in at most `max_chars` characters, keeping as many of its
+    top levels as fit. If not even the top level fits, an object is replaced by the list
+    of its keys that fit, and anything else by an empty placeholder, so it's always valid.
+    """
+    serialized = minify_json(value)
+    if len(serialized) <= max_chars:
+        return serialized
+
+    # The deepest limit that fits, the length only grows with the depth
+    shrunk = None
+    low, high = 1, json_depth(value) - 1
+    while low <= high:
+        depth = (low + high) // 2
+        limited = minify_json(limit_json_depth(value, depth))
+        if len(limited) <= max_chars:
+            shrunk = limited
+            low = depth + 1
+        else:
+            high = depth - 1
+
+    if shrunk is not None:
+        return shrunk
+    return json_placeholder(value, max_chars)
+
+
+def json_placeholder(value, max_chars: int) -> str:
+    if isinstance(value, dict):
+        keys = []
+        chars = len("[]")
+        for key in sorted(value):
+            chars += len(json.dumps(key)) + (1 if keys else 0)
+            if chars > max_chars:
+                break
+            keys.append(key)
+        return minify_json(keys) if keys else "{}"
+    if isinstance(value, list):
+        return "[]"
+    return '""' if isinstance(value, str) else "null"
@@ -0,0 +1,106 @@
+import math
+import os
+import re
+from collections import Counter
+from typing import Optional
+from airbyte_connector_generator_poc.prompt_budget import estimate_tokens
+from airbyte_connector_generator_poc.logger import logger
+from airbyte_connector_generator_poc.markdown_sections import split_markdown_sections
+
+DEFAULT_TOP_K = int(os.environ.get("SKYFFEL_RELEVANCE_TOP_K", 30))
+DEFAULT_MAX_TOKENS = int(os.environ.get("SKYFFEL_RELEVANCE_MAX_TOKENS", 30_000))
+
+# BM25 parameters
+K1 = 1.5
+B = 0.75
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+STOPWORDS = {"a", "an", "the", "and", "or", "of", "to", "in", "on", "for", "from", "with", "by",
+             "at", "as", "is", "are", "be", "it", "this", "that", "all", "every", "each", "my",
+             "i", "we", "want", "get", "extract", "fetch", "sync", "data", "api"}
+# Sections needed for any connector, whatever the goal
+ALWAYS_KEPT_SECTION_PATTERN = re.compile(
+    r"\b(auth\w*|api[ _-]?keys?|bearer|tokens?|oauth\w*|versions?|versioning|paginat\w*|cursors?|base[ _-]?urls?)\b",
+    re.IGNORECASE)
+
+
+def stem(token: str) -> str:
+    # Just enough stemming for `entries` to match `entry` and `posts` to match `post`
+    if len(token) > 4 and token.endswith("ies"):
+        return token[:-3] + "y"
+    if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+        return token[:-1]
+    return token
+
+
+def tokenize(text: str) -> list[str]:
+    return [stem(token) for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOPWORDS]
+
+
+def bm25_scores(query: list[str], documents: list[list[str]]) -> list[float]:
+    if not documents:
+        return []
+
+    average_length = sum(len(document) for document in documents) / len(documents) or 1
+    document_frequency = Counter(
+        token for document in documents for token in set(document))
+
+    scores = []
+    for document in documents:
+        term_frequency = Counter(document)
+        score = 0.0
+        for token in set(query):
+            if token not in term_frequency:
+                continue
+            idf = math.log(1 + (len(documents) - document_frequency[token] + 0.5) /
+                           (document_frequency[token] + 0.5))
+            tf = term_frequency[token]
+            score += idf * tf * (K1 + 1) / \
+                (tf + K1 * (1 - B + B * len(document) / average_length))
+        scores.append(score)
+
+    return scores
+
+
+def select_relevant_markdown(markdown: str, user_goal: str, top_k: Optional[int] = DEFAULT_TOP_K,
+                             max_tokens: int = DEFAULT_MAX_TOKENS,
+                             always_kept_pattern: Optional[re.Pattern] = ALWAYS_KEPT_SECTION_PATTERN) -> str:
+    """
+    Keep the markdown sections most relevant to the goal, ranked locally with BM25.
+    Sections whose headings match `always_kept_pattern`, by default those about
+    authentication, versioning and pagination, are always kept first, then the `top_k`
+    best scoring ones, as long as they fit in `max_tokens`.
+    Sections are returned in their original order.
+    """
+    sections = split_markdown_sections(markdown)
+
+    # Headings count twice, and a section inherits the headings it's nested in,
+    # e.g `### Response` under `## List blog entries`
+    documents = [tokenize(" ".join(section["path"] * 2) + " " + section["content"])
+                 for section in sections]
+    scores = bm25_scores(tokenize(user_goal), documents)
+
+    always_kept = [i for i, section in enumerate(sections)
+                   if always_kept_pattern and always_kept_pattern.search(" ".join(section["path"]))]
+    always_kept_set = set(always_kept)
+    ranked = [i for i in sorted(range(len(sections)), key=lambda i: -scores[i])
+              if scores[i] > 0 and i not in always_kept_set][:top_k]
+
+    if not ranked:
+        # Nothing matches the goal, keep the docs as they are up to the budget
+        logger.debug("No section matches the goal, keeping sections in order")
+        ranked = [i for i in range(len(sections)) if i not in always_kept_set]
+
+    selected = set()
+    tokens = 0
+    for i in always_kept + ranked:
+        section_tokens = estimate_tokens(sections[i]["content"])
+        if tokens + section_tokens > max_tokens:
+            continue
+        selected.add(i)
+        tokens += section_tokens
+
+    logger.debug(
+        f"Kept {len(selected)} of {len(sections)} sections ({tokens} of {estimate_tokens(markdown)} tokens)")
+
+    return "\n\n".join(sections[i]["content"] for i in sorted(selected))
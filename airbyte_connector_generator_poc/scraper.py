@@ -1,36 +1,448 @@
-from playwright.async_api import async_playwright
-from rich.progress import Progress
-from rich.progress import SpinnerColumn, TextColumn, BarColumn, TaskProgressColumn, TimeElapsedColumn
+import asyncio
+from typing import TYPE_CHECKING, AsyncIterator, Callable, Optional
+from urllib.parse import urlparse
+from airbyte_connector_generator_poc.logger import logger
+from airbyte_connector_generator_poc.progress import progress, shared_progress
+from airbyte_connector_generator_poc.page_cache import PageCache, conditional_request_headers
+from airbyte_connector_generator_poc.html_parser import parse_html
+from airbyte_connector_generator_poc.tracing import current_span, span, traced
 
-progress = Progress(
-    SpinnerColumn(),
-    TextColumn("[progress.description]{task.description}"),
-    BarColumn(),
-    TaskProgressColumn(),
-    TimeElapsedColumn(),
-)
+# httpx and playwright are imported when scraping starts, so the CLI starts fast
+if TYPE_CHECKING:
+    import httpx
+    from playwright.async_api import Browser, Page, Route
 
+DEFAULT_CONCURRENCY = 5
+DEFAULT_TIMEOUT = 60
+DEFAULT_WAIT_STRATEGY = "stable:500"
+DEFAULT_FETCH_MODE = "auto"
 
-async def scrape_urls(urls: list[str]) -> dict:
-    with progress:
-        scrape_progress_task = progress.add_task(
-            "[bold cyan]Scraping URLs...", total=len(urls))
+# auto: plain HTTP first, headless browser only for pages that need rendering
+# http: plain HTTP only
+# browser: headless browser only
+FETCH_MODES = ["auto", "http", "browser"]
+
+# A server-rendered docs page has at least this much text in its main content
+MIN_STATIC_CONTENT_CHARS = 500
+MAIN_CONTENT_SELECTORS = ["main", "article", "[role=main]"]
+# Mount points of client-side rendered apps, empty until JavaScript runs
+SPA_ROOT_SELECTORS = ["#root", "#app", "#__next",
+                      "#__nuxt", "#svelte", "[data-reactroot]", "app-root"]
+
+USER_AGENT = "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36"
+
+# Upper bound for the "stable" strategy, so pages with never-ending DOM churn
+# (tickers, carousels) are captured as-is instead of timing out
+STABLE_MAX_WAIT_MS = 10_000
+
+# We only need the DOM, so anything that doesn't contribute to it is aborted
+BLOCKED_RESOURCE_TYPES = ["image", "media", "font",
+                          "stylesheet", "texttrack", "manifest", "eventsource"]
+BLOCKED_HOSTS = [
+    "google-analytics.com",
+    "googletagmanager.com",
+    "googlesyndication.com",
+    "doubleclick.net",
+    "facebook.net",
+    "segment.com",
+    "segment.io",
+    "hotjar.com",
+    "intercom.io",
+    "intercomcdn.com",
+    "hs-scripts.com",
+    "hs-analytics.net",
+    "mixpanel.com",
+    "amplitude.com",
+    "fullstory.com",
+    "sentry.io",
+    "heapanalytics.com",
+    "clarity.ms",
+    "plausible.io",
+]
+
+WAIT_STRATEGIES = ["load", "domcontentloaded",
+                   "networkidle", "selector", "stable"]
+
+WAIT_FOR_STABLE_DOM_JS = """
+([quietMs, maxMs]) => new Promise((resolve) => {
+    let quietTimer;
+    const done = (stable) => {
+        observer.disconnect();
+        clearTimeout(quietTimer);
+        clearTimeout(maxTimer);
+        resolve(stable);
+    };
+    const observer = new MutationObserver(() => {
+        clearTimeout(quietTimer);
+        quietTimer = setTimeout(() => done(true), quietMs);
+    });
+    observer.observe(document, { childList: true, subtree: true, characterData: true });
+    quietTimer = setTimeout(() => done(true), quietMs);
+    const maxTimer = setTimeout(() => done(false), maxMs);
+})
+"""
+
+def parse_wait_strategy(wait_strategy: str) -> tuple[str, Optional[str]]:
+    """
+    Parse a wait strategy of the form `<kind>` or `<kind>:<argument>`.
+
+    Supported strategies:
+    - `load`, `domcontentloaded`, `networkidle`: Playwright load states
+    - `selector:<css selector>`: wait until the selector is attached to the DOM
+    - `stable:<ms>`: wait until the DOM hasn't changed for the given milliseconds
+    """
+    kind, _, argument = wait_strategy.partition(":")
+    kind = kind.strip()
+    argument = argument.strip() or None
+
+    if kind not in WAIT_STRATEGIES:
+        raise ValueError(
+            f"Unknown wait strategy `{wait_strategy}`, expected one of {WAIT_STRATEGIES}")
+    if kind == "selector" and argument is None:
+        raise ValueError(
+            "The `selector` wait strategy requires a CSS selector, e.g `selector:main`")
+    if kind == "stable" and not (argument or "0").isdigit():
+        raise ValueError(
+            f"The `stable` wait strategy takes milliseconds, e.g `stable:500`, got `{argument}`")
+
+    return kind, argument
+
+
+def has_rendered_content(html: str) -> bool:
+    """
+    Heuristically check if a document fetched without a browser already contains
+    the page content, i.e it's server-rendered rather than a client-side app shell.
+    """
+    document = parse_html(html)
+
+    for selector in SPA_ROOT_SELECTORS:
+        root = document.select_one(selector)
+        if root is not None and not root.get_text(strip=True):
+            return False
+
+    for tag in document(["script", "style", "noscript", "template", "svg"]):
+        tag.decompose()
+
+    containers = [container for selector in MAIN_CONTENT_SELECTORS
+                  for container in document.select(selector)]
+    if not containers and document.body is not None:
+        containers = [document.body]
+
+    text_length = sum(len(container.get_text(" ", strip=True))
+                      for container in containers)
+
+    return text_length >= MIN_STATIC_CONTENT_CHARS
+
+
+async def fetch_static_url(client: "httpx.AsyncClient", url: str, fetch_mode: str,
+                           page_cache: Optional[PageCache] = None) -> tuple[Optional[str], dict]:
+    """
+    Fetch a URL without a browser, revalidating the cached copy if there is one
+    and it isn't fresh.
+    Returns `None` as HTML if the page has to be rendered by a browser instead,
+    together with the validators to cache the rendered page with.
+
+    Browser-rendered pages are revalidated against the server document, so a
+    page whose content is loaded by client-side requests only is re-rendered
+    when the server says its document changed.
+    """
+    import httpx
+
+    cached_page = page_cache.get(url) if page_cache else None
+    if cached_page is not None and page_cache.is_fresh(cached_page):
+        logger.debug("%s fetched recently, using cached page", url)
+        return cached_page["html"], {}
+    request_headers = conditional_request_headers(cached_page)
+
+    if fetch_mode == "browser" and not request_headers:
+        # Nothing to revalidate, and the response would be thrown away
+        return None, {}
+
+    try:
+        response = await client.get(url, headers=request_headers)
+        if response.status_code == 304:
+            logger.debug("%s not modified, using cached page", url)
+            page_cache.touch(url)
+            return cached_page["html"], {}
+        response.raise_for_status()
+    except httpx.HTTPError as e:
+        if fetch_mode == "http":
+            raise
+        logger.debug(
+            "Plain HTTP fetch of %s failed (%s), escalating to browser", url, e)
+        return None, {}
+
+    validators = {
+        "etag": response.headers.get("etag"),
+        "last_modified": response.headers.get("last-modified"),
+    }
+
+    if fetch_mode == "browser":
+        return None, validators
+
+    content_type = response.headers.get("content-type", "")
+    if "html" not in content_type:
+        if fetch_mode == "http":
+            raise ValueError(
+                f"Expected an HTML document from {url}, got `{content_type}`")
+        logger.debug("%s is not HTML (%s), escalating to browser",
+                     url, content_type)
+        return None, validators
+
+    html = response.text
+
+    if not has_rendered_content(html):
+        if fetch_mode == "auto":
+            logger.debug(
+                "%s looks client-side rendered, escalating to browser", url)
+            return None, validators
+        logger.warning(
+            "%s looks client-side rendered, the scraped content might be incomplete", url)
+
+    if page_cache:
+        page_cache.set(url, html, **validators)
+
+    return html, validators
+
+
+def is_blocked_request(resource_type: str, url: str) -> bool:
+    if resource_type in BLOCKED_RESOURCE_TYPES:
+        return True
+    host = urlparse(url).hostname or ""
+    return any(host == blocked or host.endswith(f".{blocked}") for blocked in BLOCKED_HOSTS)
+
+
+async def block_unneeded_resources(route: "Route"):
+    request = route.request
+    if is_blocked_request(request.resource_type, request.url):
+        await route.abort()
+    else:
+        await route.continue_()
+
+
+async def wait_until_ready(page: "Page", url: str, wait_strategy: str):
+    kind, argument = parse_wait_strategy(wait_strategy)
+
+    if kind in ["load", "networkidle"]:
+        await page.goto(url, wait_until=kind)
+        return
+
+    await page.goto(url, wait_until="domcontentloaded")
+
+    if kind == "selector":
+        await page.wait_for_selector(argument, state="attached")
+    elif kind == "stable":
+        quiet_ms = int(argument or 500)
+        stable = await page.evaluate(WAIT_FOR_STABLE_DOM_JS, [quiet_ms, STABLE_MAX_WAIT_MS])
+        if not stable:
+            logger.debug(
+                "DOM of %s kept changing for %dms, using it as-is", url, STABLE_MAX_WAIT_MS)
 
+
+async def scrape_url(browser: "Browser", url: str, timeout: float = DEFAULT_TIMEOUT,
+                     wait_strategy: str = DEFAULT_WAIT_STRATEGY, block_resources: bool = True) -> str:
+    # Every URL gets its own context so cookies/storage don't leak between
+    # pages, and closing the context releases the page and its memory.
+    context = await browser.new_context()
+    try:
+        if block_resources:
+            await context.route("**/*", block_unneeded_resources)
+        page = await context.new_page()
+        page.set_default_timeout(timeout * 1000)
+        await wait_until_ready(page, url, wait_strategy)
+        return await page.content()
+    finally:
+        await context.close()
+
+
+async def fetch_static_urls(urls: list[str], concurrency: int, timeout: float, fetch_mode: str,
+                            page_cache: Optional[PageCache], on_scraped) -> tuple[dict, dict]:
+    import httpx
+
+    limits = httpx.Limits(max_connections=concurrency,
+                          max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=timeout, follow_redirects=True,
+                                 headers={"User-Agent": USER_AGENT}) as client:
         content_by_url = {}
-        async with async_playwright() as p:
-            browser = await p.chromium.launch()
-            for url in urls:
-                progress.update(scrape_progress_task,
-                                description=f"[bold cyan]Scraping[/bold cyan] {url}")
-                page = await browser.new_page()
-                await page.goto(url)
-                await page.wait_for_load_state("networkidle")
-                content = await page.content()
+        validators_by_url = {}
+
+        async def fetch(url: str):
+            with span("fetch_page", url=url) as page_span:
+                content, validators = await fetch_static_url(client, url, fetch_mode, page_cache)
+                page_span.set(html_bytes=len(content or ""),
+                              escalated=content is None)
+            if content is not None:
                 content_by_url[url] = content
-                progress.update(scrape_progress_task, advance=1)
+                # Handed over as soon as it's fetched, not when every page is
+                on_scraped(url, content)
+            else:
+                validators_by_url[url] = validators
+
+        await asyncio.gather(*[fetch(url) for url in urls])
+
+    return content_by_url, validators_by_url
+
+
+def load_cached_pages(urls: list[str], page_cache: PageCache, on_scraped) -> dict:
+    content_by_url = {}
+    missing_urls = []
+
+    for url in urls:
+        cached_page = page_cache.get(url)
+        if cached_page is None:
+            missing_urls.append(url)
+            continue
+        content_by_url[url] = cached_page["html"]
+        on_scraped(url, cached_page["html"])
+
+    if missing_urls:
+        raise ValueError(f"URLs not found in the page cache: {missing_urls}")
+
+    return content_by_url
+
+
+class SharedBrowser():
+    """
+    A Chromium launched on first use and shared by every scrape until closed, e.g by
+    the jobs of a batch. Pages are isolated by their own context either way.
+    """
+
+    def __init__(self):
+        self._playwright = None
+        self._browser = None
+        self._lock = None
+
+    async def get(self) -> "Browser":
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if self._browser is None:
+                from playwright.async_api import async_playwright
+
+                self._playwright = await async_playwright().start()
+                self._browser = await self._playwright.chromium.launch()
+        return self._browser
+
+    async def close(self):
+        if self._browser is not None:
+            await self._browser.close()
+            await self._playwright.stop()
+            self._browser = None
+            self._playwright = None
+
+
+async def scrape_with_browser(urls: list[str], concurrency: int, timeout: float, wait_strategy: str,
+                              block_resources: bool, on_scraped, shared_browser: Optional[SharedBrowser] = None) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def scrape_all(browser: "Browser") -> list[str]:
+        async def scrape_with_limit(url: str) -> str:
+            async with semaphore:
+                with span("render_page", url=url) as page_span:
+                    try:
+                        content = await asyncio.wait_for(
+                            scrape_url(browser, url, timeout,
+                                       wait_strategy, block_resources),
+                            timeout)
+                    except asyncio.TimeoutError:
+                        raise TimeoutError(
+                            f"Timed out after {timeout}s scraping {url}")
+                    page_span.set(html_bytes=len(content))
+                on_scraped(url, content)
+                return content
+
+        return await asyncio.gather(*[scrape_with_limit(url) for url in urls])
+
+    if shared_browser is not None:
+        # Closed by its owner once every job is done
+        contents = await scrape_all(await shared_browser.get())
+        return dict(zip(urls, contents))
+
+    from playwright.async_api import async_playwright
+
+    async with async_playwright() as p:
+        browser = await p.chromium.launch()
+        try:
+            contents = await scrape_all(browser)
+        finally:
             await browser.close()
 
+    return dict(zip(urls, contents))
+
+
+@traced()
+async def scrape_urls(urls: list[str], concurrency: int = DEFAULT_CONCURRENCY, timeout: float = DEFAULT_TIMEOUT,
+                      wait_strategy: str = DEFAULT_WAIT_STRATEGY, block_resources: bool = True,
+                      fetch_mode: str = DEFAULT_FETCH_MODE, use_cache: bool = True, from_cache: bool = False,
+                      on_page: Optional[Callable[[str, str], None]] = None,
+                      shared_browser: Optional[SharedBrowser] = None) -> dict:
+    if concurrency < 1:
+        raise ValueError("Concurrency must be at least 1.")
+    if fetch_mode not in FETCH_MODES:
+        raise ValueError(
+            f"Unknown fetch mode `{fetch_mode}`, expected one of {FETCH_MODES}")
+    # Fail before launching the browser if the strategy is malformed
+    parse_wait_strategy(wait_strategy)
+    current_span().set(pages=len(urls), fetch_mode=fetch_mode,
+                       from_cache=from_cache)
+
+    page_cache = PageCache() if use_cache or from_cache else None
+
+    with shared_progress():
+        scrape_progress_task = progress.add_task(
+            "[bold cyan]Scraping URLs...", total=len(urls))
+
+        def on_scraped(url: str, content: str):
+            logger.debug("Scraped %s (%d chars)", url, len(content))
+            progress.update(scrape_progress_task, advance=1,
+                            description=f"[bold cyan]Scraped[/bold cyan] {url}")
+            if on_page:
+                on_page(url, content)
+
+        if from_cache:
+            content_by_url = load_cached_pages(urls, page_cache, on_scraped)
+            progress.update(scrape_progress_task,
+                            description="[bold green]✅ Loaded URLs from cache")
+            return content_by_url
+
+        content_by_url, validators_by_url = await fetch_static_urls(
+            urls, concurrency, timeout, fetch_mode, page_cache, on_scraped=on_scraped)
+
+        remaining_urls = [url for url in urls if url not in content_by_url]
+
+        if remaining_urls:
+            progress.update(scrape_progress_task,
+                            description=f"[bold cyan]Rendering[/bold cyan] {len(remaining_urls)} page(s) in browser")
+            rendered_by_url = await scrape_with_browser(
+                remaining_urls, concurrency, timeout, wait_strategy, block_resources, on_scraped=on_scraped,
+                shared_browser=shared_browser)
+            if page_cache:
+                for url, content in rendered_by_url.items():
+                    page_cache.set(url, content, **
+                                   validators_by_url.get(url, {}))
+            content_by_url.update(rendered_by_url)
+
         progress.update(scrape_progress_task,
                         description="[bold green]✅ Scraped URLs")
 
-        return content_by_url
+        return {url: content_by_url[url] for url in urls}
+
+
+async def stream_urls(urls: list[str], **options) -> AsyncIterator[tuple[str, str]]:
+    """
+    Scrape URLs like `scrape_urls`, yielding `(url, html)` as soon as each page is
+    scraped, so the next stage can start before the slowest page is done.
+    Pages come in the order they're scraped, not the order of `urls`.
+    """
+    queue = asyncio.Queue()
+    scraping = asyncio.create_task(scrape_urls(
+        urls, **options, on_page=lambda url, content: queue.put_nowait((url, content))))
+    scraping.add_done_callback(lambda _: queue.put_nowait(None))
+
+    try:
+        while (page := await queue.get()) is not None:
+            yield page
+        # Raises the scraping error, if any
+        await scraping
+    finally:
+        scraping.cancel()
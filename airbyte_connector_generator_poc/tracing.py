@@ -0,0 +1,252 @@
+import functools
+import inspect
+import json
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, Optional
+
+TRACE_FORMATS = ["otlp", "json"]
+SERVICE_NAME = "skyffel"
+
+# Attributes of LLM spans, named after the OpenTelemetry semantic conventions for GenAI
+MODEL_ATTRIBUTE = "gen_ai.request.model"
+INPUT_TOKENS_ATTRIBUTE = "gen_ai.usage.input_tokens"
+OUTPUT_TOKENS_ATTRIBUTE = "gen_ai.usage.output_tokens"
+CACHE_HIT_ATTRIBUTE = "llm.cache_hit"
+
+
+class Span():
+    """
+    A timed step of a run, nested in the span that was current when it started.
+    """
+
+    def __init__(self, name: str, parent: Optional["Span"], attributes: dict):
+        self.name = name
+        self.trace_id = parent.trace_id if parent else secrets.token_hex(16)
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent.span_id if parent else None
+        self.attributes = attributes
+        self.error = None
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+
+    @property
+    def duration(self) -> float:
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e9
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def add(self, **amounts):
+        # Counters, e.g retries
+        for key, amount in amounts.items():
+            self.attributes[key] = self.attributes.get(key, 0) + amount
+
+    def fail(self, error: str):
+        # For errors handled within the span, raised ones are recorded already
+        self.error = error
+
+
+class NoopSpan():
+    # Handed out while tracing is off, so instrumented code doesn't check
+    def set(self, **attributes):
+        pass
+
+    def add(self, **amounts):
+        pass
+
+    def fail(self, error: str):
+        pass
+
+
+NOOP_SPAN = NoopSpan()
+
+# Tasks and threads started within a span inherit it as their parent
+_current_span: ContextVar[Optional[Span]] = ContextVar(
+    "current_span", default=None)
+
+
+class Tracer():
+    """
+    Collects the spans of a run when enabled, e.g by `--trace`. Disabled, spans cost
+    a flag check.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.spans = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name: str, /, **attributes) -> Iterator[Span]:
+        if not self.enabled:
+            yield NOOP_SPAN
+            return
+
+        span = Span(name, _current_span.get(), attributes)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.error = f"{e.__class__.__name__}: {e}"
+            raise
+        finally:
+            span.end_ns = time.time_ns()
+            _current_span.reset(token)
+            with self._lock:
+                self.spans.append(span)
+
+
+tracer = Tracer()
+
+
+def span(name: str, /, **attributes):
+    return tracer.span(name, **attributes)
+
+
+def current_span():
+    span = _current_span.get()
+    return span if span is not None and tracer.enabled else NOOP_SPAN
+
+
+def traced(name: Optional[str] = None):
+    """
+    Run every call of the decorated function, sync or async, in a span named after it.
+    """
+    def decorator(fn):
+        span_name = name or fn.__name__
+
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def wrapper(*args, **kwargs):
+                if not tracer.enabled:
+                    return await fn(*args, **kwargs)
+                with tracer.span(span_name):
+                    return await fn(*args, **kwargs)
+        else:
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                if not tracer.enabled:
+                    return fn(*args, **kwargs)
+                with tracer.span(span_name):
+                    return fn(*args, **kwargs)
+
+        return wrapper
+    return decorator
+
+
+def otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        # 64 bit integers are strings in OTLP/JSON
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    if isinstance(value, (list, tuple)):
+        return {"arrayValue": {"values": [otlp_value(item) for item in value]}}
+    return {"stringValue": str(value)}
+
+
+def to_otlp(spans: list[Span]) -> dict:
+    # OTLP/JSON, as accepted by OpenTelemetry collectors and Jaeger
+    return {"resourceSpans": [{
+        "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": SERVICE_NAME}}]},
+        "scopeSpans": [{
+            "scope": {"name": SERVICE_NAME},
+            "spans": [{
+                "traceId": span.trace_id,
+                "spanId": span.span_id,
+                **({"parentSpanId": span.parent_id} if span.parent_id else {}),
+                "name": span.name,
+                # Internal, the OpenAI requests are client spans
+                "kind": 3 if MODEL_ATTRIBUTE in span.attributes else 1,
+                "startTimeUnixNano": str(span.start_ns),
+                "endTimeUnixNano": str(span.end_ns),
+                "attributes": [{"key": key, "value": otlp_value(value)}
+                               for key, value in span.attributes.items()],
+                "status": {"code": 2, "message": span.error} if span.error else {"code": 1},
+            } for span in sorted(spans, key=lambda span: span.start_ns)],
+        }],
+    }]}
+
+
+def to_json(spans: list[Span]) -> dict:
+    return {"spans": [{
+        "name": span.name,
+        "trace_id": span.trace_id,
+        "span_id": span.span_id,
+        "parent_id": span.parent_id,
+        "start": span.start_ns / 1e9,
+        "duration_ms": round(span.duration * 1000, 3),
+        "attributes": span.attributes,
+        "error": span.error,
+    } for span in sorted(spans, key=lambda span: span.start_ns)]}
+
+
+def export_trace(file_path: str, format: str = "otlp"):
+    if format not in TRACE_FORMATS:
+        raise ValueError(
+            f"Unknown trace format `{format}`, expected one of {TRACE_FORMATS}")
+
+    with tracer._lock:
+        spans = list(tracer.spans)
+
+    with open(file_path, "w") as file:
+        json.dump(to_otlp(spans) if format == "otlp" else to_json(spans),
+                  file, indent=2, default=str)
+
+
+def span_path(span: Span, spans_by_id: dict) -> tuple[str, ...]:
+    path = [span.name]
+    while span.parent_id in spans_by_id:
+        span = spans_by_id[span.parent_id]
+        path.append(span.name)
+    return tuple(reversed(path))
+
+
+def summarize_spans(spans: list[Span]) -> list[dict]:
+    # Spans with the same path of names together, e.g every extraction request, in the order they first started
+    spans_by_id = {span.span_id: span for span in spans}
+    summary = {}
+    for span in sorted(spans, key=lambda span: span.start_ns):
+        path = span_path(span, spans_by_id)
+        row = summary.setdefault(path, {
+            "name": span.name, "depth": len(path) - 1, "calls": 0, "errors": 0,
+            "total": 0.0, "max": 0.0, "input_tokens": 0, "output_tokens": 0, "cache_hits": 0})
+        row["calls"] += 1
+        row["errors"] += span.error is not None
+        row["total"] += span.duration
+        row["max"] = max(row["max"], span.duration)
+        row["input_tokens"] += span.attributes.get(INPUT_TOKENS_ATTRIBUTE, 0)
+        row["output_tokens"] += span.attributes.get(OUTPUT_TOKENS_ATTRIBUTE, 0)
+        row["cache_hits"] += span.attributes.get(CACHE_HIT_ATTRIBUTE) is True
+    return list(summary.values())
+
+
+def print_trace_summary(console):
+    from rich.table import Table
+
+    table = Table(title="Trace summary")
+    table.add_column("Span", no_wrap=True)
+    table.add_column("Calls", justify="right")
+    table.add_column("Time", justify="right")
+    table.add_column("Max", justify="right")
+    table.add_column("Tokens (in/out)", justify="right")
+    table.add_column("Cached", justify="right")
+
+    with tracer._lock:
+        spans = list(tracer.spans)
+
+    for row in summarize_spans(spans):
+        # Indented under their parent, in red if any of them failed
+        name = "  " * row["depth"] + row["name"]
+        table.add_row(f"[red]{name} ({row['errors']} failed)" if row["errors"] else name,
+                      str(row["calls"]), f"{row['total']:.2f}s", f"{row['max']:.2f}s",
+                      f"{row['input_tokens']}/{row['output_tokens']}" if row["input_tokens"] or row["output_tokens"] else "-",
+                      str(row["cache_hits"]) if row["cache_hits"] else "-")
+
+    console.print(table)
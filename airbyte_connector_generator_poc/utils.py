@@ -1,14 +1,115 @@
+import atexit
+import gzip
+import queue
 import re
+import threading
 import yaml
 import os
 import validators
 import os
 import shutil
+from contextvars import ContextVar
+from typing import Callable, Optional, Union
 from airbyte_connector_generator_poc.logger import logger
 
 
 ENV_PATH = os.path.join(os.getcwd(), ".env")
 SKYFFEL_DIR = os.path.join(os.getcwd(), ".skyffel")
+# Caches that outlive a single run, everything else in SKYFFEL_DIR is debug output
+PERSISTENT_DEBUG_ENTRIES = ["selector_cache.sqlite",
+                            "page_cache", "llm_cache.sqlite", "openapi_validation_cache.sqlite"]
+
+# Where debug files are written, set per job when several run concurrently.
+# Caches stay in SKYFFEL_DIR so they're shared by every job
+debug_dir: ContextVar[str] = ContextVar("debug_dir", default=SKYFFEL_DIR)
+
+# none: only the error reports the console points to
+# summary: what's sent to the LLM (relevant markdown, extracted details, prompts)
+# full: every intermediate artifact, e.g the raw and relevant HTML of each page
+DEBUG_ARTIFACT_LEVELS = ["none", "summary", "full"]
+# Artifacts at least this large are gzipped, unset to never compress
+DEBUG_GZIP_MIN_BYTES = int(os.environ["SKYFFEL_DEBUG_GZIP_MIN_BYTES"]) \
+    if os.environ.get("SKYFFEL_DEBUG_GZIP_MIN_BYTES") else None
+
+
+def resolve_debug_artifact_level(level: Optional[str] = None) -> str:
+    level = (level or os.environ.get(
+        "SKYFFEL_DEBUG_ARTIFACTS", "summary")).lower()
+    if level not in DEBUG_ARTIFACT_LEVELS:
+        raise ValueError(
+            f"Unknown debug artifact level `{level}`, expected one of {DEBUG_ARTIFACT_LEVELS}")
+    return level
+
+
+DEBUG_ARTIFACT_LEVEL = resolve_debug_artifact_level()
+
+
+def set_debug_artifact_level(level: Optional[str]):
+    # E.g from the command line, over SKYFFEL_DEBUG_ARTIFACTS
+    global DEBUG_ARTIFACT_LEVEL
+    DEBUG_ARTIFACT_LEVEL = resolve_debug_artifact_level(level)
+
+
+class DebugFileWriter():
+    """
+    Writes debug files on a background thread, in the order they're queued, so large
+    artifacts don't block the event loop. Content given as a callable is serialized
+    on the writer thread too. Pending files are written before the process exits.
+    """
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def write(self, file_path: str, content: Union[str, Callable[[], str]], compress: bool = False):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="debug-file-writer", daemon=True)
+                self._thread.start()
+                atexit.register(self.flush)
+        self._queue.put((file_path, content, compress))
+
+    def flush(self):
+        if self._thread is not None:
+            self._queue.join()
+
+    def _run(self):
+        while True:
+            file_path, content, compress = self._queue.get()
+            try:
+                self._write(file_path, content, compress)
+            except Exception:
+                logger.debug(
+                    f"Failed to write debug file: {file_path}", exc_info=True)
+            finally:
+                self._queue.task_done()
+
+    def _write(self, file_path: str, content: Union[str, Callable[[], str]], compress: bool):
+        data = (content() if callable(content) else content).encode()
+
+        if compress and DEBUG_GZIP_MIN_BYTES is not None and len(data) >= DEBUG_GZIP_MIN_BYTES:
+            file_path += ".gz"
+            data = gzip.compress(data, compresslevel=6)
+
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        with open(file_path, 'wb') as file:
+            file.write(data)
+        logger.debug(f"Debug file written: {file_path}")
+
+
+debug_file_writer = DebugFileWriter()
+
+
+class NoAliasDumper(yaml.SafeDumper):
+    # Expanded refs share their subtrees, which are written out in full rather than as anchors
+    def ignore_aliases(self, data):
+        return True
+
+
+def dump_yaml(data, file):
+    yaml.dump(data, file, Dumper=NoAliasDumper)
 
 
 def extract_yaml_from_markdown(content) -> dict:
@@ -22,7 +123,7 @@ def extract_yaml_from_markdown(content) -> dict:
     try:
         return yaml.safe_load(yaml_content.strip())
     except Exception as e:
-        write_debug_file("error_extracting_yaml.txt", content)
+        write_debug_file("error_extracting_yaml.txt", content, level="none")
         logger.debug(f"Error extracting YAML: {yaml_content}")
         raise e
 
@@ -54,21 +155,38 @@ def validate_urls(urls: list[str]):
     return urls
 
 
-def write_debug_file(file_name, content):
-    if not os.path.exists(SKYFFEL_DIR):
-        os.makedirs(SKYFFEL_DIR)
-    file_path = os.path.join(SKYFFEL_DIR, file_name)
-    with open(file_path, 'w') as file:  # Changed mode from 'w' to 'a' to append if file exists
-        file.write(content)
-    logger.debug(f"Debug file written: {file_path}")
+def write_debug_file(file_name, content: Union[str, Callable[[], str]], level: str = "summary"):
+    """
+    Queue a debug file, written if the artifact level is at least `level`. Error
+    reports use `none`, so they're always written. Pass a callable to defer building
+    the content, it's never called if the file isn't written.
+    """
+    if DEBUG_ARTIFACT_LEVELS.index(level) > DEBUG_ARTIFACT_LEVELS.index(DEBUG_ARTIFACT_LEVEL):
+        return
+    # Resolved now, the writer thread doesn't see the debug directory of the job
+    file_path = os.path.join(debug_dir.get(), file_name)
+    # Error reports are read as is
+    debug_file_writer.write(file_path, content, compress=level != "none")
+
+
+def is_persistent_debug_entry(item: str) -> bool:
+    # SQLite keeps its write-ahead log next to the database, e.g `selector_cache.sqlite-wal`
+    return any(item == entry or item.startswith(f"{entry}-") for entry in PERSISTENT_DEBUG_ENTRIES)
+
+
+def debug_file_path(file_name) -> str:
+    return os.path.relpath(os.path.join(debug_dir.get(), file_name))
 
 
 def nuke_debug_directory():
-    if not os.path.exists(SKYFFEL_DIR):
+    # Files of the previous run still queued would land after the reset
+    debug_file_writer.flush()
+    directory = debug_dir.get()
+    if not os.path.exists(directory):
         return
-    for item in os.listdir(SKYFFEL_DIR):
-        item_path = os.path.join(SKYFFEL_DIR, item)
-        if item != "selector_cache.json":
+    for item in os.listdir(directory):
+        item_path = os.path.join(directory, item)
+        if not is_persistent_debug_entry(item):
             if os.path.isfile(item_path) or os.path.islink(item_path):
                 os.unlink(item_path)
             else:
@@ -0,0 +1,131 @@
+"""
+Benchmark `build_html_tree` against the previous recursive implementation.
+
+Usage:
+    python -m benchmarks.bench_html_tree [PAGE.html ...] [--repeat N]
+
+Without pages, synthetic documentation pages of increasing size and depth are used.
+Save real docs pages (e.g from `.skyffel/page_cache`) to benchmark those instead.
+"""
+import argparse
+import sys
+import time
+from bs4 import BeautifulSoup, Tag
+from airbyte_connector_generator_poc.html_tree import EXCLUDED_TAGS, build_html_tree
+
+
+def legacy_build_html_tree(element: Tag, level=0) -> str:
+    # The recursive implementation with repeated concatenation, kept as the baseline
+    ast = ""
+    if element.name and element.name not in EXCLUDED_TAGS:
+        attributes = []
+        for k, v in element.attrs.items():
+            if k not in ["style", "class"]:
+                if not isinstance(v, list):
+                    attributes.append(f'{k}="{v}"')
+                else:
+                    exclusion_rules = ['css-', 'js-', 'r-']
+                    filtered_values = []
+                    for attr in v:
+                        if not any(attr.startswith(rule) for rule in exclusion_rules):
+                            digit_count = sum(c.isdigit() for c in attr)
+                            if digit_count <= 2:
+                                filtered_values.append(attr)
+                    if filtered_values:
+                        attributes.append(f'{k}="{" ".join(filtered_values)}"')
+        attribute_str = str(" ".join(attributes))
+        ast += (f"<{element.name} {attribute_str.strip()}>" if attribute_str else f"<{element.name}>").replace("\n", "").strip()
+        for child in element.children:
+            if isinstance(child, Tag) and child.name not in EXCLUDED_TAGS:
+                ast += legacy_build_html_tree(child, level +
+                                              1).replace("\n", "").strip()
+        if element.name and element.name not in EXCLUDED_TAGS:
+            ast += f"</{element.name}>".replace("\n", "").strip()
+    return ast
+
+
+def synthetic_docs_page(endpoints: int, nesting: int, layout_depth: int = 30) -> str:
+    nav = "".join(
+        f'<li><a href="/reference/endpoint-{i}" data-id="nav-{i}">Endpoint {i}</a></li>' for i in range(endpoints))
+    sections = []
+    for i in range(endpoints):
+        params = "".join(
+            f'<tr><td><code>param_{j}</code></td><td>string</td><td>Parameter {j} of endpoint {i}</td></tr>' for j in range(8))
+        wrapped = "".join(f'<div class="css-{k} wrapper" data-depth="{k}">' for k in range(nesting)) + \
+            f"<p>Example response of endpoint {i}</p>" + "</div>" * nesting
+        sections.append(f"""
+            <section id="endpoint-{i}" aria-labelledby="title-{i}">
+                <h2 id="title-{i}">GET /v1/resources/{i}</h2>
+                <p>Retrieve resource {i}. <a href="#auth">Requires authentication</a>.</p>
+                <table rel="params list"><thead><tr><th>Name</th><th>Type</th><th>Description</th></tr></thead>
+                <tbody>{params}</tbody></table>
+                <pre><code class="language-json">{{"id": "{i}", "object": "resource"}}</code></pre>
+                {wrapped}
+            </section>""")
+    return f"""<!DOCTYPE html>
+        <html><head><title>API reference</title><script>window.analytics = {{}}</script><style>body {{}}</style></head>
+        <body>
+            <header><nav aria-label="main"><ul>{nav}</ul></nav></header>
+            <aside class="sidebar"><ul>{nav}</ul></aside>
+            {'<div class="layout">' * layout_depth}<main id="content">{"".join(sections)}</main>{"</div>" * layout_depth}
+            <footer><p>Footer</p><svg><path d="M0 0"/></svg></footer>
+        </body></html>"""
+
+
+def time_call(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("pages", nargs="*")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.pages:
+        documents = {}
+        for path in args.pages:
+            with open(path, "r") as file:
+                documents[path] = file.read()
+    else:
+        documents = {
+            f"synthetic {endpoints} endpoints, depth {nesting}": synthetic_docs_page(endpoints, nesting)
+            for endpoints, nesting in [(20, 10), (100, 40), (300, 150), (20, 1500)]
+        }
+
+    print(f"{'page':<45} {'html':>10} {'legacy':>10} {'iterative':>10} {'speedup':>8}")
+
+    for name, document in documents.items():
+        html = BeautifulSoup(document, "html.parser")
+
+        try:
+            expected = legacy_build_html_tree(html)
+            legacy_time = time_call(
+                lambda: legacy_build_html_tree(html), args.repeat)
+        except RecursionError:
+            expected = None
+
+        output = build_html_tree(html)
+        if expected is not None and output != expected:
+            print(f"{name}: output differs from the legacy implementation")
+            sys.exit(1)
+
+        iterative_time = time_call(lambda: build_html_tree(html), args.repeat)
+
+        if expected is None:
+            legacy_column, speedup_column = "recursion", "-"
+        else:
+            legacy_column = f"{legacy_time * 1000:.1f}ms"
+            speedup_column = f"{legacy_time / iterative_time:.1f}x"
+
+        print(f"{name[:45]:<45} {len(document):>10} {legacy_column:>10} {iterative_time * 1000:>8.1f}ms {speedup_column:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Guard the startup time of the CLI, measured with `python -X importtime`.
+
+Usage:
+    python -m benchmarks.bench_import_time [--module MODULE ...] [--repeat N] [--budget-ms MS]
+
+Each module is imported in a fresh interpreter `--repeat` times. The best cumulative
+import time is compared against the budget, and modules only needed once a run starts
+(OpenAI, Playwright, httpx, bs4, the spec validators) must not be imported at all.
+Exits with an error if either check fails, and lists the slowest imports.
+"""
+import argparse
+import subprocess
+import sys
+
+# The CLI, and the stages it imports once a run starts, which must stay lazy too
+DEFAULT_MODULES = ["airbyte_connector_generator_poc.main",
+                   "airbyte_connector_generator_poc.pipeline",
+                   "airbyte_connector_generator_poc.openapi_generator",
+                   "airbyte_connector_generator_poc.airbyte.airbyte"]
+DEFAULT_BUDGET_MS = 400
+
+# Imported on first use, a top-level import of any of these is a regression
+LAZY_MODULES = ["openai", "playwright", "httpx", "bs4", "lxml", "html2text",
+                "openapi_spec_validator", "jsonschema", "requests", "tiktoken"]
+
+
+def parse_importtime(stderr: str) -> dict[str, tuple[int, int]]:
+    # `import time: self [us] | cumulative | imported package`
+    timings = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        timings[name.strip()] = (int(self_us), int(cumulative_us))
+    return timings
+
+
+def measure(module: str) -> dict[str, tuple[int, int]]:
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        print(result.stderr)
+        sys.exit(1)
+    return parse_importtime(result.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--module", action="append", dest="modules")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS)
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    failed = False
+
+    for module in args.modules or DEFAULT_MODULES:
+        # The best run, the others are mostly noise from a cold disk cache
+        runs = [measure(module) for _ in range(args.repeat)]
+        timings = min(runs, key=lambda run: run[module][1])
+        total_ms = timings[module][1] / 1000
+
+        eager = sorted({name.split(".")[0] for name in timings} & set(LAZY_MODULES))
+        over_budget = total_ms > args.budget_ms
+        failed = failed or over_budget or bool(eager)
+
+        print(f"{module}: {total_ms:.1f}ms (budget {args.budget_ms:.0f}ms)"
+              f"{' OVER BUDGET' if over_budget else ''}")
+        if eager:
+            print(f"  imported eagerly: {', '.join(eager)}")
+
+        print(f"  {'self':>8} {'cumulative':>11}  slowest imports")
+        for name, (self_us, cumulative_us) in sorted(timings.items(), key=lambda item: -item[1][0])[:args.top]:
+            print(f"  {self_us / 1000:>6.1f}ms {cumulative_us / 1000:>9.1f}ms  {name}")
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,294 @@
+"""
+Benchmark the whole pipeline offline, stage by stage.
+
+Usage:
+    python -m benchmarks.bench_pipeline [--fixtures DIR] [--copies N] [--repeat N]
+                                        [--llm-latency-ms MS] [--output FILE]
+                                        [--baseline FILE] [--tolerance RATIO]
+
+The docs pages of the fixtures directory are served from a local HTTP server, and
+OpenAI requests go to a local OpenAI-compatible endpoint replaying the canned
+responses of `llm_responses.json` after `--llm-latency-ms`. Nothing leaves the machine
+and no API key is needed. `--copies` serves each page under N paths, for larger docs.
+
+Each run starts from empty caches, in a temporary directory. The time spent in each
+stage is written as JSON. With `--baseline`, the median wall time of each stage is
+compared against a previous result and the benchmark fails if any stage is slower
+by more than `--tolerance`.
+"""
+import argparse
+import asyncio
+import functools
+import http.server
+import inspect
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+FIXTURES_PATH = os.path.join(os.path.dirname(
+    os.path.realpath(__file__)), "fixtures", "acme_notes")
+DEFAULT_GOAL = "extract all notes and notebooks from acme notes"
+DEFAULT_LLM_LATENCY_MS = 200
+DEFAULT_TOLERANCE = 0.2
+
+
+class FixtureHandler(http.server.SimpleHTTPRequestHandler):
+    # `/copy-<n>/<page>` serves `<page>`, so the fixtures can be scraped as a larger site
+    def translate_path(self, path):
+        parts = path.split("/")
+        if len(parts) > 2 and parts[1].startswith("copy-"):
+            path = "/" + "/".join(parts[2:])
+        return super().translate_path(path)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeOpenAIHandler(http.server.BaseHTTPRequestHandler):
+    responses = []
+    latency = 0.0
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        prompt = "\n".join(str(message.get("content", ""))
+                           for message in body.get("messages", []))
+
+        response = next((entry["response"] for entry in self.responses
+                         if entry["match"] in prompt), None)
+        if response is None or not self.path.endswith("/chat/completions"):
+            # Unknown prompts fail loudly rather than returning something made up
+            self.send_json(400, {"error": {"message": f"No canned response for: {prompt[:200]}",
+                                           "type": "invalid_request_error"}})
+            return
+
+        time.sleep(self.latency)
+
+        content = json.dumps(response)
+        prompt_tokens = len(prompt) // 4 + 1
+        completion_tokens = len(content) // 4 + 1
+        self.send_json(200, {
+            "id": "chatcmpl-bench",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model"),
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": content}}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens},
+        })
+
+    def send_json(self, status: int, payload: dict):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(handler) -> http.server.ThreadingHTTPServer:
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class StageTimer():
+    """
+    Records the start and end of every call of the instrumented functions by stage.
+    Calls may overlap, e.g pages preprocessed concurrently, so a stage reports both
+    the sum of its calls and the wall time they covered.
+    """
+
+    def __init__(self):
+        self.intervals = {}
+
+    def record(self, stage: str, started_at: float):
+        self.intervals.setdefault(stage, []).append(
+            (started_at, time.perf_counter()))
+
+    def instrument(self, owner, name: str, stage: str):
+        fn = getattr(owner, name)
+
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def wrapper(*args, **kwargs):
+                started_at = time.perf_counter()
+                try:
+                    return await fn(*args, **kwargs)
+                finally:
+                    self.record(stage, started_at)
+        else:
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                started_at = time.perf_counter()
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    self.record(stage, started_at)
+
+        setattr(owner, name, wrapper)
+
+    def results(self) -> dict:
+        results = {}
+        for stage, intervals in self.intervals.items():
+            wall = 0.0
+            covered_until = float("-inf")
+            for start, end in sorted(intervals):
+                wall += max(0.0, end - max(start, covered_until))
+                covered_until = max(covered_until, end)
+            results[stage] = {"calls": len(intervals),
+                              "total_s": round(sum(end - start for start, end in intervals), 6),
+                              "wall_s": round(wall, 6)}
+        return results
+
+
+def instrument_stages(timer: StageTimer):
+    # Patched where they're looked up, i.e the module calling them
+    from airbyte_connector_generator_poc import docs_parser, openapi_generator, pipeline, scraper
+    from airbyte_connector_generator_poc.airbyte import airbyte, validation
+    from airbyte_connector_generator_poc.llm import llm
+
+    timer.instrument(pipeline, "run_pipeline", "total")
+    timer.instrument(scraper, "scrape_urls", "scrape")
+    timer.instrument(openapi_generator, "extract_relevant_html",
+                     "extract_relevant_html")
+    timer.instrument(docs_parser, "build_html_tree", "build_html_tree")
+    timer.instrument(openapi_generator, "convert_html_to_markdown",
+                     "convert_html_to_markdown")
+    timer.instrument(openapi_generator, "generate_openapi_spec_from_markdown",
+                     "generate_openapi_spec")
+    timer.instrument(openapi_generator, "validate_openapi_spec_by_path",
+                     "validate_openapi_spec")
+    timer.instrument(airbyte, "generate_airbyte_connector",
+                     "generate_airbyte_connector")
+    timer.instrument(validation, "validate_airbyte_connector",
+                     "validate_airbyte_connector")
+    # Requests actually sent, cache hits excluded
+    timer.instrument(llm, "_create", "llm")
+
+
+def reset_caches(skyffel_dir: str):
+    # The LLM cache is bypassed instead, its connection stays open for the whole process
+    for item in os.listdir(skyffel_dir) if os.path.exists(skyffel_dir) else []:
+        if not item.startswith("llm_cache.sqlite"):
+            path = os.path.join(skyffel_dir, item)
+            shutil.rmtree(path) if os.path.isdir(path) else os.unlink(path)
+
+
+def compare(results: dict, baseline_path: str, tolerance: float) -> bool:
+    with open(baseline_path, "r") as file:
+        baseline_results = json.load(file)
+    baseline = baseline_results["median_wall_s"]
+
+    for key in ["pages", "llm_latency_ms"]:
+        if baseline_results.get(key) != results[key]:
+            print(f"Warning: the baseline was run with {key}={baseline_results.get(key)}, not {results[key]}")
+
+    ok = True
+    print(f"\n{'stage':<28} {'baseline':>10} {'current':>10} {'ratio':>7}")
+    for stage, seconds in results["median_wall_s"].items():
+        if stage not in baseline or baseline[stage] == 0:
+            continue
+        ratio = seconds / baseline[stage]
+        regressed = ratio > 1 + tolerance
+        ok = ok and not regressed
+        print(f"{stage:<28} {baseline[stage] * 1000:>8.1f}ms {seconds * 1000:>8.1f}ms {ratio:>6.2f}x"
+              f"{' REGRESSION' if regressed else ''}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fixtures", default=FIXTURES_PATH)
+    parser.add_argument("--goal", default=DEFAULT_GOAL)
+    parser.add_argument("--copies", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--llm-latency-ms", type=float,
+                        default=DEFAULT_LLM_LATENCY_MS)
+    parser.add_argument("--output", default="bench_pipeline.json")
+    parser.add_argument("--baseline")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    args = parser.parse_args()
+
+    fixtures = os.path.abspath(args.fixtures)
+    output_path = os.path.abspath(args.output)
+    with open(os.path.join(fixtures, "llm_responses.json"), "r") as file:
+        FakeOpenAIHandler.responses = json.load(file)["responses"]
+    FakeOpenAIHandler.latency = args.llm_latency_ms / 1000
+
+    docs_server = serve(functools.partial(FixtureHandler, directory=fixtures))
+    openai_server = serve(FakeOpenAIHandler)
+
+    pages = sorted(name for name in os.listdir(fixtures)
+                   if name.endswith(".html"))
+    docs_url = f"http://127.0.0.1:{docs_server.server_port}"
+    urls = [f"{docs_url}/copy-{copy}/{page}" if args.copies > 1 else f"{docs_url}/{page}"
+            for copy in range(args.copies) for page in pages]
+
+    # Set before the package is imported, it reads them at import time
+    os.environ["OPENAI_API_KEY"] = "sk-bench"
+    os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{openai_server.server_port}/v1"
+    os.environ["SKYFFEL_LLM_CACHE"] = "false"
+    os.environ.setdefault("SKYFFEL_DEBUG_ARTIFACTS", "none")
+    # Caches and outputs go to a scratch directory, as `.skyffel` is relative to the working directory
+    work_dir = tempfile.mkdtemp(prefix="skyffel-bench-")
+    os.chdir(work_dir)
+
+    from airbyte_connector_generator_poc import pipeline
+    from airbyte_connector_generator_poc.utils import SKYFFEL_DIR
+
+    timer = StageTimer()
+    instrument_stages(timer)
+
+    runs = []
+    try:
+        for _ in range(args.repeat):
+            reset_caches(SKYFFEL_DIR)
+            timer.intervals = {}
+            asyncio.run(pipeline.run_pipeline(args.goal, urls, output_dir=os.path.join(work_dir, "output"),
+                                              fetch_mode="http", use_cache=False))
+            runs.append(timer.results())
+    finally:
+        docs_server.shutdown()
+        openai_server.shutdown()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    stages = list(runs[0].keys())
+    results = {
+        "benchmark": "pipeline",
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "pages": len(urls),
+        "llm_latency_ms": args.llm_latency_ms,
+        "runs": runs,
+        "median_wall_s": {stage: round(statistics.median(run[stage]["wall_s"] for run in runs if stage in run), 6)
+                          for stage in stages},
+    }
+
+    with open(output_path, "w") as file:
+        json.dump(results, file, indent=2)
+
+    print(f"\n{'stage':<28} {'calls':>6} {'wall':>10} {'sum':>10}")
+    for stage in stages:
+        calls = runs[-1][stage]["calls"]
+        total = statistics.median(run[stage]["total_s"] for run in runs if stage in run)
+        print(f"{stage:<28} {calls:>6} {results['median_wall_s'][stage] * 1000:>8.1f}ms {total * 1000:>8.1f}ms")
+    print(f"\nWritten to {output_path}")
+
+    if args.baseline and not compare(results, args.baseline, args.tolerance):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
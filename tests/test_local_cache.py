@@ -0,0 +1,113 @@
+import os
+import pytest
+from airbyte_connector_generator_poc import local_cache
+from airbyte_connector_generator_poc.local_cache import LocalCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(local_cache.time, "time", clock)
+    return clock
+
+
+def totals(cache: LocalCache) -> tuple:
+    return cache.connection.execute("SELECT entries, bytes FROM totals").fetchone()
+
+
+def test_path_must_be_sqlite(tmp_path):
+    with pytest.raises(ValueError):
+        LocalCache(str(tmp_path / "cache.json"))
+
+
+def test_set_get_delete(tmp_path):
+    cache = LocalCache(str(tmp_path / "cache.sqlite"))
+    cache.set("key", {"value": 1})
+    assert cache.get("key") == {"value": 1}
+
+    cache.set("key", {"value": 2})
+    assert cache.get("key") == {"value": 2}
+
+    cache.delete("key")
+    assert cache.get("key") is None
+    assert cache.get("missing") is None
+
+
+def test_entries_are_shared_between_connections(tmp_path):
+    path = str(tmp_path / "nested" / "cache.sqlite")
+    LocalCache(path).set("key", [1, 2])
+    assert os.path.exists(path)
+    assert LocalCache(path).get("key") == [1, 2]
+
+
+def test_ttl_expires_entries(tmp_path, clock):
+    cache = LocalCache(str(tmp_path / "cache.sqlite"), ttl=60)
+    cache.set("old", 1)
+
+    clock.now += 30
+    cache.set("new", 2)
+    assert cache.get("old") == 1
+
+    clock.now += 31
+    # Expired on read...
+    assert cache.get("old") is None
+    assert cache.get("new") == 2
+
+    cache.set("other", 3)
+    clock.now += 61
+    cache.set("latest", 4)
+    # ...and on write, without being read
+    assert totals(cache) == (1, len("4"))
+
+
+def test_max_entries_evicts_least_recently_used(tmp_path, clock):
+    cache = LocalCache(str(tmp_path / "cache.sqlite"), max_entries=2)
+    cache.set("a", 1)
+    clock.now += 1
+    cache.set("b", 2)
+    clock.now += 1
+    # Reading `a` makes `b` the least recently used
+    assert cache.get("a") == 1
+    clock.now += 1
+    cache.set("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert totals(cache)[0] == 2
+
+
+def test_max_bytes_evicts_until_under_bound(tmp_path, clock):
+    cache = LocalCache(str(tmp_path / "cache.sqlite"), max_bytes=25)
+    for key in ["a", "b", "c"]:
+        cache.set(key, "x" * 8)
+        clock.now += 1
+    # 3 values of 10 bytes serialized, the oldest is evicted
+    assert cache.get("a") is None
+    assert totals(cache) == (2, 20)
+
+    cache.set("d", "x" * 18)
+    assert cache.get("b") is None
+    assert cache.get("c") is None
+    assert totals(cache) == (1, 20)
+
+
+def test_totals_follow_inserts_updates_and_deletes(tmp_path):
+    cache = LocalCache(str(tmp_path / "cache.sqlite"))
+    cache.set("a", "xx")
+    cache.set("b", "xxxx")
+    assert totals(cache) == (2, 10)
+
+    cache.set("a", "xxxxxx")
+    assert totals(cache) == (2, 14)
+
+    cache.delete("b")
+    assert totals(cache) == (1, 8)
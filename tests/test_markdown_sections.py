@@ -0,0 +1,47 @@
+from airbyte_connector_generator_poc.markdown_sections import chunk_markdown, split_markdown_sections
+from airbyte_connector_generator_poc.prompt_budget import estimate_tokens
+
+
+def test_split_sections_tracks_heading_path():
+    sections = split_markdown_sections(
+        "Intro\n# Users\n## List users\n```\n# not a heading\n```\n## Get a user\n# Posts\nText")
+
+    assert [(section["heading"], section["level"], section["path"]) for section in sections] == [
+        ("", 0, []),
+        ("Users", 1, ["Users"]),
+        ("List users", 2, ["Users", "List users"]),
+        ("Get a user", 2, ["Users", "Get a user"]),
+        ("Posts", 1, ["Posts"]),
+    ]
+    assert "# not a heading" in sections[2]["content"]
+
+
+def test_chunks_follow_headings_within_budget():
+    sections = [f"## Endpoint {i}\n" + "Some words. " * 20 for i in range(10)]
+    markdown = "\n".join(sections)
+
+    chunks = chunk_markdown(markdown, 150)
+    assert len(chunks) > 1
+    assert all(estimate_tokens(chunk) <= 150 for chunk in chunks)
+    # Sections are packed whole and in order
+    assert "\n\n".join(chunks) == "\n\n".join(section.strip() for section in sections)
+
+
+def test_oversized_section_repeats_heading_path():
+    paragraphs = ["Paragraph %d. " % i + "word " * 40 for i in range(6)]
+    markdown = "# Users\n## List users\n" + "\n\n".join(paragraphs)
+
+    chunks = chunk_markdown(markdown, 100)
+    assert len(chunks) > 1
+    assert all(estimate_tokens(chunk) <= 100 for chunk in chunks)
+    assert chunks[0].startswith("# Users")
+    for chunk in chunks[1:]:
+        assert chunk.startswith("(Users > List users)")
+    for paragraph in paragraphs:
+        assert sum(paragraph.strip() in chunk for chunk in chunks) == 1
+
+
+def test_text_without_breaks_is_split_hard():
+    chunks = chunk_markdown("x" * 1000, 50)
+    assert "".join(chunks) == "x" * 1000
+    assert all(estimate_tokens(chunk) <= 50 for chunk in chunks)
@@ -0,0 +1,81 @@
+import asyncio
+import json
+from airbyte_connector_generator_poc import openapi_spec, prompt_budget
+from airbyte_connector_generator_poc.llm import llm
+from airbyte_connector_generator_poc.prompt_budget import check_prompt
+
+
+def test_oversized_chunk_is_trimmed(monkeypatch):
+    requests = []
+
+    async def chat_completion(**params):
+        # What the client itself would reject
+        check_prompt(params)
+        requests.append(params)
+        return json.dumps({"endpoints": []})
+
+    monkeypatch.setattr(llm, "chat_completion", chat_completion)
+    monkeypatch.setattr(prompt_budget, "get_encoding", lambda model: None)
+    context_tokens = prompt_budget.MODEL_CONTEXT_TOKENS[openapi_spec.EXTRACT_DETAILS_MODEL]
+    markdown = "# Users\n" + "x" * context_tokens * 4
+
+    details = asyncio.run(openapi_spec.extract_chunk_details(markdown, "users", 0, 1))
+    assert details == {"endpoints": []}
+    assert "# Users" in requests[0]["messages"][-1]["content"]
+
+
+def test_merge_details_deduplicates_endpoints_by_method_and_path():
+    details = openapi_spec.merge_details([
+        {"endpoints": [
+            {"method": "get", "path": "/users/{id}", "description": "Get a user",
+             "query_parameters": [{"name": "expand", "type": "string"}]},
+            {"method": "GET", "path": "/users"},
+        ]},
+        {"endpoints": [
+            {"method": "GET", "path": "/Users/:user_id/", "description": "Retrieve a single user by id",
+             "query_parameters": [{"name": "Expand", "description": "Related objects"},
+                                  {"name": "fields"}]},
+            {"method": "DELETE", "path": "/users/<id>"},
+            "not an endpoint",
+        ]},
+    ])
+
+    assert [(endpoint["method"], endpoint["path"]) for endpoint in details["endpoints"]] == [
+        ("get", "/users/{id}"), ("GET", "/users"), ("DELETE", "/users/<id>")]
+    user = details["endpoints"][0]
+    # The longer description, and parameters merged by name
+    assert user["description"] == "Retrieve a single user by id"
+    assert user["query_parameters"] == [
+        {"name": "expand", "type": "string", "description": "Related objects"}, {"name": "fields"}]
+
+
+def test_merge_details_deduplicates_facts():
+    details = openapi_spec.merge_details([
+        {"authentication": ["Use a Bearer token"], "base_urls": ["https://api.example.com"], "notes": []},
+        {"authentication": ["use a  bearer token", "Tokens expire after an hour"],
+         "base_urls": ["https://api.example.com"], "pagination": ["Cursor based"]},
+        {},
+    ])
+
+    assert details == {
+        "authentication": ["Use a Bearer token", "Tokens expire after an hour"],
+        "base_urls": ["https://api.example.com"],
+        "notes": [],
+        "pagination": ["Cursor based"],
+        "endpoints": [],
+    }
+
+
+def test_extract_details_merges_chunks(monkeypatch):
+    async def chat_completion(**params):
+        content = params["messages"][-1]["content"]
+        path = "/users" if "# Users" in content else "/posts"
+        return json.dumps({"endpoints": [{"method": "GET", "path": path}], "base_urls": ["https://api.example.com"]})
+
+    monkeypatch.setattr(llm, "chat_completion", chat_completion)
+    monkeypatch.setattr(openapi_spec, "EXTRACT_DETAILS_CHUNK_TOKENS", 50)
+    markdown = "# Users\n" + "List users. " * 10 + "\n\n# Posts\n" + "List posts. " * 10
+
+    details = asyncio.run(openapi_spec.extract_details(markdown, "users and posts"))
+    assert [endpoint["path"] for endpoint in details["endpoints"]] == ["/users", "/posts"]
+    assert details["base_urls"] == ["https://api.example.com"]
@@ -0,0 +1,91 @@
+import asyncio
+import httpx
+import pytest
+from typing import Optional
+from airbyte_connector_generator_poc import page_cache as page_cache_module
+from airbyte_connector_generator_poc.page_cache import PageCache
+from airbyte_connector_generator_poc.scraper import fetch_static_url
+
+URL = "https://docs.example.com/users"
+HTML = "<html><body><main>" + "List users. " * 100 + "</main></body></html>"
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(page_cache_module.time, "time", clock)
+    return clock
+
+
+def fetch(cache: PageCache, requests: list, headers: Optional[dict] = None, fetch_mode: str = "http"):
+    headers = headers or {}
+
+    def handle(request: httpx.Request) -> httpx.Response:
+        requests.append(request)
+        if headers.get("etag") and request.headers.get("if-none-match") == headers["etag"]:
+            return httpx.Response(304)
+        return httpx.Response(200, html=HTML, headers=headers)
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handle)) as client:
+            return await fetch_static_url(client, URL, fetch_mode, cache)
+
+    return asyncio.run(run())
+
+
+def test_fresh_page_is_reused_without_request(tmp_path, clock):
+    cache = PageCache(str(tmp_path), max_age=60)
+    requests = []
+
+    assert fetch(cache, requests) == (HTML, {"etag": None, "last_modified": None})
+    clock.now += 30
+    assert fetch(cache, requests) == (HTML, {})
+    assert len(requests) == 1
+
+    # Without validators, a page past its max age is downloaded again
+    clock.now += 31
+    fetch(cache, requests)
+    assert len(requests) == 2
+    assert "if-none-match" not in requests[1].headers
+
+
+def test_stale_page_is_revalidated(tmp_path, clock):
+    cache = PageCache(str(tmp_path), max_age=60)
+    requests = []
+
+    fetch(cache, requests, headers={"etag": '"v1"'})
+    clock.now += 61
+    assert fetch(cache, requests, headers={"etag": '"v1"'}) == (HTML, {})
+    assert requests[1].headers["if-none-match"] == '"v1"'
+
+    # Revalidating makes the page fresh again
+    clock.now += 30
+    fetch(cache, requests, headers={"etag": '"v1"'})
+    assert len(requests) == 2
+
+
+def test_fresh_rendered_page_skips_browser(tmp_path, clock):
+    cache = PageCache(str(tmp_path), max_age=60)
+    cache.set(URL, HTML)
+    requests = []
+
+    assert fetch(cache, requests, fetch_mode="browser") == (HTML, {})
+    assert requests == []
+
+
+def test_no_max_age_always_revalidates(tmp_path, clock):
+    cache = PageCache(str(tmp_path), max_age=0)
+    requests = []
+
+    fetch(cache, requests, headers={"etag": '"v1"'})
+    fetch(cache, requests, headers={"etag": '"v1"'})
+    assert len(requests) == 2
+    assert cache.get(URL)["html"] == HTML
@@ -0,0 +1,103 @@
+import jsonschema
+import pytest
+from airbyte_connector_generator_poc.airbyte.pagination import DEFAULT_PAGE_SIZE, infer_paginator
+from airbyte_connector_generator_poc.airbyte.validation import load_airbyte_schema
+
+
+def query(name: str, **schema) -> dict:
+    return {"name": name, "in": "query", "schema": schema}
+
+
+def response(**properties) -> dict:
+    return {"type": "object", "properties": {"data": {"type": "array"}, **properties}}
+
+
+def assert_valid(paginator: dict):
+    schema = load_airbyte_schema()
+    jsonschema.validate(paginator, {"$schema": schema["$schema"], "$ref": "#/definitions/DefaultPaginator",
+                                    "definitions": schema["definitions"]})
+    # Not in the schema, but the CDK rejects a page size option without a page size
+    if "page_size_option" in paginator:
+        assert paginator["pagination_strategy"]["page_size"]
+
+
+def test_link_header():
+    paginator = infer_paginator([query("per_page", type="integer", maximum=100)], {},
+                                response(), {"Link": {"schema": {"type": "string"}}})
+    assert_valid(paginator)
+    assert paginator["pagination_strategy"]["cursor_value"] == "{{ headers['link']['next']['url'] }}"
+    assert paginator["page_token_option"] == {"type": "RequestPath"}
+    assert paginator["pagination_strategy"]["page_size"] == 100
+
+
+def test_cursor_with_has_more():
+    paginator = infer_paginator(
+        [query("starting_after", type="string"), query("limit", type="integer", default=10)], {},
+        response(has_more={"type": "boolean"}, next_cursor={"type": "string"}))
+    assert_valid(paginator)
+    assert paginator["pagination_strategy"]["cursor_value"] == "{{ response['next_cursor'] }}"
+    assert paginator["pagination_strategy"]["stop_condition"] == "{{ not response['has_more'] }}"
+    assert paginator["page_token_option"]["field_name"] == "starting_after"
+    assert paginator["pagination_strategy"]["page_size"] == 10
+
+
+def test_cursor_in_body_and_container():
+    paginator = infer_paginator(
+        [], {"properties": {"start_cursor": {"type": "string"}, "page_size": {"type": "integer"}}},
+        response(meta={"type": "object", "properties": {"next_cursor": {"type": "string"}}}))
+    assert_valid(paginator)
+    assert paginator["pagination_strategy"]["cursor_value"] == "{{ response['meta']['next_cursor'] }}"
+    assert paginator["page_token_option"]["inject_into"] == "body_json"
+    assert paginator["page_size_option"]["inject_into"] == "body_json"
+    assert paginator["pagination_strategy"]["page_size"] == DEFAULT_PAGE_SIZE
+
+
+def test_next_url():
+    paginator = infer_paginator([], {}, response(
+        links={"type": "object", "properties": {"next": {"type": "string"}}}))
+    assert_valid(paginator)
+    assert paginator["pagination_strategy"]["cursor_value"] == "{{ response['links']['next'] }}"
+    assert paginator["page_token_option"] == {"type": "RequestPath"}
+    assert "page_size_option" not in paginator
+
+
+def test_offset_and_limit():
+    paginator = infer_paginator(
+        [query("offset", type="integer"), query("limit", type="integer", maximum=500)], {}, response())
+    assert_valid(paginator)
+    assert paginator["pagination_strategy"] == {"type": "OffsetIncrement", "page_size": 500}
+    assert paginator["page_token_option"]["field_name"] == "offset"
+    assert paginator["page_size_option"]["field_name"] == "limit"
+
+
+def test_page():
+    paginator = infer_paginator(
+        [query("page", type="integer", minimum=0), query("per_page", type="integer")], {}, response())
+    assert_valid(paginator)
+    assert paginator["pagination_strategy"]["type"] == "PageIncrement"
+    assert paginator["pagination_strategy"]["start_from_page"] == 0
+
+
+@pytest.mark.parametrize("parameters, response_schema", [
+    ([], response()),
+    # A page size alone isn't a pattern
+    ([query("limit", type="integer")], response()),
+    # Filters named like pagination fields
+    ([query("start", type="string", format="date"), query("count", type="integer")], response()),
+    ([query("after", type="string", format="date-time")], response(cursor={"type": "string"})),
+    ([query("cursor", type="string")], response(more={"type": "boolean"}, after={"type": "string"})),
+])
+def test_unknown_pattern_is_left_to_llm(parameters, response_schema):
+    assert infer_paginator(parameters, {}, response_schema) is None
+
+
+def test_generic_page_size_needs_integer():
+    paginator = infer_paginator(
+        [query("offset", type="integer"), query("size", type="string")], {}, response())
+    assert paginator is None
+
+    paginator = infer_paginator(
+        [query("start", type="integer"), query("count", type="integer")], {}, response())
+    assert_valid(paginator)
+    assert paginator["page_token_option"]["field_name"] == "start"
+    assert paginator["page_size_option"]["field_name"] == "count"
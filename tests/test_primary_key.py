@@ -0,0 +1,99 @@
+import asyncio
+import json
+from airbyte_connector_generator_poc.airbyte.airbyte import chunk_schemas, determine_primary_keys
+from airbyte_connector_generator_poc.airbyte.primary_key import (
+    PRIMARY_KEY_CONFIDENCE_THRESHOLD, guess_primary_key)
+from airbyte_connector_generator_poc.llm import llm
+from airbyte_connector_generator_poc.prompt_budget import PromptTooLargeError
+
+
+def records(**properties) -> dict:
+    return {"type": "array", "items": {"type": "object", "properties": properties}}
+
+
+def test_id():
+    key, confidence = guess_primary_key(
+        records(id={"type": "integer"}, name={"type": "string"}))
+    assert key == ["id"]
+    assert confidence >= PRIMARY_KEY_CONFIDENCE_THRESHOLD
+
+
+def test_uuid():
+    key, confidence = guess_primary_key(
+        records(uuid={"type": "string", "format": "uuid"}, name={"type": "string"}))
+    assert key == ["uuid"]
+    assert confidence >= PRIMARY_KEY_CONFIDENCE_THRESHOLD
+
+
+def test_resource_id():
+    key, confidence = guess_primary_key(
+        records(userId={"type": "string"}, teamId={"type": "string"}), "/users_get")
+    assert key == ["userId"]
+    assert confidence >= PRIMARY_KEY_CONFIDENCE_THRESHOLD
+
+
+def test_uuid_foreign_key_is_not_trusted():
+    key, confidence = guess_primary_key(
+        records(owner_id={"type": "string", "format": "uuid"}, name={"type": "string"}))
+    assert key == ["owner_id"]
+    assert confidence < PRIMARY_KEY_CONFIDENCE_THRESHOLD
+
+
+def test_nullable_id_is_not_trusted():
+    _, confidence = guess_primary_key(
+        records(id={"type": "string", "nullable": True}))
+    assert confidence < PRIMARY_KEY_CONFIDENCE_THRESHOLD
+
+
+def test_close_runner_up_is_not_trusted():
+    key, confidence = guess_primary_key(
+        records(id={"type": "integer"}, uuid={"type": "string"}))
+    assert key == ["id"]
+    assert confidence < PRIMARY_KEY_CONFIDENCE_THRESHOLD
+
+
+def test_records_property():
+    key, _ = guess_primary_key(
+        {"data": records(id={"type": "integer"})})
+    assert key == ["id"]
+
+
+def test_no_candidate():
+    assert guess_primary_key(records(name={"type": "string"})) == (None, 0.0)
+
+
+def test_chunk_schemas():
+    schemas = {"small_0": "{}", "large": "x" * 400, "small_1": "{}", "small_2": "{}"}
+    chunks, oversized = chunk_schemas(schemas, max_tokens=20, batch_size=2)
+    assert chunks == [{"small_0": "{}", "small_1": "{}"}, {"small_2": "{}"}]
+    assert oversized == ["large"]
+
+
+def test_oversized_schema_falls_back_to_heuristic(monkeypatch):
+    async def chat_completion(**params):
+        raise PromptTooLargeError(params["model"], 1, 0)
+
+    monkeypatch.setattr(llm, "chat_completion", chat_completion)
+    schema = records(owner_id={"type": "string", "format": "uuid"},
+                     body={"type": "string", "enum": ["x" * 400_000]})
+
+    primary_keys, sources = asyncio.run(determine_primary_keys({"/posts_get": schema}))
+    assert primary_keys == {"/posts_get": ["owner_id"]}
+    assert sources == {"/posts_get": "heuristic"}
+
+
+def test_oversized_schema_is_shrunk(monkeypatch):
+    prompts = []
+
+    async def chat_completion(**params):
+        prompts.append(params["messages"][-1]["content"])
+        return json.dumps({"primary_keys": ["slug"]})
+
+    monkeypatch.setattr(llm, "chat_completion", chat_completion)
+    schema = records(slug={"type": "string"},
+                     body={"type": "object", "properties": {"text": {"type": "string", "enum": ["x" * 400_000]}}})
+
+    primary_keys, sources = asyncio.run(determine_primary_keys({"/posts_get": schema}))
+    assert primary_keys == {"/posts_get": ["slug"]}
+    assert sources == {"/posts_get": "llm"}
+    assert len(prompts) == 1 and '"slug":{"type":"string"}' in prompts[0]
@@ -0,0 +1,67 @@
+import json
+import pytest
+from airbyte_connector_generator_poc import prompt_budget
+from airbyte_connector_generator_poc.prompt_budget import (
+    DEFAULT_COMPLETION_TOKENS, PromptTooLargeError, check_prompt, fit_messages)
+
+CONTEXT_TOKENS = prompt_budget.MODEL_CONTEXT_TOKENS["gpt-3.5-turbo"]
+
+
+@pytest.fixture(autouse=True)
+def estimated_tokens(monkeypatch):
+    # 4 characters per token, whether or not tiktoken is installed
+    monkeypatch.setattr(prompt_budget, "get_encoding", lambda model: None)
+    monkeypatch.setattr(prompt_budget, "MAX_PROMPT_TOKENS", None)
+
+
+def request(tokens: int, **params) -> dict:
+    return {"model": "gpt-3.5-turbo", "messages": [{"role": "user", "content": "x" * tokens * 4}], **params}
+
+
+def test_prompt_within_context_window():
+    # Over the budget left after reserving a completion, but the API accepts it
+    check_prompt(request(CONTEXT_TOKENS - DEFAULT_COMPLETION_TOKENS + 1000))
+
+
+def test_prompt_over_context_window():
+    with pytest.raises(PromptTooLargeError):
+        check_prompt(request(CONTEXT_TOKENS))
+
+
+def test_prompt_over_context_window_less_max_tokens():
+    with pytest.raises(PromptTooLargeError):
+        check_prompt(request(CONTEXT_TOKENS - 1000, max_tokens=2000))
+
+
+def test_fit_messages_leaves_room_for_completion():
+    def render(max_chars):
+        docs = "x" * CONTEXT_TOKENS * 4
+        return [{"role": "system", "content": "Find the paginator"},
+                {"role": "user", "content": docs if max_chars is None else docs[:max_chars]}]
+
+    messages = fit_messages("gpt-3.5-turbo", render)
+    tokens = prompt_budget.count_message_tokens(messages, "gpt-3.5-turbo")
+    assert tokens <= CONTEXT_TOKENS - DEFAULT_COMPLETION_TOKENS
+    check_prompt({"model": "gpt-3.5-turbo", "messages": messages})
+
+
+def test_shrink_json_keeps_top_levels():
+    schema = {"type": "object", "properties": {
+        "id": {"type": "string"},
+        "owner": {"type": "object", "properties": {"name": {"type": "string", "enum": ["a" * 1000]}}}}}
+    shrunk = prompt_budget.shrink_json(schema, 200)
+    assert len(shrunk) <= 200
+    assert '"id":{"type":"string"}' in shrunk
+    assert "aaaa" not in shrunk
+
+
+def test_shrink_json_placeholders_are_valid_json():
+    wide = {f"field_{i}": {"type": "string"} for i in range(100)}
+    shrunk = prompt_budget.shrink_json(wide, 40)
+    assert len(shrunk) <= 40
+    assert json.loads(shrunk) == ["field_0", "field_1", "field_10"]
+
+    assert prompt_budget.shrink_json({"a" * 100: 1}, 10) == "{}"
+    assert prompt_budget.shrink_json(["x" * 100], 10) == "[]"
+    assert prompt_budget.shrink_json("x" * 100, 10) == '""'
+    assert prompt_budget.shrink_json({"a": 1}, 100) == '{"a":1}'
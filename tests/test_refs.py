@@ -0,0 +1,91 @@
+import io
+import yaml
+from airbyte_connector_generator_poc.airbyte import refs
+from airbyte_connector_generator_poc.airbyte.refs import RefResolver, resolve_json_pointer
+from airbyte_connector_generator_poc.utils import dump_yaml
+
+
+def test_pointer_escapes():
+    document = {"paths": {"/users/{id}": {"get": 1}}, "a~b": 2}
+    assert resolve_json_pointer(document, "#/paths/~1users~1{id}/get") == 1
+    assert resolve_json_pointer(document, "#/a~0b") == 2
+    assert resolve_json_pointer(document, "#/paths/%7E1users%7E1%7Bid%7D/get") == 1
+
+
+def test_pointer_array_indexes():
+    document = {"parameters": [{"name": "page"}, {"name": "limit"}]}
+    assert resolve_json_pointer(document, "#/parameters/1/name") == "limit"
+    assert resolve_json_pointer(document, "#/parameters/2") is None
+    assert resolve_json_pointer(document, "#/parameters/first") is None
+
+
+def test_pointer_root_and_missing():
+    document = {"a": {"b": 1}}
+    assert resolve_json_pointer(document, "#") is document
+    assert resolve_json_pointer(document, "#/a/c") is None
+
+
+def test_circular_ref_is_stubbed():
+    document = {"Node": {"type": "object", "properties": {
+        "children": {"type": "array", "items": {"$ref": "#/Node"}}}}}
+    node = RefResolver(document).resolve({"$ref": "#/Node"})
+    stub = node["properties"]["children"]["items"]
+    assert stub["type"] == "object"
+    assert stub["description"] == "Circular reference to #/Node"
+
+
+def test_expansion_is_memoized_with_first_stub():
+    document = {
+        "A": {"type": "object", "properties": {"b": {"$ref": "#/B"}}},
+        "B": {"type": "object", "properties": {"a": {"$ref": "#/A"}}},
+    }
+    resolver = RefResolver(document)
+    a = resolver.resolve({"$ref": "#/A"})
+    b = resolver.resolve({"$ref": "#/B"})
+    assert b is a["properties"]["b"]
+    assert b["properties"]["a"]["description"] == "Circular reference to #/A"
+
+
+def test_cross_linked_components():
+    # Every component references every other, expanded once each rather than once per path
+    names = [f"C{i}" for i in range(30)]
+    document = {"components": {"schemas": {name: {"type": "object", "properties": {
+        other.lower(): {"$ref": f"#/components/schemas/{other}"} for other in names if other != name}}
+        for name in names}}}
+    resolver = RefResolver(document)
+    resolved = resolver.resolve(
+        {name: {"$ref": f"#/components/schemas/{name}"} for name in names})
+    assert len(resolver._memo) == len(names)
+    assert resolved["C1"] is resolved["C0"]["properties"]["c1"]
+
+
+def test_deeply_nested_expansion_is_not_reused(monkeypatch):
+    monkeypatch.setattr(refs, "MAX_REF_DEPTH", 2)
+    document = {
+        "A": {"$ref": "#/B"},
+        "B": {"$ref": "#/C"},
+        "C": {"type": "string"},
+    }
+    resolver = RefResolver(document)
+    assert resolver.resolve({"$ref": "#/A"})["description"] == "Too deeply nested reference to #/C"
+    assert resolver.resolve({"$ref": "#/C"}) == {"type": "string"}
+
+
+def test_expansions_are_dumped_without_anchors():
+    document = {"User": {"type": "object", "properties": {"id": {"type": "string"}}}}
+    spec = RefResolver(document).resolve(
+        {"first": {"$ref": "#/User"}, "second": {"$ref": "#/User"}})
+    assert spec["first"] is spec["second"]
+
+    file = io.StringIO()
+    dump_yaml(spec, file)
+    assert "&id" not in file.getvalue()
+    assert yaml.safe_load(file.getvalue()) == spec
+
+
+def test_ref_with_siblings():
+    document = {"Base": {"type": "object", "properties": {"id": {"type": "string"}}}}
+    resolved = RefResolver(document).resolve(
+        {"$ref": "#/Base", "description": "A user"})
+    assert resolved == {"type": "object", "properties": {"id": {"type": "string"}},
+                        "description": "A user"}
@@ -0,0 +1,64 @@
+from airbyte_connector_generator_poc.prompt_budget import estimate_tokens
+from airbyte_connector_generator_poc.relevance import bm25_scores, select_relevant_markdown, tokenize
+
+DOCS = """# Example API
+Welcome to the docs.
+
+## Authentication
+Send your API key in the `Authorization` header.
+
+## Users
+### List users
+GET /users returns all users.
+
+### Get a user
+GET /users/{id} returns a single user.
+
+## Invoices
+GET /invoices returns invoices, with their line items and totals.
+
+## Webhooks
+Subscribe to events with a webhook endpoint.
+
+## Pagination
+Pass the `cursor` of the last page.
+"""
+
+
+def headings(markdown: str) -> list[str]:
+    return [line for line in markdown.splitlines() if line.startswith("#")]
+
+
+def test_tokenize_stems_and_drops_stopwords():
+    assert tokenize("Extract all the Entries and Posts from the API") == ["entry", "post"]
+
+
+def test_bm25_ranks_matching_documents():
+    scores = bm25_scores(["invoice"], [["user", "list"], ["invoice", "total"], ["invoice"] + ["other"] * 20])
+    assert scores[0] == 0
+    assert scores[1] > scores[2] > 0
+    assert bm25_scores(["invoice"], []) == []
+
+
+def test_keeps_relevant_and_always_kept_sections_in_order():
+    selected = select_relevant_markdown(DOCS, "extract all invoices", top_k=1)
+    assert headings(selected) == ["## Authentication", "## Invoices", "## Pagination"]
+
+
+def test_nested_sections_inherit_headings():
+    # `### Get a user` doesn't mention users listing, but is under `## Users`
+    selected = select_relevant_markdown(DOCS, "users", top_k=3, always_kept_pattern=None)
+    assert headings(selected) == ["## Users", "### List users", "### Get a user"]
+
+
+def test_no_match_keeps_sections_in_order():
+    selected = select_relevant_markdown(DOCS, "shipments", always_kept_pattern=None)
+    assert headings(selected) == headings(DOCS)
+
+
+def test_max_tokens_bounds_selection():
+    long_docs = DOCS + "\n## Invoice exports\n" + "GET /invoices/export " * 200
+    selected = select_relevant_markdown(long_docs, "invoices", max_tokens=100)
+    assert estimate_tokens(selected) <= 100
+    # The always kept sections come first, the export section doesn't fit
+    assert headings(selected) == ["## Authentication", "## Invoices", "## Pagination"]
@@ -0,0 +1,32 @@
+import pytest
+from airbyte_connector_generator_poc import utils
+
+
+@pytest.fixture
+def debug_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(utils, "DEBUG_ARTIFACT_LEVEL", utils.DEBUG_ARTIFACT_LEVEL)
+    token = utils.debug_dir.set(str(tmp_path))
+    yield tmp_path
+    utils.debug_dir.reset(token)
+
+
+def test_debug_artifact_level_overrides_env(monkeypatch):
+    monkeypatch.setenv("SKYFFEL_DEBUG_ARTIFACTS", "full")
+    assert utils.resolve_debug_artifact_level() == "full"
+    assert utils.resolve_debug_artifact_level("None") == "none"
+    with pytest.raises(ValueError):
+        utils.resolve_debug_artifact_level("verbose")
+
+
+def test_debug_files_follow_level(debug_dir):
+    utils.set_debug_artifact_level("summary")
+    utils.write_debug_file("report.txt", "report", level="none")
+    utils.write_debug_file("prompt.txt", "prompt")
+    utils.write_debug_file("page.html", lambda: pytest.fail("built below its level"), level="full")
+    utils.debug_file_writer.flush()
+    assert sorted(path.name for path in debug_dir.iterdir()) == ["prompt.txt", "report.txt"]
+
+    utils.set_debug_artifact_level("none")
+    utils.write_debug_file("other_prompt.txt", "prompt")
+    utils.debug_file_writer.flush()
+    assert not (debug_dir / "other_prompt.txt").exists()